@@ -6,14 +6,22 @@ import random
 import re
 import ssl
 import sys
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
 from typing import Dict, List, Optional, Tuple
-from urllib.parse import quote
+from urllib.parse import quote, urlsplit
+from uuid import uuid4
 
 # Third party imports
-import aiodns
 from alive_progress import alive_bar
 from aiohttp import ClientSession, TCPConnector, http_exceptions
-from aiohttp.client_exceptions import ClientConnectorError, ServerDisconnectedError
+from aiohttp.client_exceptions import (
+    ClientConnectorError,
+    ClientOSError,
+    ServerDisconnectedError,
+)
 from python_socks import _errors as proxy_errors
 from socid_extractor import extract
 
@@ -23,10 +31,28 @@ except ImportError:
     from unittest.mock import Mock
 
 # Local imports
-from . import errors
+from . import errors, metrics
 from .activation import ParsingActivator, import_aiohttp_cookies
 from .errors import CheckError
-from .executors import AsyncioQueueGeneratorExecutor
+from .executors import (
+    AdaptiveConcurrencyLimiter,
+    AsyncioQueueGeneratorExecutor,
+    RetryPolicy,
+    merge_runs,
+)
+from .latency import AdaptiveTimeouts
+from .notify import PROGRESS_REFRESH_SECS
+from .profiler import count, stage
+from .resolver import DnsResolver
+from .transfer import (
+    ACCEPT_ENCODING,
+    IDENTITY_ENCODING,
+    Body,
+    DecodingError,
+    ResponseBody,
+    TransferStats,
+    decode_content,
+)
 from .result import MaigretCheckResult, MaigretCheckStatus
 from .sites import MaigretDatabase, MaigretSite
 from .types import QueryOptions, QueryResultWrapper
@@ -47,6 +73,44 @@ SUPPORTED_IDS = (
 
 BAD_CHARS = "#"
 
+# lower bound of adaptive connections, the same as in settings.json
+MIN_CONNECTIONS = 5
+
+# retries of one scan are limited to this share of its checks times `retries`
+RETRY_BUDGET_RATIO = 0.3
+RETRY_BUDGET_MIN = 10
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse Retry-After header: delay in seconds or HTTP date"""
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+
+
+def make_throttling_error(status_code, retry_after_header) -> Optional[CheckError]:
+    retry_after = parse_retry_after(retry_after_header)
+    if status_code == 429:
+        return CheckError(
+            "Too many requests", "429 status code", retry_after=retry_after
+        )
+    # 503 is a throttling signal only with explicit Retry-After
+    if retry_after is not None:
+        return CheckError("Server", "503 status code", retry_after=retry_after)
+    return None
+
 
 class CheckerBase:
     pass
@@ -57,6 +121,9 @@ class SimpleAiohttpChecker(CheckerBase):
         self.proxy = kwargs.get('proxy')
         self.cookie_jar = kwargs.get('cookie_jar')
         self.logger = kwargs.get('logger', Mock())
+        # external long-living session, e.g. of the scan service
+        self.session = kwargs.get('session')
+        self.transfer: TransferStats = kwargs.get('transfer') or TransferStats()
         self.url = None
         self.headers = None
         self.allow_redirects = True
@@ -76,7 +143,9 @@ class SimpleAiohttpChecker(CheckerBase):
 
     async def _make_request(
         self, session, url, headers, allow_redirects, timeout, method, logger
-    ) -> Tuple[str, int, Optional[CheckError]]:
+    ) -> Tuple[Optional[Body], int, Optional[CheckError]]:
+        if self.transfer.accept_encoding(url) == IDENTITY_ENCODING:
+            headers = {**(headers or {}), "Accept-Encoding": IDENTITY_ENCODING}
         try:
             request_method = session.get if method == 'get' else session.head
             async with request_method(
@@ -84,16 +153,35 @@ class SimpleAiohttpChecker(CheckerBase):
                 headers=headers,
                 allow_redirects=allow_redirects,
                 timeout=timeout,
+                # bodies are decoded here to count their sizes on the wire
+                auto_decompress=False,
             ) as response:
                 status_code = response.status
-                response_content = await response.content.read()
-                charset = response.charset or "utf-8"
-                decoded_content = response_content.decode(charset, "ignore")
+                wire_content = await response.content.read()
+                try:
+                    response_content = decode_content(
+                        wire_content, response.headers.get("Content-Encoding", "")
+                    )
+                except DecodingError as e:
+                    self.transfer.disable_compression(url)
+                    logger.warning(f"{e} from {url}, compression is disabled")
+                    return None, 0, CheckError("Bad encoding", str(e))
+                self.transfer.add(url, len(wire_content), len(response_content))
+                metrics.response_received(len(response_content), len(wire_content))
+                # matched as bytes, decoded only if needed
+                body = ResponseBody(
+                    response_content, response.charset or "utf-8", response.headers
+                )
 
                 error = CheckError("Connection lost") if status_code == 0 else None
-                logger.debug(decoded_content)
+                if status_code in (429, 503):
+                    error = make_throttling_error(
+                        status_code, response.headers.get("Retry-After")
+                    )
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(body.text)
 
-                return decoded_content, status_code, error
+                return body, status_code, error
 
         except asyncio.TimeoutError as e:
             return None, 0, CheckError("Request timeout", str(e))
@@ -105,6 +193,9 @@ class SimpleAiohttpChecker(CheckerBase):
             return None, 0, CheckError("HTTP", str(e))
         except proxy_errors.ProxyError as e:
             return None, 0, CheckError("Proxy", str(e))
+        except (ConnectionError, ClientOSError) as e:
+            # e.g. reset by a proxy in the middle of its handshake
+            return None, 0, CheckError("Connection lost", str(e))
         except KeyboardInterrupt:
             return None, 0, CheckError("Interrupted")
         except Exception as e:
@@ -117,7 +208,19 @@ class SimpleAiohttpChecker(CheckerBase):
                 logger.debug(e, exc_info=True)
                 return None, 0, CheckError("Unexpected", str(e))
 
-    async def check(self) -> Tuple[str, int, Optional[CheckError]]:
+    async def check(self) -> Tuple[Body, int, Optional[CheckError]]:
+        if self.session:
+            html_text, status_code, error = await self._make_request(
+                self.session,
+                self.url,
+                self.headers,
+                self.allow_redirects,
+                self.timeout,
+                self.method,
+                self.logger,
+            )
+            return html_text or '', status_code, error
+
         from aiohttp_socks import ProxyConnector
 
         connector = (
@@ -146,7 +249,7 @@ class SimpleAiohttpChecker(CheckerBase):
             if error and str(error) == "Invalid proxy response":
                 self.logger.debug(error, exc_info=True)
 
-            return str(html_text) if html_text else '', status_code, error
+            return html_text or '', status_code, error
 
 
 class ProxiedAiohttpChecker(SimpleAiohttpChecker):
@@ -154,37 +257,345 @@ class ProxiedAiohttpChecker(SimpleAiohttpChecker):
         self.proxy = kwargs.get('proxy')
         self.cookie_jar = kwargs.get('cookie_jar')
         self.logger = kwargs.get('logger', Mock())
+        self.session = None
+        self.transfer: TransferStats = kwargs.get('transfer') or TransferStats()
+
+
+# errors of a proxy itself, not of a checked site
+PROXY_ERRORS_TYPES = (
+    'Proxy',
+    'Connecting failure',
+    'Request timeout',
+    'Server disconnected',
+    'Connection lost',
+)
+# signs that a site blocks requests of a proxy
+BLOCK_ERRORS_TYPES = (
+    'Too many requests',
+    'Captcha',
+    'Bot protection',
+    'Access denied',
+    'Request blocked',
+)
+# smoothing factor of proxy latency and error rates
+PROXY_EWMA_ALPHA = 0.2
+PROXY_DEFAULT_LATENCY = 1.0
+PROXY_MIN_SCORE = 0.01
+# a proxy is ejected after so many failures in a row...
+PROXY_EJECT_FAILURES = 5
+# ...or with such a share of errors or blocks after enough requests
+PROXY_EJECT_RATE = 0.5
+PROXY_EJECT_MIN_REQUESTS = 10
+# seconds, doubled on every next ejection of the proxy
+PROXY_EJECT_COOLDOWN = 30
+PROXY_MAX_EJECT_COOLDOWN = 600
+# isolated Tor circuits of a scan and concurrent streams over each one
+TOR_CIRCUITS = 4
+TOR_MAX_PER_CIRCUIT = 8
+
+
+def load_proxy_list(filename: str) -> List[str]:
+    """Proxies URLs, one per line, # for comments"""
+    with open(filename, encoding='utf-8') as f:
+        lines = [line.split('#', 1)[0].strip() for line in f]
+    return [line for line in lines if line]
+
+
+class ProxyState:
+    """Connections and health of one proxy of a pool"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.session: Optional[ClientSession] = None
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.block_rate = 0.0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    @property
+    def score(self) -> float:
+        """Health of the proxy, share of requests it gets"""
+        latency = PROXY_DEFAULT_LATENCY if self.latency is None else self.latency
+        health = (1 - self.error_rate) * (1 - self.block_rate) / (1 + latency)
+        return max(PROXY_MIN_SCORE, health)
+
+    def record(self, latency: float, failed: bool, blocked: bool):
+        self.requests += 1
+        self.failures = self.failures + 1 if failed else 0
+        a = PROXY_EWMA_ALPHA
+        self.error_rate = (1 - a) * self.error_rate + a * failed
+        self.block_rate = (1 - a) * self.block_rate + a * blocked
+        if not failed:
+            self.latency = (
+                latency
+                if self.latency is None
+                else (1 - a) * self.latency + a * latency
+            )
+
+    def is_unhealthy(self) -> bool:
+        if self.failures >= PROXY_EJECT_FAILURES:
+            return True
+        return self.requests >= PROXY_EJECT_MIN_REQUESTS and (
+            self.error_rate > PROXY_EJECT_RATE or self.block_rate > PROXY_EJECT_RATE
+        )
+
+    def json(self) -> Dict:
+        return {
+            'url': self.url,
+            'score': round(self.score, 3),
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'latency': self.latency and round(self.latency, 3),
+            'error_rate': round(self.error_rate, 3),
+            'block_rate': round(self.block_rate, 3),
+            'ejected': self.ejected_until > time.monotonic(),
+        }
+
+
+class ProxyPool:
+    """
+    Egress over several proxies, each with its own keep-alive session and
+    concurrency cap.
+
+    Requests go to proxies at random weighted by their health score (from
+    latency, errors and block detections). Unhealthy proxies are ejected for
+    a cooldown, which grows with every ejection, and re-admitted with
+    a half of their bad record forgiven. The pool may be shared by scans.
+    """
+
+    def __init__(self, proxies: List[str], logger=None, **kwargs):
+        if not proxies:
+            raise ValueError('Proxy pool needs at least one proxy')
+        self.proxies = [ProxyState(url) for url in dict.fromkeys(proxies)]
+        self.logger = logger or Mock()
+        self.cookie_jar = kwargs.get('cookie_jar')
+        self.max_per_proxy = kwargs.get('max_per_proxy', 20)
+        self._released = asyncio.Condition()
+
+    def _readmit(self, now: float):
+        for proxy in self.proxies:
+            if proxy.ejected_until and proxy.ejected_until <= now:
+                proxy.ejected_until = 0.0
+                proxy.failures = 0
+                proxy.error_rate /= 2
+                proxy.block_rate /= 2
+                self.logger.info(f'Proxy {proxy.url} is re-admitted')
+
+    def _eject(self, proxy: ProxyState):
+        proxy.ejections += 1
+        cooldown = min(
+            PROXY_MAX_EJECT_COOLDOWN,
+            PROXY_EJECT_COOLDOWN * 2 ** (proxy.ejections - 1),
+        )
+        proxy.ejected_until = time.monotonic() + cooldown
+        self.logger.warning(
+            f'Proxy {proxy.url} is ejected for {cooldown}s: '
+            f'{round(proxy.error_rate * 100)}% errors, '
+            f'{round(proxy.block_rate * 100)}% blocks'
+        )
+
+    def choose(self) -> Optional[ProxyState]:
+        """Proxy for the next request, None if all of them are busy"""
+        now = time.monotonic()
+        self._readmit(now)
+        admitted = [p for p in self.proxies if not p.ejected_until]
+        if not admitted:
+            # better a bad proxy than none
+            admitted = [min(self.proxies, key=lambda p: p.ejected_until)]
+        free = [p for p in admitted if p.in_flight < self.max_per_proxy]
+        if not free:
+            return None
+        return random.choices(free, weights=[p.score for p in free])[0]
+
+    async def acquire(self) -> ProxyState:
+        async with self._released:
+            proxy = self.choose()
+            while proxy is None:
+                await self._released.wait()
+                proxy = self.choose()
+            proxy.in_flight += 1
+        if proxy.session is None:
+            from aiohttp_socks import ProxyConnector
+
+            connector = ProxyConnector.from_url(
+                proxy.url, ssl=False, limit=self.max_per_proxy
+            )
+            proxy.session = ClientSession(
+                connector=connector, trust_env=True, cookie_jar=self.cookie_jar
+            )
+        return proxy
+
+    async def release(
+        self,
+        proxy: ProxyState,
+        latency: float,
+        response: Tuple[str, int, Optional[CheckError]],
+    ):
+        html_text, status_code, error = response
+        if error is None and html_text:
+            error = errors.detect(html_text)
+        error_type = error.type if error else None
+        failed = error_type in PROXY_ERRORS_TYPES
+        blocked = error_type in BLOCK_ERRORS_TYPES or status_code in (403, 429)
+        proxy.record(latency, failed, blocked)
+        if not proxy.ejected_until and proxy.is_unhealthy():
+            self._eject(proxy)
+
+        async with self._released:
+            proxy.in_flight -= 1
+            self._released.notify()
+
+    def stats(self) -> List[Dict]:
+        return [p.json() for p in self.proxies]
+
+    async def close(self):
+        for proxy in self.proxies:
+            if proxy.session:
+                await proxy.session.close()
+                proxy.session = None
+
+
+def isolated_proxy_url(proxy_url: str, username: str) -> str:
+    """SOCKS proxy URL with the given auth username"""
+    parts = urlsplit(proxy_url)
+    host = f'[{parts.hostname}]' if ':' in (parts.hostname or '') else parts.hostname
+    netloc = f'{username}:maigret@{host}' + (f':{parts.port}' if parts.port else '')
+    return parts._replace(netloc=netloc).geturl()
+
+
+class TorCircuitPool(ProxyPool):
+    """
+    Keep-alive connections over several isolated Tor circuits.
+
+    Tor sends streams with different SOCKS credentials over different
+    circuits (IsolateSOCKSAuth, enabled by default), so every circuit is
+    a proxy of the pool with its own auth username. A circuit which is
+    slow, failing or blocked by sites is replaced with a new one at once
+    instead of a cooldown.
+    """
+
+    def __init__(
+        self,
+        tor_proxy: str,
+        circuits: int = TOR_CIRCUITS,
+        logger=None,
+        cookie_jar=None,
+        max_per_circuit: int = TOR_MAX_PER_CIRCUIT,
+    ):
+        self.tor_proxy = tor_proxy
+        self.prefix = f'maigret-{uuid4().hex[:8]}'
+        self.circuits_made = 0
+        super().__init__(
+            [self._new_circuit_url() for _ in range(max(1, circuits))],
+            logger,
+            cookie_jar=cookie_jar,
+            max_per_proxy=max_per_circuit,
+        )
+
+    def _new_circuit_url(self) -> str:
+        self.circuits_made += 1
+        return isolated_proxy_url(self.tor_proxy, f'{self.prefix}-{self.circuits_made}')
+
+    def _eject(self, proxy: ProxyState):
+        if proxy not in self.proxies:
+            return
+        circuit = ProxyState(self._new_circuit_url())
+        self.proxies[self.proxies.index(proxy)] = circuit
+        self.logger.info(
+            f'Tor circuit {proxy.url} is replaced with {circuit.url}: '
+            f'{round(proxy.error_rate * 100)}% errors, '
+            f'{round(proxy.block_rate * 100)}% blocks'
+        )
+
+    async def release(self, proxy: ProxyState, latency: float, response):
+        await super().release(proxy, latency, response)
+        # connections of a replaced circuit are closed after its last stream
+        if proxy not in self.proxies and not proxy.in_flight and proxy.session:
+            await proxy.session.close()
+            proxy.session = None
+
+
+class ProxyPoolChecker(SimpleAiohttpChecker):
+    """Checker sending requests over proxies of a pool"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool: ProxyPool = kwargs['pool']
+        # the pool balances load itself, there is no single proxy to limit
+        self.proxy = None
+        # the pool passed from outside lives longer than a scan
+        self.owns_pool = kwargs.get('owns_pool', False)
+
+    async def check(self) -> Tuple[Body, int, Optional[CheckError]]:
+        # the checker is shared by all checks, the request is taken before awaiting
+        request = (
+            self.url,
+            self.headers,
+            self.allow_redirects,
+            self.timeout,
+            self.method,
+        )
+        proxy = await self.pool.acquire()
+        started_at = time.monotonic()
+        response = (None, 0, CheckError('Interrupted'))
+        try:
+            response = await self._make_request(proxy.session, *request, self.logger)
+        finally:
+            await self.pool.release(proxy, time.monotonic() - started_at, response)
+
+        html_text, status_code, error = response
+        return html_text or '', status_code, error
+
+    async def close(self):
+        if self.owns_pool:
+            await self.pool.close()
+
+
+def make_proxied_checker(checker_class, proxy, **kwargs):
+    """Checker for a proxy URL, a list of them or a ProxyPool"""
+    if isinstance(proxy, ProxyPool):
+        return ProxyPoolChecker(pool=proxy, **kwargs)
+    if isinstance(proxy, (list, tuple)):
+        if len(proxy) > 1:
+            pool = ProxyPool(
+                proxy, logger=kwargs.get('logger'), cookie_jar=kwargs.get('cookie_jar')
+            )
+            return ProxyPoolChecker(pool=pool, owns_pool=True, **kwargs)
+        proxy = proxy[0] if proxy else None
+    return checker_class(proxy=proxy, **kwargs)
 
 
 class AiodnsDomainResolver(CheckerBase):
+    """Checker of domains existence over a (shared) DnsResolver"""
+
     if sys.platform == 'win32':  # Temporary workaround for Windows
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
     def __init__(self, *args, **kwargs):
-        loop = asyncio.get_event_loop()
         self.logger = kwargs.get('logger', Mock())
-        self.resolver = aiodns.DNSResolver(loop=loop)
+        resolver = kwargs.get('resolver')
+        self.resolver: DnsResolver = resolver or DnsResolver(logger=self.logger)
+        # the resolver passed from outside lives longer than a scan
+        self.owns_resolver = kwargs.get('owns_resolver', resolver is None)
+        self.url = None
 
     def prepare(self, url, headers=None, allow_redirects=True, timeout=0, method='get'):
         self.url = url
         return None
 
     async def check(self) -> Tuple[str, int, Optional[CheckError]]:
-        status = 404
-        error = None
-        text = ''
+        answer = await self.resolver.resolve(self.url)
+        if answer.found:
+            return answer.address, 200, None
+        return '', 404, answer.error
 
-        try:
-            res = await self.resolver.query(self.url, 'A')
-            text = str(res[0].host)
-            status = 200
-        except aiodns.error.DNSError:
-            pass
-        except Exception as e:
-            self.logger.error(e, exc_info=True)
-            error = CheckError('DNS resolve error', str(e))
-
-        return text, status, error
+    async def close(self):
+        if self.owns_resolver:
+            await self.resolver.close()
 
 
 class CheckerMock:
@@ -235,7 +646,12 @@ def debug_response_logging(url, html_text, status_code, check_error):
 
 
 def process_site_result(
-    response, query_notify, logger, results_info: QueryResultWrapper, site: MaigretSite
+    response,
+    query_notify,
+    logger,
+    results_info: QueryResultWrapper,
+    site: MaigretSite,
+    response_time=None,
 ):
     if not response:
         return results_info
@@ -263,9 +679,6 @@ def process_site_result(
 
     html_text, status_code, check_error = response
 
-    # TODO: add elapsed request time counting
-    response_time = None
-
     if logger.level == logging.DEBUG:
         debug_response_logging(url, html_text, status_code, check_error)
 
@@ -287,6 +700,8 @@ def process_site_result(
             activate_fun = getattr(ParsingActivator(), method)
             # TODO: async call
             activate_fun(site, logger)
+            if results_info.get("plan"):
+                results_info["plan"].update_headers()
         except AttributeError as e:
             logger.warning(
                 f"Activation method {method} for site {site.name} not found!",
@@ -374,7 +789,8 @@ def process_site_result(
     extracted_ids_data = {}
 
     if is_parsing_enabled and result.status == MaigretCheckStatus.CLAIMED:
-        extracted_ids_data = extract_ids_data(html_text, logger, site)
+        with stage('extraction'):
+            extracted_ids_data = extract_ids_data(str(html_text), logger, site)
         if extracted_ids_data:
             new_usernames = parse_usernames(extracted_ids_data, logger)
             results_info = update_results_info(
@@ -393,69 +809,174 @@ def process_site_result(
     return results_info
 
 
+# placeholder of a username in the split URL templates
+USERNAME_MARK = '\0'
+SLASHES_RE = re.compile("(?<!:)/+")
+# the same usernames are quoted for every site of a scan
+quote_username = lru_cache(maxsize=1024)(quote)
+
+
+class SitePlan:
+    """
+    Request parts of a site check which don't depend on a username.
+
+    Compiled once per site (and mirror) in a scan and shared by searches of
+    all its usernames, so building a request for every username is a fill
+    of the pre-split URL templates. Headers of the
+    site may be changed by activation, then `update_headers()` is called.
+    """
+
+    __slots__ = (
+        'site',
+        'url_main',
+        'url_parts',
+        'clean_url_parts',
+        'probe_parts',
+        'probe_suffix',
+        'regex',
+        'headers',
+        'keep_alive',
+        'cookies',
+        'method',
+        'allow_redirects',
+        'illegal_error',
+    )
+
+    def __init__(self, site: MaigretSite, url_main: str, options: QueryOptions, logger):
+        self.site = site
+        self.url_main = url_main
+        self.keep_alive = options.get("keep_alive")
+        self.cookies = (
+            options.get("cookie_jar")
+            and options["cookie_jar"].filter_cookies(url_main)
+            or None
+        )
+        self.update_headers()
+
+        if "url" not in site.__dict__:
+            logger.error("No URL for site %s", site.name)
+
+        self.url_parts = site.url.format(
+            urlMain=url_main, urlSubpath=site.url_subpath, username=USERNAME_MARK
+        ).split(USERNAME_MARK)
+        # workaround to prevent slash errors
+        self.clean_url_parts = [SLASHES_RE.sub("/", part) for part in self.url_parts]
+
+        self.probe_parts = None
+        if site.url_probe is not None:
+            self.probe_parts = site.url_probe.format(
+                urlMain=url_main, urlSubpath=site.url_subpath, username=USERNAME_MARK
+            ).split(USERNAME_MARK)
+        self.probe_suffix = ''.join(f"&{k}={v}" for k, v in site.get_params.items())
+
+        self.regex = re.compile(site.regex_check) if site.regex_check else None
+
+        if site.check_type == "status_code" and site.request_head_only:
+            # In most cases when we are detecting by status code,
+            # it is not necessary to get the entire body:  we can
+            # detect fine with just the HEAD response.
+            self.method = 'head'
+        else:
+            # Either this detect method needs the content associated
+            # with the GET response, or this specific website will
+            # not respond properly unless we request the whole page.
+            self.method = 'get'
+
+        # Site forwards request to a different URL if username not found.
+        # Disallow the redirect so we can capture the http status from the
+        # original URL request, otherwise allow whatever redirect that the
+        # site wants to do.
+        self.allow_redirects = site.check_type != "response_url"
+
+        self.illegal_error = None
+        if site.disabled and not options['forced']:
+            logger.debug(f"Site {site.name} is disabled, skipping...")
+            self.illegal_error = CheckError("Check is disabled")
+        elif site.type != options["id_type"]:
+            self.illegal_error = CheckError(
+                'Unsupported identifier type', f'Want "{site.type}"'
+            )
+
+    def update_headers(self):
+        headers = {"Accept-Encoding": ACCEPT_ENCODING}
+        if not self.keep_alive:
+            # tell server that we want to close connection after request
+            headers["Connection"] = "close"
+        headers.update(self.site.headers)
+        self.headers = headers
+
+    def make_headers(self) -> Dict[str, str]:
+        return {"User-Agent": get_random_user_agent(), **self.headers}
+
+    def make_url(self, username: str) -> str:
+        """URL of user on site (if it exists)"""
+        quoted = quote_username(username)
+        if not quoted or '/' in quoted:
+            # slashes of the username may be merged with the template ones
+            return SLASHES_RE.sub("/", quoted.join(self.url_parts))
+        return quoted.join(self.clean_url_parts)
+
+    def make_probe_url(self, username: str, url: str) -> str:
+        if self.probe_parts is None:
+            # Probe URL is normal one seen by people out on the web.
+            return url + self.probe_suffix
+        # There is a special URL for probing existence separate
+        # from where the user profile normally can be found.
+        return username.join(self.probe_parts) + self.probe_suffix
+
+
+def get_site_plan(
+    site: MaigretSite, url_main: str, options: QueryOptions, logger
+) -> SitePlan:
+    plans = options.get("site_plans")
+    if plans is None:
+        return SitePlan(site, url_main, options, logger)
+    key = (site.name, url_main, options["id_type"])
+    plan = plans.get(key)
+    # sites of a reloaded database get new plans
+    if plan is None or plan.site is not site:
+        plan = plans[key] = SitePlan(site, url_main, options, logger)
+    return plan
+
+
 def make_site_result(
     site: MaigretSite, username: str, options: QueryOptions, logger, *args, **kwargs
 ) -> QueryResultWrapper:
     results_site: QueryResultWrapper = {}
 
+    url_main = site.url_main
+    attempt = kwargs.get('retry') or 0
+    if attempt and getattr(site, "mirrors", None):
+        # rotate mirrors on retries, the site object itself stays untouched
+        url_main = site.mirrors[attempt % len(site.mirrors)]
+        logger.info(f"Use {url_main} as a main url of site {site}")
+
+    plan = get_site_plan(site, url_main, options, logger)
+
     # Record URL of main site and username
     results_site["site"] = site
     results_site["username"] = username
     results_site["parsing_enabled"] = options["parsing"]
-    results_site["url_main"] = site.url_main
-    results_site["cookies"] = (
-        options.get("cookie_jar")
-        and options["cookie_jar"].filter_cookies(site.url_main)
-        or None
-    )
-
-    headers = {
-        "User-Agent": get_random_user_agent(),
-        # tell server that we want to close connection after request
-        "Connection": "close",
-    }
-
-    headers.update(site.headers)
+    results_site["url_main"] = url_main
+    results_site["cookies"] = plan.cookies
+    results_site["plan"] = plan
 
-    if "url" not in site.__dict__:
-        logger.error("No URL for site %s", site.name)
-
-    if kwargs.get('retry') and hasattr(site, "mirrors"):
-        site.url_main = random.choice(site.mirrors)
-        logger.info(f"Use {site.url_main} as a main url of site {site}")
-
-    # URL of user on site (if it exists)
-    url = site.url.format(
-        urlMain=site.url_main, urlSubpath=site.url_subpath, username=quote(username)
-    )
-
-    # workaround to prevent slash errors
-    url = re.sub("(?<!:)/+", "/", url)
+    url = plan.make_url(username)
 
     # always clearweb_checker for now
     checker = options["checkers"][site.protocol]
 
-    # site check is disabled
-    if site.disabled and not options['forced']:
-        logger.debug(f"Site {site.name} is disabled, skipping...")
-        results_site["status"] = MaigretCheckResult(
-            username,
-            site.name,
-            url,
-            MaigretCheckStatus.ILLEGAL,
-            error=CheckError("Check is disabled"),
-        )
-    # current username type could not be applied
-    elif site.type != options["id_type"]:
+    # site check is disabled or current username type could not be applied
+    if plan.illegal_error:
         results_site["status"] = MaigretCheckResult(
             username,
             site.name,
             url,
             MaigretCheckStatus.ILLEGAL,
-            error=CheckError('Unsupported identifier type', f'Want "{site.type}"'),
+            error=plan.illegal_error,
         )
     # username is not allowed.
-    elif site.regex_check and re.search(site.regex_check, username) is None:
+    elif plan.regex and plan.regex.search(username) is None:
         results_site["status"] = MaigretCheckResult(
             username,
             site.name,
@@ -470,51 +991,14 @@ def make_site_result(
         results_site["response_text"] = ""
         # query_notify.update(results_site["status"])
     else:
-        # URL of user on site (if it exists)
         results_site["url_user"] = url
-        url_probe = site.url_probe
-        if url_probe is None:
-            # Probe URL is normal one seen by people out on the web.
-            url_probe = url
-        else:
-            # There is a special URL for probing existence separate
-            # from where the user profile normally can be found.
-            url_probe = url_probe.format(
-                urlMain=site.url_main,
-                urlSubpath=site.url_subpath,
-                username=username,
-            )
-
-        for k, v in site.get_params.items():
-            url_probe += f"&{k}={v}"
-
-        if site.check_type == "status_code" and site.request_head_only:
-            # In most cases when we are detecting by status code,
-            # it is not necessary to get the entire body:  we can
-            # detect fine with just the HEAD response.
-            request_method = 'head'
-        else:
-            # Either this detect method needs the content associated
-            # with the GET response, or this specific website will
-            # not respond properly unless we request the whole page.
-            request_method = 'get'
-
-        if site.check_type == "response_url":
-            # Site forwards request to a different URL if username not
-            # found.  Disallow the redirect so we can capture the
-            # http status from the original URL request.
-            allow_redirects = False
-        else:
-            # Allow whatever redirect that the site wants to do.
-            # The final result of the request will be what is available.
-            allow_redirects = True
 
         future = checker.prepare(
-            method=request_method,
-            url=url_probe,
-            headers=headers,
-            allow_redirects=allow_redirects,
-            timeout=options['timeout'],
+            method=plan.method,
+            url=plan.make_probe_url(username, url),
+            headers=plan.make_headers(),
+            allow_redirects=plan.allow_redirects,
+            timeout=get_site_timeout(site, options),
         )
 
         # Store future request object in the results object
@@ -525,12 +1009,21 @@ def make_site_result(
     return results_site
 
 
+def get_site_timeout(site: MaigretSite, options: QueryOptions) -> float:
+    adaptive_timeouts = options.get("adaptive_timeouts")
+    if adaptive_timeouts:
+        return adaptive_timeouts.timeout_for(site)
+    return options["timeout"]
+
+
 async def check_site_for_username(
     site, username, options: QueryOptions, logger, query_notify, *args, **kwargs
 ) -> Tuple[str, QueryResultWrapper]:
-    default_result = make_site_result(
-        site, username, options, logger, retry=kwargs.get('retry')
-    )
+    metrics.check_started(kwargs.get('retry') or 0)
+    with stage('make_site_result'):
+        default_result = make_site_result(
+            site, username, options, logger, retry=kwargs.get('retry')
+        )
     # future = default_result.get("future")
     # if not future:
     # return site.name, default_result
@@ -540,13 +1033,34 @@ async def check_site_for_username(
         print(f"error, no checker for {site.name}")
         return site.name, default_result
 
-    response = await checker.check()
+    is_check_needed = default_result.get("status") is None
 
-    response_result = process_site_result(
-        response, query_notify, logger, default_result, site
-    )
+    started_at = time.monotonic()
+    metrics.request_started()
+    try:
+        with stage('check', site.name):
+            response = await checker.check()
+    finally:
+        metrics.request_finished()
+    response_time = time.monotonic() - started_at
+
+    with stage('process_site_result'):
+        response_result = process_site_result(
+            response, query_notify, logger, default_result, site, response_time
+        )
 
-    query_notify.update(response_result['status'], site.similar_search)
+    if is_check_needed:
+        error = response_result["status"].error
+        if not error:
+            AdaptiveTimeouts.record(site, response_time)
+        elif error.type == "Request timeout":
+            # real latency is unknown, but it's not less than the timeout
+            AdaptiveTimeouts.record(site, get_site_timeout(site, options))
+        if error:
+            count(f'error: {error.type}')
+
+    with stage('notify'):
+        query_notify.update(response_result['status'], site.similar_search)
 
     return site.name, response_result
 
@@ -555,20 +1069,36 @@ async def debug_ip_request(checker, logger):
     checker.prepare(url="https://icanhazip.com")
     ip, status, check_error = await checker.check()
     if ip:
-        logger.debug(f"My IP is: {ip.strip()}")
+        logger.debug(f"My IP is: {str(ip).strip()}")
     else:
         logger.debug(f"IP requesting {check_error.type}: {check_error.desc}")
 
 
-def get_failed_sites(results: Dict[str, QueryResultWrapper]) -> List[str]:
-    sites = []
-    for sitename, r in results.items():
-        status = r.get('status', {})
-        if status and status.error:
-            if errors.is_permanent(status.error.type):
-                continue
-            sites.append(sitename)
-    return sites
+def get_check_error_type(result: Tuple[str, QueryResultWrapper]) -> Optional[str]:
+    if not result:
+        return None
+    _, results_info = result
+    status = results_info.get('status')
+    if status and status.error:
+        return status.error.type
+    return None
+
+
+def get_check_retry_info(
+    result: Tuple[str, QueryResultWrapper]
+) -> Tuple[bool, Optional[float]]:
+    """Is check result a temporary failure, and when the site asks to retry"""
+    if not result:
+        return False, None
+    _, results_info = result
+    status = results_info.get('status')
+    if not status or not status.error:
+        return False, None
+
+    if status.error.retry_after is not None:
+        return True, status.error.retry_after
+
+    return not errors.is_permanent(status.error.type), None
 
 
 async def maigret(
@@ -580,6 +1110,7 @@ async def maigret(
     tor_proxy=None,
     i2p_proxy=None,
     timeout=3,
+    tor_circuits=TOR_CIRCUITS,
     is_parsing_enabled=False,
     id_type="username",
     debug=False,
@@ -589,6 +1120,18 @@ async def maigret(
     cookies=None,
     retries=0,
     check_domains=False,
+    dns_options=None,
+    dns_resolver=None,
+    adaptive_connections=False,
+    min_connections=MIN_CONNECTIONS,
+    adaptive_timeouts=False,
+    min_timeout=1,
+    session=None,
+    limiter=None,
+    wrap_checker=None,
+    transfer=None,
+    on_result=None,
+    site_plans=None,
     *args,
     **kwargs,
 ) -> QueryResultWrapper:
@@ -611,8 +1154,50 @@ async def maigret(
                               https://maigret.readthedocs.io/en/latest/supported-identifier-types.html
     max_connections        -- Maximum number of concurrent connections allowed.
                               Default is 100.
+    adaptive_connections   -- Adjust number of concurrent connections between
+                              min_connections and max_connections using
+                              latency and errors of completed checks.
+    min_connections        -- Lower bound for adaptive connections limit.
+    adaptive_timeouts      -- Derive timeout of each site from its latency
+                              history (see `site.stats["latency"]`), between
+                              min_timeout and timeout. Sites with the longest
+                              expected checks are started first.
+    min_timeout            -- Lower bound for adaptive timeouts.
+    proxy                  -- Proxy URL for clearweb checks, a list of URLs or
+                              a ProxyPool to balance requests between proxies
+                              by their health. tor_proxy and i2p_proxy are
+                              the same for onion and I2P sites.
+    tor_circuits           -- Number of isolated Tor circuits with keep-alive
+                              connections for a tor_proxy URL (see
+                              TorCircuitPool), 0 for a new connection over
+                              the same circuit for every request.
+    session                -- External aiohttp session for clearweb checks,
+                              connections are kept alive and the session
+                              is not closed after the search.
+    limiter                -- External concurrency limiter shared with other
+                              searches, overrides adaptive_connections.
+    wrap_checker           -- Function applied to every checker, e.g. to record
+                              or replay requests (see `maigret.replay`).
+    transfer               -- TransferStats to sum sizes of responses on the
+                              wire and decoded, e.g. for all the searches.
+    on_result              -- Function called with the site name and result of
+                              every finished check, e.g. to write reports
+                              while the search goes.
+    site_plans             -- Dict of compiled site plans shared by searches of
+                              the scan with the same session and options, so
+                              site requests are prepared once for all usernames.
+    check_domains          -- Check existence of domains (sites of 'dns'
+                              protocol). They are resolved apart from HTTP
+                              checks, within the queries limit of the resolver.
+    dns_options            -- Arguments of a new DnsResolver of the search
+                              (nameservers, record_types, max_queries).
+    dns_resolver           -- DnsResolver shared with other searches, to keep
+                              its cache, used instead of a new one.
     no_progressbar         -- Displaying of ASCII progressbar during scanner.
     cookies                -- Filename of a cookie jar file to use for each request.
+    retries                -- Count of restarts of temporarily failed checks.
+                              Checks are restarted with exponential backoff
+                              (or after Retry-After delay) as soon as they fail.
 
     Return Value:
     Dictionary containing results from report. Key of dictionary is the name
@@ -639,40 +1224,73 @@ async def maigret(
         logger.debug(f"Using cookies jar file {cookies}")
         cookie_jar = import_aiohttp_cookies(cookies)
 
-    clearweb_checker = SimpleAiohttpChecker(
-        proxy=proxy, cookie_jar=cookie_jar, logger=logger
+    if transfer is None:
+        transfer = TransferStats()
+
+    clearweb_checker = make_proxied_checker(
+        SimpleAiohttpChecker,
+        proxy,
+        cookie_jar=cookie_jar,
+        logger=logger,
+        session=session,
+        transfer=transfer,
     )
 
     # TODO
     tor_checker = CheckerMock()
-    if tor_proxy:
-        tor_checker = ProxiedAiohttpChecker(  # type: ignore
-            proxy=tor_proxy, cookie_jar=cookie_jar, logger=logger
+    if isinstance(tor_proxy, str) and tor_circuits:
+        tor_checker = ProxyPoolChecker(  # type: ignore
+            pool=TorCircuitPool(
+                tor_proxy, tor_circuits, logger=logger, cookie_jar=cookie_jar
+            ),
+            owns_pool=True,
+            logger=logger,
+            transfer=transfer,
+        )
+    elif tor_proxy:
+        tor_checker = make_proxied_checker(  # type: ignore
+            ProxiedAiohttpChecker,
+            tor_proxy,
+            cookie_jar=cookie_jar,
+            logger=logger,
+            transfer=transfer,
         )
 
     # TODO
     i2p_checker = CheckerMock()
     if i2p_proxy:
-        i2p_checker = ProxiedAiohttpChecker(  # type: ignore
-            proxy=i2p_proxy, cookie_jar=cookie_jar, logger=logger
+        i2p_checker = make_proxied_checker(  # type: ignore
+            ProxiedAiohttpChecker,
+            i2p_proxy,
+            cookie_jar=cookie_jar,
+            logger=logger,
+            transfer=transfer,
         )
 
-    # TODO
     dns_checker = CheckerMock()
     if check_domains:
-        dns_checker = AiodnsDomainResolver(logger=logger)  # type: ignore
+        owns_resolver = dns_resolver is None
+        if owns_resolver:
+            dns_resolver = DnsResolver(logger=logger, **(dns_options or {}))
+        dns_checker = AiodnsDomainResolver(  # type: ignore
+            logger=logger, resolver=dns_resolver, owns_resolver=owns_resolver
+        )
+
+    if wrap_checker:
+        clearweb_checker = wrap_checker(clearweb_checker)
+        tor_checker = wrap_checker(tor_checker)
+        i2p_checker = wrap_checker(i2p_checker)
+        dns_checker = wrap_checker(dns_checker)
 
     if logger.level == logging.DEBUG:
         await debug_ip_request(clearweb_checker, logger)
 
-    # setup parallel executor
-    executor = AsyncioQueueGeneratorExecutor(
-        logger=logger,
-        in_parallel=max_connections,
-        timeout=timeout + 0.5,
-        *args,
-        **kwargs,
-    )
+    if limiter is None and adaptive_connections:
+        limiter = AdaptiveConcurrencyLimiter(
+            logger=logger,
+            min_limit=min(min_connections, max_connections),
+            max_limit=max_connections,
+        )
 
     # make options objects for all the requests
     options: QueryOptions = {}
@@ -685,66 +1303,129 @@ async def maigret(
     }
     options["parsing"] = is_parsing_enabled
     options["timeout"] = timeout
+    options["adaptive_timeouts"] = (
+        AdaptiveTimeouts(min_timeout=min_timeout, max_timeout=timeout)
+        if adaptive_timeouts
+        else None
+    )
     options["id_type"] = id_type
     options["forced"] = forced
+    options["keep_alive"] = session is not None
+    options["site_plans"] = site_plans if site_plans is not None else {}
+
+    if options["adaptive_timeouts"]:
+        # start long-running checks first to shorten the tail of the scan
+        site_dict = dict(
+            sorted(
+                site_dict.items(),
+                key=lambda x: options["adaptive_timeouts"].expected_duration(x[1]),
+                reverse=True,
+            )
+        )
 
-    # results from analysis of all sites
-    all_results: Dict[str, QueryResultWrapper] = {}
+    tasks_dict = {}
+    for sitename, site in site_dict.items():
+        default_result: QueryResultWrapper = {
+            'site': site,
+            'status': MaigretCheckResult(
+                username,
+                sitename,
+                '',
+                MaigretCheckStatus.UNKNOWN,
+                error=CheckError('Request failed'),
+            ),
+        }
+        checker = options["checkers"][site.protocol]
+        tasks_dict[sitename] = (
+            check_site_for_username,
+            [site, username, options, logger, query_notify],
+            {
+                'default': (sitename, default_result),
+                'retry': 0,
+                # separate concurrency limit for each proxy
+                'limiter_key': getattr(checker, 'proxy', None),
+                'timeout': get_site_timeout(site, options) + 0.5,
+            },
+        )
 
-    sites = list(site_dict.keys())
+    metrics.checks_queued(len(tasks_dict))
 
-    attempts = retries + 1
-    while attempts:
-        tasks_dict = {}
+    # temporarily failed checks are restarted by executor with a backoff
+    # as soon as they fail, without waiting for the rest of the scan
+    retry_policy = RetryPolicy(
+        max_retries=retries,
+        budget=max(
+            RETRY_BUDGET_MIN, int(len(tasks_dict) * retries * RETRY_BUDGET_RATIO)
+        ),
+        retry_info_func=get_check_retry_info,
+    )
 
-        for sitename, site in site_dict.items():
-            if sitename not in sites:
-                continue
-            default_result: QueryResultWrapper = {
-                'site': site,
-                'status': MaigretCheckResult(
-                    username,
-                    sitename,
-                    '',
-                    MaigretCheckStatus.UNKNOWN,
-                    error=CheckError('Request failed'),
-                ),
-            }
-            tasks_dict[sitename] = (
-                check_site_for_username,
-                [site, username, options, logger, query_notify],
-                {
-                    'default': (sitename, default_result),
-                    'retry': retries - attempts + 1,
-                },
-            )
+    # setup parallel executor
+    executor = AsyncioQueueGeneratorExecutor(
+        logger=logger,
+        in_parallel=max_connections,
+        timeout=timeout + 0.5,
+        limiter=limiter,
+        error_type_func=get_check_error_type,
+        retry_policy=retry_policy,
+        *args,
+        **kwargs,
+    )
+    # domains are resolved by their own workers, not competing with HTTP checks
+    dns_sites = {name for name, site in site_dict.items() if site.protocol == 'dns'}
+    runs = [executor.run(t for n, t in tasks_dict.items() if n not in dns_sites)]
+    if dns_sites:
+        dns_executor = AsyncioQueueGeneratorExecutor(
+            logger=logger,
+            in_parallel=dns_resolver.max_queries if dns_resolver else max_connections,
+            timeout=timeout + 0.5,
+            error_type_func=get_check_error_type,
+            retry_policy=retry_policy,
+        )
+        runs.append(dns_executor.run(tasks_dict[name] for name in dns_sites))
+
+    # results from analysis of all sites
+    all_results: Dict[str, QueryResultWrapper] = {}
 
-        cur_results = []
-        with alive_bar(
-            len(tasks_dict), title="Searching", force_tty=True, disable=no_progressbar
-        ) as progress:
-            async for result in executor.run(tasks_dict.values()):
-                cur_results.append(result)
-                progress()
+    with alive_bar(
+        len(tasks_dict),
+        title="Searching",
+        force_tty=True,
+        disable=no_progressbar,
+        refresh_secs=PROGRESS_REFRESH_SECS,
+    ) as progress:
+        async for result in merge_runs(*runs):
+            sitename, site_result = result
+            all_results[sitename] = site_result
+            if on_result:
+                on_result(sitename, site_result)
+            status = site_result['status']
+            metrics.check_finished(
+                status.status.name, status.error.type if status.error else None
+            )
+            if limiter:
+                progress.text = f'connections limit: {limiter.limit}'
+            progress()
+        # results buffered by the output are shown above the final bar
+        query_notify.flush()
 
-        all_results.update(cur_results)
+    if retry_policy.retries_count:
+        logger.info(f'Restarted {retry_policy.retries_count} temporarily failed checks')
 
-        # rerun for failed sites
-        sites = get_failed_sites(dict(cur_results))
-        attempts -= 1
+    if limiter:
+        logger.info(f'Adaptive concurrency limits at the end: {limiter.stats()}')
 
-        if not sites:
-            break
+    if dns_resolver:
+        logger.info(f'DNS resolver: {dns_resolver.stats()}')
 
-        if attempts:
-            query_notify.warning(
-                f'Restarting checks for {len(sites)} sites... ({attempts} attempts left)'
-            )
+    if transfer.responses:
+        logger.info(f'Responses: {transfer.summary()}')
 
     # closing http client session
     await clearweb_checker.close()
     await tor_checker.close()
     await i2p_checker.close()
+    await dns_checker.close()
 
     # notify caller that all queries are finished
     query_notify.finish()
@@ -0,0 +1,779 @@
+"""Maigret distributed scanning
+
+The coordinator splits sites of each searched username into work units and
+serves them over a small JSON-over-HTTP protocol, workers on any number of
+hosts pull units, check sites with their own connections and send results
+back. No external broker is needed: the coordinator keeps the queue itself.
+
+Workers send heartbeats with the units they are working on, units of silent
+workers are queued again. The number of checks running at the same time
+for one host is limited across the whole cluster. Results are passed to the
+notifier as soon as they arrive, and the search returns the usual results
+dict. All workers must use the same sites database as the coordinator.
+
+API:
+    POST /api/cluster/workers                       register a worker
+    POST /api/cluster/workers/{id}/lease            take units to check
+    POST /api/cluster/workers/{id}/heartbeat        extend units leases
+    POST /api/cluster/units/{id}/results            send units results
+    POST /api/cluster/units/{id}/release            give up a unit
+    GET  /api/cluster/status                        coordinator statistics
+
+With a token every request must have it in the `X-Maigret-Cluster-Token`
+header, a coordinator listening on a non-loopback address requires one.
+"""
+
+import asyncio
+import hmac
+import ipaddress
+import logging
+import time
+import uuid
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+from alive_progress import alive_bar
+
+try:
+    from mock import Mock
+except ImportError:
+    from unittest.mock import Mock
+
+from .checking import MIN_CONNECTIONS, SitePlan, maigret
+from .errors import CheckError
+from .executors import AdaptiveConcurrencyLimiter
+from .latency import AdaptiveTimeouts
+from .notify import PROGRESS_REFRESH_SECS
+from .result import MaigretCheckResult, MaigretCheckStatus
+from .sites import MaigretDatabase, MaigretSite
+from .types import QueryResultWrapper
+from .workers import make_session
+
+DEFAULT_PORT = 5006
+DEFAULT_HOST = '127.0.0.1'
+TOKEN_HEADER = 'X-Maigret-Cluster-Token'
+# sites in a work unit
+UNIT_SIZE = 20
+# checks of one host running at the same time in the whole cluster
+PER_HOST_LIMIT = 2
+# seconds without heartbeats after which units of a worker are queued again
+LEASE_TIMEOUT = 30
+# a unit failing so many times gets unknown results
+MAX_UNIT_ATTEMPTS = 3
+# seconds a worker waits for new units in one lease request
+LEASE_WAIT = 10
+# units checked by a worker at the same time
+WORKER_UNITS = 2
+
+STATUSES = {str(s): s for s in MaigretCheckStatus}
+# parts of results which can't be sent as JSON
+NOT_SERIALIZABLE_KEYS = ('site', 'checker', 'future', 'plan', 'status')
+
+
+def parse_address(address: str, default_host=DEFAULT_HOST) -> Tuple[str, int]:
+    """`host:port` or `port` to host and port"""
+    host, _, port = address.rpartition(':')
+    return host or default_host, int(port)
+
+
+def is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host.strip('[]')).is_loopback
+    except ValueError:
+        return False
+
+
+def site_host(site: MaigretSite) -> str:
+    return urlparse(site.url or site.url_main).netloc.lower() or site.name
+
+
+def result_to_json(result: QueryResultWrapper) -> Dict[str, Any]:
+    data = {
+        k: v
+        for k, v in result.items()
+        if k not in NOT_SERIALIZABLE_KEYS
+        and isinstance(v, (str, int, float, bool, list, dict, type(None)))
+    }
+    status = result.get('status')
+    if status:
+        data['status'] = {
+            'site_name': status.site_name,
+            'url': status.site_url_user,
+            'status': str(status.status),
+            'query_time': status.query_time,
+            'ids_data': status.ids_data,
+            'tags': status.tags,
+            'error': (
+                [status.error.type, status.error.desc] if status.error else None
+            ),
+        }
+    return data
+
+
+def result_from_json(data: Dict[str, Any], site: MaigretSite) -> QueryResultWrapper:
+    result = dict(data, site=site)
+    status = data.get('status')
+    if status:
+        result['status'] = MaigretCheckResult(
+            data['username'],
+            status['site_name'],
+            status['url'],
+            STATUSES[status['status']],
+            ids_data=status['ids_data'],
+            query_time=status['query_time'],
+            error=CheckError(*status['error']) if status['error'] else None,
+            tags=status['tags'],
+        )
+    return result
+
+
+class WorkUnit:
+    def __init__(self, scan: "ClusterScan", sites: List[str], hosts: Counter):
+        self.id = uuid.uuid4().hex
+        self.scan = scan
+        self.sites = sites
+        self.hosts = hosts
+        self.attempts = 0
+        self.worker_id: Optional[str] = None
+        self.deadline = 0.0
+        self.done = False
+
+    def json(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'username': self.scan.username,
+            'id_type': self.scan.id_type,
+            'sites': self.sites,
+        }
+
+
+class ClusterScan:
+    """Search of one username, results of units are merged into it"""
+
+    def __init__(self, username: str, id_type: str, site_dict: Dict[str, MaigretSite]):
+        self.username = username
+        self.id_type = id_type
+        self.site_dict = site_dict
+        self.remaining = len(site_dict)
+        self.results: Dict[str, QueryResultWrapper] = {}
+        # batches of new results for the search coroutine
+        self.updates: asyncio.Queue = asyncio.Queue()
+
+    def add_results(self, results: Dict[str, QueryResultWrapper]):
+        new_results = {k: v for k, v in results.items() if k not in self.results}
+        self.results.update(new_results)
+        self.remaining -= len(new_results)
+        self.updates.put_nowait(new_results)
+
+
+class ClusterCoordinator:
+    """
+    Queue of work units and registry of workers.
+
+    `search` has the same interface as `ShardedScanner.search`, the HTTP
+    API for workers is made by `make_coordinator_app`.
+    """
+
+    def __init__(
+        self,
+        logger=None,
+        unit_size: int = UNIT_SIZE,
+        per_host_limit: int = PER_HOST_LIMIT,
+        lease_timeout: float = LEASE_TIMEOUT,
+        max_attempts: int = MAX_UNIT_ATTEMPTS,
+    ):
+        self.logger = logger or logging.getLogger('maigret')
+        self.unit_size = unit_size
+        self.per_host_limit = per_host_limit
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.workers: Dict[str, Dict[str, Any]] = {}
+        self.units: Dict[str, WorkUnit] = {}
+        self.host_load: Counter = Counter()
+        self._queue: Deque[WorkUnit] = deque()
+        self._changed: Optional[asyncio.Condition] = None
+        self._reaper: Optional[asyncio.Task] = None
+
+    @property
+    def changed(self) -> asyncio.Condition:
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    async def notify_changes(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def start(self):
+        self._reaper = asyncio.create_task(self._requeue_expired_loop())
+
+    async def close(self):
+        if self._reaper:
+            self._reaper.cancel()
+            await asyncio.gather(self._reaper, return_exceptions=True)
+
+    def make_units(self, scan: ClusterScan) -> List[WorkUnit]:
+        """
+        Split sites into units, a unit never has more checks of one host
+        than allowed to run at the same time
+        """
+        units = []
+        pending = deque(scan.site_dict)
+        while pending:
+            sites: List[str] = []
+            hosts: Counter = Counter()
+            skipped = []
+            while pending and len(sites) < self.unit_size:
+                name = pending.popleft()
+                host = site_host(scan.site_dict[name])
+                if hosts[host] >= self.per_host_limit:
+                    skipped.append(name)
+                    continue
+                hosts[host] += 1
+                sites.append(name)
+            pending.extendleft(reversed(skipped))
+            units.append(WorkUnit(scan, sites, hosts))
+        return units
+
+    def register(self, name: str = '') -> Dict[str, Any]:
+        worker_id = uuid.uuid4().hex
+        self.workers[worker_id] = {
+            'name': name or worker_id,
+            'last_seen': time.monotonic(),
+            'units': set(),
+            'checked': 0,
+        }
+        self.logger.info(f'Cluster worker {name} is registered')
+        return {
+            'worker_id': worker_id,
+            'heartbeat_interval': self.lease_timeout / 3,
+        }
+
+    def _touch(self, worker_id: str) -> Dict[str, Any]:
+        worker = self.workers[worker_id]
+        worker['last_seen'] = time.monotonic()
+        return worker
+
+    def _fits(self, unit: WorkUnit) -> bool:
+        return all(
+            self.host_load[host] + count <= self.per_host_limit
+            for host, count in unit.hosts.items()
+        )
+
+    def lease(self, worker_id: str, max_units: int) -> List[WorkUnit]:
+        """Take queued units which hosts are not busy"""
+        if worker_id not in self.workers:
+            return []
+        worker = self._touch(worker_id)
+        leased = []
+        deadline = time.monotonic() + self.lease_timeout
+        for unit in list(self._queue):
+            if len(leased) >= max_units:
+                break
+            if not self._fits(unit):
+                continue
+            self._queue.remove(unit)
+            self.host_load.update(unit.hosts)
+            unit.worker_id = worker_id
+            unit.deadline = deadline
+            unit.attempts += 1
+            worker['units'].add(unit.id)
+            leased.append(unit)
+        return leased
+
+    async def wait_lease(
+        self, worker_id: str, max_units: int, wait: float
+    ) -> List[WorkUnit]:
+        """Lease units, waiting up to `wait` seconds if there are none"""
+        deadline = time.monotonic() + wait
+        async with self.changed:
+            while True:
+                units = self.lease(worker_id, max_units)
+                timeout = deadline - time.monotonic()
+                if units or timeout <= 0:
+                    return units
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    def heartbeat(self, worker_id: str, unit_ids: List[str]) -> List[str]:
+        """Extend leases of the worker units, returns ids of lost ones"""
+        self._touch(worker_id)
+        deadline = time.monotonic() + self.lease_timeout
+        lost = []
+        for unit_id in unit_ids:
+            unit = self.units.get(unit_id)
+            if unit and not unit.done and unit.worker_id == worker_id:
+                unit.deadline = deadline
+            else:
+                lost.append(unit_id)
+        return lost
+
+    def _unlease(self, unit: WorkUnit):
+        if unit.worker_id is None:
+            return
+        self.host_load.subtract(unit.hosts)
+        self.host_load += Counter()  # drop zero counts
+        worker = self.workers.get(unit.worker_id)
+        if worker:
+            worker['units'].discard(unit.id)
+        unit.worker_id = None
+
+    def _finish_unit(self, unit: WorkUnit, results: Dict[str, QueryResultWrapper]):
+        unit.done = True
+        if unit in self._queue:
+            self._queue.remove(unit)
+        self._unlease(unit)
+        del self.units[unit.id]
+        unit.scan.add_results(results)
+
+    def _unknown_result(self, unit: WorkUnit, name: str, reason: str):
+        username = unit.scan.username
+        return {
+            'site': unit.scan.site_dict[name],
+            'username': username,
+            'status': MaigretCheckResult(
+                username,
+                name,
+                '',
+                MaigretCheckStatus.UNKNOWN,
+                error=CheckError('Cluster failure', reason),
+            ),
+        }
+
+    def _fail_unit(self, unit: WorkUnit, reason: str):
+        """Queue the unit again or give it unknown results"""
+        self._unlease(unit)
+        if unit.attempts < self.max_attempts:
+            self._queue.appendleft(unit)
+            return
+
+        self.logger.error(f'Unit of {unit.scan.username} failed: {reason}')
+        self._finish_unit(
+            unit, {name: self._unknown_result(unit, name, reason) for name in unit.sites}
+        )
+
+    def complete(
+        self, worker_id: str, unit_id: str, results: Dict[str, Dict[str, Any]]
+    ) -> bool:
+        """Merge results of the unit, returns False for unknown units"""
+        unit = self.units.get(unit_id)
+        if worker_id in self.workers:
+            self._touch(worker_id)['checked'] += len(results)
+        if not unit or unit.done:
+            return False
+
+        site_dict = unit.scan.site_dict
+        self._finish_unit(
+            unit,
+            {
+                name: (
+                    result_from_json(results[name], site_dict[name])
+                    if name in results
+                    else self._unknown_result(unit, name, 'Not checked by worker')
+                )
+                for name in unit.sites
+            },
+        )
+        return True
+
+    def release(self, worker_id: str, unit_id: str, error: str = ''):
+        unit = self.units.get(unit_id)
+        if unit and not unit.done and unit.worker_id == worker_id:
+            self._fail_unit(unit, error or 'Released by worker')
+
+    def requeue_expired(self) -> int:
+        now = time.monotonic()
+        expired = [
+            u for u in self.units.values() if u.worker_id and u.deadline < now
+        ]
+        for unit in expired:
+            self.logger.warning(
+                f'Lease of unit {unit.id} by worker {unit.worker_id} is expired'
+            )
+            self._fail_unit(unit, 'Worker is lost')
+
+        for worker_id, worker in list(self.workers.items()):
+            if not worker['units'] and now - worker['last_seen'] > 3 * self.lease_timeout:
+                del self.workers[worker_id]
+        return len(expired)
+
+    async def _requeue_expired_loop(self):
+        interval = min(1, self.lease_timeout / 2)
+        while True:
+            await asyncio.sleep(interval)
+            if self.requeue_expired():
+                await self.notify_changes()
+
+    async def search(
+        self,
+        username: str,
+        site_dict: Dict[str, MaigretSite],
+        query_notify=None,
+        id_type: str = 'username',
+        no_progressbar: bool = False,
+        on_result=None,
+    ) -> Dict[str, QueryResultWrapper]:
+        if not query_notify:
+            query_notify = Mock()
+
+        query_notify.start(username, id_type)
+
+        scan = ClusterScan(username, id_type, site_dict)
+        for unit in self.make_units(scan):
+            self.units[unit.id] = unit
+            self._queue.append(unit)
+        await self.notify_changes()
+
+        try:
+            with alive_bar(
+                len(site_dict),
+                title="Searching",
+                force_tty=True,
+                disable=no_progressbar,
+                refresh_secs=PROGRESS_REFRESH_SECS,
+            ) as progress:
+                while scan.remaining > 0:
+                    for name, result in (await scan.updates.get()).items():
+                        if on_result:
+                            on_result(name, result)
+                        status = result.get('status')
+                        if not status:
+                            continue
+                        site = site_dict[name]
+                        if status.query_time and not status.error:
+                            AdaptiveTimeouts.record(site, status.query_time)
+                        query_notify.update(status, site.similar_search)
+                        progress()
+                query_notify.flush()
+        finally:
+            self._drop_scan(scan)
+
+        query_notify.finish()
+
+        return {name: scan.results[name] for name in site_dict if name in scan.results}
+
+    def _drop_scan(self, scan: ClusterScan):
+        """Forget unfinished units of a cancelled search"""
+        for unit in [u for u in self.units.values() if u.scan is scan]:
+            unit.done = True
+            if unit in self._queue:
+                self._queue.remove(unit)
+            self._unlease(unit)
+            del self.units[unit.id]
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            'queued_units': len(self._queue),
+            'leased_units': sum(1 for u in self.units.values() if u.worker_id),
+            'busy_hosts': len(self.host_load),
+            'workers': {
+                worker_id: {
+                    'name': w['name'],
+                    'units': len(w['units']),
+                    'checked': w['checked'],
+                    'last_seen': round(now - w['last_seen'], 1),
+                }
+                for worker_id, w in self.workers.items()
+            },
+        }
+
+
+COORDINATOR_KEY = web.AppKey('coordinator', ClusterCoordinator)
+
+
+def get_worker_id(request: web.Request, worker_id: Optional[str]) -> str:
+    if worker_id not in request.app[COORDINATOR_KEY].workers:
+        raise web.HTTPNotFound(
+            text='{"error": "Unknown worker"}', content_type='application/json'
+        )
+    return worker_id
+
+
+async def handle_register(request: web.Request) -> web.Response:
+    data = await request.json()
+    return web.json_response(
+        request.app[COORDINATOR_KEY].register(str(data.get('name', '')))
+    )
+
+
+async def handle_lease(request: web.Request) -> web.Response:
+    coordinator = request.app[COORDINATOR_KEY]
+    worker_id = get_worker_id(request, request.match_info['worker_id'])
+    data = await request.json()
+    units = await coordinator.wait_lease(
+        worker_id,
+        max_units=max(1, int(data.get('max_units', 1))),
+        wait=min(float(data.get('wait', 0)), LEASE_WAIT, coordinator.lease_timeout),
+    )
+    return web.json_response({'units': [u.json() for u in units]})
+
+
+async def handle_heartbeat(request: web.Request) -> web.Response:
+    worker_id = get_worker_id(request, request.match_info['worker_id'])
+    data = await request.json()
+    lost = request.app[COORDINATOR_KEY].heartbeat(worker_id, data.get('units', []))
+    return web.json_response({'lost': lost})
+
+
+async def handle_results(request: web.Request) -> web.Response:
+    coordinator = request.app[COORDINATOR_KEY]
+    data = await request.json()
+    accepted = coordinator.complete(
+        data.get('worker_id'), request.match_info['unit_id'], data['results']
+    )
+    await coordinator.notify_changes()
+    return web.json_response({'accepted': accepted})
+
+
+async def handle_release(request: web.Request) -> web.Response:
+    coordinator = request.app[COORDINATOR_KEY]
+    data = await request.json()
+    coordinator.release(
+        data.get('worker_id'), request.match_info['unit_id'], data.get('error', '')
+    )
+    await coordinator.notify_changes()
+    return web.json_response({})
+
+
+async def handle_status(request: web.Request) -> web.Response:
+    return web.json_response(request.app[COORDINATOR_KEY].stats())
+
+
+def make_token_middleware(token: str):
+    @web.middleware
+    async def check_token(request: web.Request, handler):
+        sent = request.headers.get(TOKEN_HEADER, '')
+        if not hmac.compare_digest(sent.encode(), token.encode()):
+            raise web.HTTPUnauthorized(
+                text='{"error": "Wrong cluster token"}',
+                content_type='application/json',
+            )
+        return await handler(request)
+
+    return check_token
+
+
+def make_coordinator_app(
+    coordinator: ClusterCoordinator, token: str = ''
+) -> web.Application:
+    app = web.Application(middlewares=[make_token_middleware(token)] if token else [])
+    app[COORDINATOR_KEY] = coordinator
+
+    async def on_startup(app):
+        await coordinator.start()
+
+    async def on_cleanup(app):
+        await coordinator.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+
+    app.router.add_post('/api/cluster/workers', handle_register)
+    app.router.add_post('/api/cluster/workers/{worker_id}/lease', handle_lease)
+    app.router.add_post('/api/cluster/workers/{worker_id}/heartbeat', handle_heartbeat)
+    app.router.add_post('/api/cluster/units/{unit_id}/results', handle_results)
+    app.router.add_post('/api/cluster/units/{unit_id}/release', handle_release)
+    app.router.add_get('/api/cluster/status', handle_status)
+    return app
+
+
+async def start_coordinator(
+    coordinator: ClusterCoordinator,
+    host=DEFAULT_HOST,
+    port=DEFAULT_PORT,
+    token: str = '',
+) -> web.AppRunner:
+    """Start the coordinator API, stop it with `runner.cleanup()`"""
+    if not token and not is_loopback(host):
+        raise ValueError(f'A cluster token is required to listen on {host}')
+    runner = web.AppRunner(make_coordinator_app(coordinator, token))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    coordinator.logger.warning(f'Maigret cluster coordinator is listening on {host}:{port}')
+    return runner
+
+
+class ClusterWorker:
+    """
+    Pulls work units from the coordinator and checks them.
+
+    Search arguments are the same as for `maigret.search`, `max_connections`
+    is shared by all units checked at the same time.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        db: MaigretDatabase,
+        logger=None,
+        name: str = '',
+        units: int = WORKER_UNITS,
+        retry_delay: float = 1,
+        token: str = '',
+        **kwargs,
+    ):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.db = db
+        self.logger = logger or logging.getLogger('maigret')
+        self.name = name
+        self.units = units
+        self.retry_delay = retry_delay
+        self.search_kwargs = kwargs
+        self.site_plans: Dict[Tuple[str, str, str], SitePlan] = {}
+        self.worker_id: Optional[str] = None
+        self.heartbeat_interval = LEASE_TIMEOUT / 3
+        self.checked = 0
+        self._active: Dict[str, asyncio.Task] = {}
+        self._api: Optional[ClientSession] = None
+        self._session: Optional[ClientSession] = None
+
+        max_connections = kwargs.get('max_connections', 100)
+        self.limiter = AdaptiveConcurrencyLimiter(
+            logger=self.logger,
+            min_limit=(
+                min(kwargs.get('min_connections', MIN_CONNECTIONS), max_connections)
+                if kwargs.get('adaptive_connections')
+                else max_connections
+            ),
+            max_limit=max_connections,
+            initial_limit=max_connections,
+        )
+
+    async def _call(self, path: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        async with self._api.post(f'{self.url}{path}', json=data) as response:
+            if response.status == 404 and path.startswith('/api/cluster/workers/'):
+                # the coordinator is restarted and doesn't know the worker
+                self.worker_id = None
+            response.raise_for_status()
+            return await response.json()
+
+    async def _register(self):
+        data = await self._call('/api/cluster/workers', {'name': self.name})
+        self.worker_id = data['worker_id']
+        self.heartbeat_interval = data['heartbeat_interval']
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if not self.worker_id or not self._active:
+                continue
+            try:
+                data = await self._call(
+                    f'/api/cluster/workers/{self.worker_id}/heartbeat',
+                    {'units': list(self._active)},
+                )
+            except (ClientError, asyncio.TimeoutError) as e:
+                self.logger.warning(f'Heartbeat failed: {e}')
+                continue
+            # somebody else checks these units now
+            for unit_id in data['lost']:
+                task = self._active.pop(unit_id, None)
+                if task:
+                    task.cancel()
+
+    async def _check_unit(self, unit: Dict[str, Any]):
+        sites_dict = self.db.sites_dict
+        unknown = [name for name in unit['sites'] if name not in sites_dict]
+        if unknown:
+            self.logger.warning(f'Sites {unknown} are not in the worker database')
+
+        try:
+            results = await maigret(
+                username=unit['username'],
+                site_dict={n: sites_dict[n] for n in unit['sites'] if n in sites_dict},
+                logger=self.logger,
+                id_type=unit['id_type'],
+                no_progressbar=True,
+                session=self._session,
+                limiter=self.limiter,
+                site_plans=self.site_plans,
+                **self.search_kwargs,
+            )
+            path, data = f"/api/cluster/units/{unit['id']}/results", {
+                'results': {k: result_to_json(v) for k, v in results.items()}
+            }
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Check of unit {unit['id']} failed: {e}", exc_info=True)
+            path, data = f"/api/cluster/units/{unit['id']}/release", {'error': str(e)}
+
+        try:
+            await self._call(path, dict(data, worker_id=self.worker_id))
+            self.checked += len(data.get('results', {}))
+        except (ClientError, asyncio.TimeoutError) as e:
+            # the unit will be queued again after its lease expiration
+            self.logger.warning(f"Results of unit {unit['id']} are not sent: {e}")
+        finally:
+            self._active.pop(unit['id'], None)
+
+    async def run(self):
+        """Check units until the task is cancelled"""
+        self._api = ClientSession(
+            timeout=ClientTimeout(total=LEASE_WAIT + 30),
+            headers={TOKEN_HEADER: self.token} if self.token else None,
+        )
+        if not any(
+            self.search_kwargs.get(k)
+            for k in ('proxy', 'tor_proxy', 'i2p_proxy', 'cookies')
+        ):
+            self._session = await make_session(
+                self.search_kwargs.get('max_connections', 100)
+            )
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+        try:
+            while True:
+                try:
+                    if not self.worker_id:
+                        await self._register()
+                    free = self.units - len(self._active)
+                    if free <= 0:
+                        await asyncio.wait(
+                            list(self._active.values()),
+                            return_when=asyncio.FIRST_COMPLETED,
+                        )
+                        continue
+                    data = await self._call(
+                        f'/api/cluster/workers/{self.worker_id}/lease',
+                        {'max_units': free, 'wait': LEASE_WAIT},
+                    )
+                except (ClientError, asyncio.TimeoutError) as e:
+                    self.logger.warning(f'Coordinator {self.url} is unavailable: {e}')
+                    await asyncio.sleep(self.retry_delay)
+                    continue
+
+                for unit in data['units']:
+                    self._active[unit['id']] = asyncio.create_task(
+                        self._check_unit(unit)
+                    )
+        finally:
+            heartbeat.cancel()
+            tasks = list(self._active.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(heartbeat, *tasks, return_exceptions=True)
+            await self._release_active()
+            await self._api.close()
+            if self._session:
+                await self._session.close()
+
+    async def _release_active(self):
+        """Give unfinished units back to the coordinator on stop"""
+        for unit_id in list(self._active):
+            try:
+                await self._call(
+                    f'/api/cluster/units/{unit_id}/release',
+                    {'worker_id': self.worker_id, 'error': 'Worker is stopped'},
+                )
+            except (ClientError, asyncio.TimeoutError):
+                pass
+        self._active.clear()
@@ -8,10 +8,13 @@ from .types import QueryResultWrapper
 class CheckError:
     _type = 'Unknown'
     _desc = ''
+    # delay in seconds requested by the site (Retry-After header)
+    retry_after = None
 
-    def __init__(self, typename, desc=''):
+    def __init__(self, typename, desc='', retry_after=None):
         self._type = typename
         self._desc = desc
+        self.retry_after = retry_after
 
     def __str__(self):
         if not self._desc:
@@ -69,7 +72,9 @@ ERRORS_TYPES = {
     'Bot protection': 'Try to switch to another IP address',
     'Censorship': 'Switch to another internet service provider',
     'Request timeout': 'Try to increase timeout or to switch to another internet service provider',
-    'Connecting failure': 'Try to decrease number of parallel connections (e.g. -n 10)',
+    'Too many requests': 'Try to decrease number of parallel connections or to switch to another IP address',
+    'Connecting failure': 'Try to decrease number of parallel connections (e.g. -n 10) '
+    'or to enable `--adaptive-connections`',
 }
 
 # TODO: checking for reason
@@ -86,6 +91,19 @@ TEMPORARY_ERRORS_TYPES = [
     'Proxy',
     'Interrupted',
     'Connection lost',
+    'Too many requests',
+    'DNS resolve error',
+    'Bad encoding',
+]
+
+# errors meaning that we (or our proxy) send requests too fast
+CONGESTION_ERRORS_TYPES = [
+    'Request timeout',
+    'Connecting failure',
+    'Server disconnected',
+    'Bot protection',
+    'Captcha',
+    'Too many requests',
 ]
 
 THRESHOLD = 3  # percent
@@ -99,6 +117,10 @@ def is_permanent(err_type):
     return err_type not in TEMPORARY_ERRORS_TYPES
 
 
+def is_congestion(err_type):
+    return err_type in CONGESTION_ERRORS_TYPES
+
+
 def detect(text):
     for flag, err in COMMON_ERRORS.items():
         if flag in text:
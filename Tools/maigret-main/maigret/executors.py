@@ -1,11 +1,14 @@
 import asyncio
+import logging
+import random
 import sys
 import time
-from typing import Any, Iterable, List, Callable
+from typing import Any, AsyncIterator, Dict, Iterable, List, Callable, Optional, Set
 
 import alive_progress
 from alive_progress import alive_bar
 
+from .errors import is_congestion
 from .types import QueryDraft
 
 
@@ -18,6 +21,188 @@ def create_task_func():
     return create_asyncio_task
 
 
+class AIMDLimit:
+    """
+    Additive increase / multiplicative decrease concurrency limit.
+
+    The limit grows by one for every successful completion while it is
+    actually saturated, and is cut by `backoff_ratio` on congestion signals.
+    Only requests started after the previous cut can cut it again, so a burst
+    of timeouts from the same window counts as one congestion event.
+    """
+
+    def __init__(
+        self,
+        initial_limit,
+        min_limit=1,
+        max_limit=100,
+        backoff_ratio=0.75,
+        latency_tolerance=2.0,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.in_flight = 0
+        # smoothed completion latency and the lowest value seen (no-load latency)
+        self.latency: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self._last_decrease = 0.0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def has_room(self) -> bool:
+        return self.in_flight < self.limit
+
+    def on_success(self, latency: float) -> Optional[str]:
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+
+        if self.baseline_latency is None or self.latency < self.baseline_latency:
+            self.baseline_latency = self.latency
+
+        # latency gradient: queues are growing somewhere, stop probing upwards
+        if self.latency > self.baseline_latency * self.latency_tolerance:
+            return None
+
+        # increase only when the limit is the real constraint
+        if self.in_flight + 1 < self._limit / 2:
+            return None
+
+        if self._limit >= self.max_limit:
+            return None
+
+        self._limit = min(self.max_limit, self._limit + 1)
+        return 'success'
+
+    def on_congestion(self, started_at: float, reason: str) -> Optional[str]:
+        if started_at < self._last_decrease:
+            return None
+
+        if self._limit <= self.min_limit:
+            return None
+
+        self._last_decrease = time.monotonic()
+        self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+        return reason
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Concurrency limiter driven by completion latency and errors.
+
+    Keeps one global AIMD limit and a separate one per key (e.g. proxy URL),
+    a check is started only when both limits have room for it.
+    Congestion signals are timeouts, connection failures and bot protection
+    pages, see `errors.CONGESTION_ERRORS_TYPES`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.logger = kwargs.get('logger', logging.getLogger('maigret'))
+        self.min_limit = kwargs.get('min_limit', 1)
+        self.max_limit = kwargs.get('max_limit', 100)
+        self.initial_limit = kwargs.get(
+            'initial_limit', max(self.min_limit, self.max_limit // 2)
+        )
+        self.key_max_limit = kwargs.get('key_max_limit', self.max_limit)
+        self.backoff_ratio = kwargs.get('backoff_ratio', 0.75)
+        self.latency_tolerance = kwargs.get('latency_tolerance', 2.0)
+
+        self._global = self._make_limit(self.initial_limit, self.max_limit)
+        self._keys: Dict[str, AIMDLimit] = {}
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _make_limit(self, initial_limit, max_limit) -> AIMDLimit:
+        return AIMDLimit(
+            initial_limit,
+            min_limit=self.min_limit,
+            max_limit=max_limit,
+            backoff_ratio=self.backoff_ratio,
+            latency_tolerance=self.latency_tolerance,
+        )
+
+    def _key_limit(self, key) -> Optional[AIMDLimit]:
+        if key is None:
+            return None
+        if key not in self._keys:
+            self._keys[key] = self._make_limit(
+                min(self.initial_limit, self.key_max_limit), self.key_max_limit
+            )
+        return self._keys[key]
+
+    @property
+    def limit(self) -> int:
+        """Current global limit of in-flight checks."""
+        return self._global.limit
+
+    @property
+    def in_flight(self) -> int:
+        return self._global.in_flight
+
+    @property
+    def limits(self) -> Dict[str, int]:
+        """Current limits per key, e.g. per proxy."""
+        return {k: v.limit for k, v in self._keys.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'keys': self.limits,
+        }
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, key=None) -> float:
+        """Wait for a free slot, returns the start time to pass to `release`."""
+        key_limit = self._key_limit(key)
+        condition = self._get_condition()
+
+        async with condition:
+            await condition.wait_for(
+                lambda: self._global.has_room()
+                and (key_limit is None or key_limit.has_room())
+            )
+            self._global.in_flight += 1
+            if key_limit:
+                key_limit.in_flight += 1
+
+        return time.monotonic()
+
+    async def release(self, key, started_at: float, error_type=None):
+        """Free the slot and adjust the limits using the check outcome."""
+        key_limit = self._key_limit(key)
+        latency = time.monotonic() - started_at
+
+        for name, state in (('global', self._global), (key, key_limit)):
+            if state is None:
+                continue
+            state.in_flight -= 1
+            old_limit = state.limit
+            if error_type and is_congestion(error_type):
+                reason = state.on_congestion(started_at, error_type)
+            else:
+                reason = state.on_success(latency)
+
+            if reason and state.limit != old_limit:
+                self.logger.info(
+                    f'Concurrency limit ({name}): {old_limit} -> {state.limit}, '
+                    f'reason: {reason}, latency: {round(latency, 2)}s'
+                )
+
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+
+
 class AsyncExecutor:
     # Deprecated: will be removed soon, don't use it
     def __init__(self, *args, **kwargs):
@@ -180,6 +365,80 @@ class AsyncioProgressbarQueueExecutor(AsyncExecutor):
         return self.results
 
 
+class RetryPolicy:
+    """
+    Exponential backoff with jitter for temporarily failed tasks.
+
+    `retry_info_func(result)` returns a tuple (is_retryable, retry_after),
+    where retry_after is a delay requested by the server (or None).
+    Retries are limited per task (`max_retries`) and for the whole run
+    (`budget`), so a mostly failing scan doesn't multiply its duration.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.max_retries = kwargs.get('max_retries', 0)
+        self.budget = kwargs.get('budget', sys.maxsize)
+        self.base_delay = kwargs.get('base_delay', 0.5)
+        self.max_delay = kwargs.get('max_delay', 10)
+        # don't wait for servers asking to come back much later
+        self.max_retry_after = kwargs.get('max_retry_after', 60)
+        self.retry_info_func = kwargs.get('retry_info_func', lambda _: (False, None))
+        self.retries_count = 0
+
+    def backoff(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2**attempt)
+        # "equal jitter": spread retries of simultaneously failed tasks
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def next_delay(self, attempt: int, result) -> Optional[float]:
+        """Delay before the next attempt, None if the task must not be retried"""
+        if attempt >= self.max_retries or self.retries_count >= self.budget:
+            return None
+
+        is_retryable, retry_after = self.retry_info_func(result)
+        if not is_retryable:
+            return None
+
+        delay = self.backoff(attempt)
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            delay = max(delay, retry_after)
+
+        self.retries_count += 1
+        return delay
+
+
+async def merge_runs(*runs: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """Results of several executors runs as soon as any of them gives one"""
+    results: asyncio.Queue = asyncio.Queue()
+    run_done = object()
+
+    async def drain(run):
+        try:
+            async for result in run:
+                await results.put(result)
+        finally:
+            await results.put(run_done)
+
+    tasks = [asyncio.create_task(drain(run)) for run in runs]
+    try:
+        running = len(tasks)
+        while running:
+            result = await results.get()
+            if result is not run_done:
+                yield result
+                continue
+            running -= 1
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception():
+                    raise task.exception()  # type: ignore
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 class AsyncioQueueGeneratorExecutor:
     # Deprecated: will be removed soon, don't use it
     def __init__(self, *args, **kwargs):
@@ -187,8 +446,53 @@ class AsyncioQueueGeneratorExecutor:
         self.queue = asyncio.Queue()
         self.timeout = kwargs.get('timeout')
         self.logger = kwargs['logger']
+        # optional AdaptiveConcurrencyLimiter, `in_parallel` is its upper bound
+        self.limiter = kwargs.get('limiter')
+        # extracts error type from a task result to feed the limiter
+        self.error_type_func = kwargs.get('error_type_func', lambda _: None)
+        # optional RetryPolicy, failed tasks are re-queued with `retry` kwarg
+        self.retry_policy = kwargs.get('retry_policy')
         self._results = asyncio.Queue()
         self._stop_signal = object()
+        self._no_result = object()
+        self._retry_tasks: Set[asyncio.Task] = set()
+
+    async def _run_task(self, f, args, kwargs):
+        query_future = f(*args, **kwargs)
+        query_task = create_task_func()(query_future)
+
+        try:
+            result = await asyncio.wait_for(
+                query_task, timeout=kwargs.get('timeout', self.timeout)
+            )
+            error_type = self.error_type_func(result)
+        except asyncio.TimeoutError:
+            result = kwargs.get('default')
+            error_type = 'Request timeout'
+
+        return result, error_type
+
+    async def _requeue(self, task: QueryDraft, delay: float):
+        await asyncio.sleep(delay)
+        await self.queue.put(task)
+
+    def _schedule_retry(self, task: QueryDraft, result) -> bool:
+        if not self.retry_policy:
+            return False
+
+        f, args, kwargs = task
+        attempt = kwargs.get('retry') or 0
+        delay = self.retry_policy.next_delay(attempt, result)
+        if delay is None:
+            return False
+
+        self.logger.debug(f"Retry #{attempt + 1} of {args} in {round(delay, 2)}s")
+        retry_task = create_task_func()(
+            self._requeue((f, args, {**kwargs, 'retry': attempt + 1}), delay)
+        )
+        self._retry_tasks.add(retry_task)
+        retry_task.add_done_callback(self._retry_tasks.discard)
+        return True
 
     async def worker(self):
         """Process tasks from the queue and put results into the results queue."""
@@ -198,46 +502,59 @@ class AsyncioQueueGeneratorExecutor:
                 self.queue.task_done()
                 break
 
+            result = self._no_result
             try:
                 f, args, kwargs = task
-                query_future = f(*args, **kwargs)
-                query_task = create_task_func()(query_future)
-
-                try:
-                    result = await asyncio.wait_for(query_task, timeout=self.timeout)
-                except asyncio.TimeoutError:
-                    result = kwargs.get('default')
-                await self._results.put(result)
+                if self.limiter:
+                    key = kwargs.get('limiter_key')
+                    started_at = await self.limiter.acquire(key)
+                    error_type = None
+                    try:
+                        result, error_type = await self._run_task(f, args, kwargs)
+                    finally:
+                        await self.limiter.release(key, started_at, error_type)
+                else:
+                    result, _ = await self._run_task(f, args, kwargs)
+
+                if self._schedule_retry(task, result):
+                    continue
             except Exception as e:
                 self.logger.error(f"Error in worker: {e}")
             finally:
                 self.queue.task_done()
 
+            await self._results.put(result)
+
     async def run(self, queries: Iterable[Callable[..., Any]]):
         """Run workers to process queries in parallel."""
         start_time = time.time()
 
         # Add tasks to the queue
+        pending = 0
         for t in queries:
             await self.queue.put(t)
+            pending += 1
 
         # Create workers
         workers = [
             asyncio.create_task(self.worker()) for _ in range(self.workers_count)
         ]
 
-        # Add stop signals
-        for _ in range(self.workers_count):
-            await self.queue.put(self._stop_signal)
-
         try:
-            while any(w.done() is False for w in workers) or not self._results.empty():
-                try:
-                    result = await asyncio.wait_for(self._results.get(), timeout=1)
+            # every task gives exactly one final result, retries are internal
+            while pending:
+                result = await self._results.get()
+                pending -= 1
+                if result is not self._no_result:
                     yield result
-                except asyncio.TimeoutError:
-                    pass
         finally:
+            for retry_task in list(self._retry_tasks):
+                retry_task.cancel()
+
+            # Add stop signals
+            for _ in range(self.workers_count):
+                await self.queue.put(self._stop_signal)
+
             # Ensure all workers are awaited
             await asyncio.gather(*workers)
             self.execution_time = time.time() - start_time
@@ -0,0 +1,125 @@
+"""Maigret sites latency statistics
+
+Every site keeps an exponentially decayed histogram of its response times
+in `site.stats["latency"]`. It is saved between runs and used to derive
+per-site request timeouts and expected durations of checks.
+"""
+
+import math
+import os
+from typing import Any, Dict, Optional
+
+# upper bound of the first bucket, seconds
+BUCKETS_BASE = 0.05
+# each next bucket is 30% wider, the last one is ~130s
+BUCKETS_RATIO = 1.3
+BUCKETS_COUNT = 30
+# weight of old samples is multiplied by this value on every new sample
+DECAY = 0.95
+# don't trust statistics collected from fewer samples
+MIN_SAMPLES = 5
+# timeout = p99 * margin, the result is clamped by min/max timeouts
+TIMEOUT_MARGIN = 1.5
+
+DEFAULT_STATS_FILE = os.path.join(
+    os.path.expanduser('~'), '.maigret', 'sites_stats.json'
+)
+
+
+class LatencyHistogram:
+    """
+    Decayed histogram of response times with logarithmic buckets
+    """
+
+    def __init__(self, counts=None, total=0):
+        self.counts = list(counts) if counts else [0.0] * BUCKETS_COUNT
+        # number of all samples ever added, without decay
+        self.total = total
+
+    @staticmethod
+    def bucket_of(value: float) -> int:
+        if value <= BUCKETS_BASE:
+            return 0
+        bucket = math.ceil(math.log(value / BUCKETS_BASE, BUCKETS_RATIO))
+        return min(BUCKETS_COUNT - 1, bucket)
+
+    @staticmethod
+    def upper_bound(bucket: int) -> float:
+        return BUCKETS_BASE * BUCKETS_RATIO**bucket
+
+    def add(self, value: float):
+        self.counts = [c * DECAY for c in self.counts]
+        self.counts[self.bucket_of(value)] += 1
+        self.total += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket with q-th percentile, None if no samples"""
+        weight = sum(self.counts)
+        if not weight:
+            return None
+
+        threshold = weight * q
+        accumulated = 0.0
+        for bucket, count in enumerate(self.counts):
+            accumulated += count
+            if accumulated >= threshold - 1e-9:
+                return self.upper_bound(bucket)
+
+        return self.upper_bound(BUCKETS_COUNT - 1)
+
+    @property
+    def is_reliable(self) -> bool:
+        return self.total >= MIN_SAMPLES
+
+    @property
+    def json(self) -> Dict[str, Any]:
+        return {
+            'counts': [round(c, 4) for c in self.counts],
+            'total': self.total,
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "LatencyHistogram":
+        counts = data.get('counts', [])
+        if len(counts) != BUCKETS_COUNT:
+            # buckets layout changed, start from scratch
+            return cls()
+        return cls(counts, data.get('total', 0))
+
+
+def get_site_latency(site) -> LatencyHistogram:
+    if 'latency' not in site.stats:
+        site.stats['latency'] = LatencyHistogram()
+    return site.stats['latency']
+
+
+class AdaptiveTimeouts:
+    """
+    Per-site timeouts derived from latency history of sites.
+
+    Sites without enough statistics get `max_timeout`.
+    """
+
+    def __init__(self, min_timeout: float, max_timeout: float):
+        self.min_timeout = min(min_timeout, max_timeout)
+        self.max_timeout = max_timeout
+
+    def timeout_for(self, site) -> float:
+        latency = get_site_latency(site)
+        if not latency.is_reliable:
+            return self.max_timeout
+
+        p99 = latency.percentile(0.99)
+        timeout = p99 * TIMEOUT_MARGIN
+        return round(min(self.max_timeout, max(self.min_timeout, timeout)), 2)
+
+    def expected_duration(self, site) -> float:
+        """Median check duration, unknown sites are expected to be the slowest"""
+        latency = get_site_latency(site)
+        if not latency.is_reliable:
+            return self.max_timeout
+        return min(self.max_timeout, latency.percentile(0.5))
+
+    @staticmethod
+    def record(site, response_time: float):
+        get_site_latency(site).add(response_time)
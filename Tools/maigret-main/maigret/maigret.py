@@ -4,6 +4,7 @@ Maigret main module
 
 import ast
 import asyncio
+import cProfile
 import logging
 import os
 import sys
@@ -22,28 +23,54 @@ from .checking import (
     self_check,
     BAD_CHARS,
     maigret,
+    load_proxy_list,
+    ProxyPool,
+    TorCircuitPool,
+    TOR_CIRCUITS,
+    MIN_CONNECTIONS,
 )
+from .activation import import_aiohttp_cookies
 from . import errors
-from .notify import QueryNotifyPrint
+from .notify import QueryNotifyPrint, TerminalWriter
 from .report import (
-    save_csv_report,
     save_xmind_report,
     save_html_report,
     save_pdf_report,
     generate_report_context,
-    save_txt_report,
     SUPPORTED_JSON_REPORT_FORMATS,
-    save_json_report,
+    open_report_writers,
     get_plaintext_report,
     sort_report_by_data_points,
     save_graph_report,
 )
+from .latency import DEFAULT_STATS_FILE
+from .server import DEFAULT_PORT as DEFAULT_SERVICE_PORT, ScanService, serve
+from .workers import ShardedScanner
+from .replay import ArchiveWriter, ReplayChecker, ScanArchive
+from .profiler import enable as enable_profiler, stage
+from .metrics import (
+    DEFAULT_PORT as DEFAULT_METRICS_PORT,
+    enable as enable_metrics,
+    start_metrics_server,
+    write_textfile_periodically,
+)
+from .cluster import (
+    DEFAULT_PORT as DEFAULT_CLUSTER_PORT,
+    ClusterCoordinator,
+    ClusterWorker,
+    is_loopback,
+    parse_address,
+    start_coordinator,
+)
 from .sites import MaigretDatabase
 from .submit import Submitter
 from .types import QueryResultWrapper
 from .utils import get_dict_ascii_tree
 from .settings import Settings
-from .permutator import Permute
+from .permutator import Permute, UsernameSiteFilter
+from .resolver import DNS_QUERIES_LIMIT, RECORD_TYPES, DnsResolver
+from .storage import ResultStore
+from .transfer import TransferStats, format_size
 
 
 def extract_ids_from_page(url, logger, timeout=5) -> dict:
@@ -150,6 +177,23 @@ def setup_arguments_parser(settings: Settings):
         "A longer timeout will be more likely to get results from slow sites. "
         "On the other hand, this may cause a long delay to gather all results. ",
     )
+    parser.add_argument(
+        "--adaptive-timeouts",
+        action="store_true",
+        dest="adaptive_timeouts",
+        default=False,
+        help="Derive timeout of each site from its response times in previous scans, "
+        "using --timeout as the upper bound.",
+    )
+    parser.add_argument(
+        "--min-timeout",
+        action="store",
+        metavar='MIN_TIMEOUT',
+        dest="min_timeout",
+        type=timeout_check,
+        default=1,
+        help="Lower bound of timeout for --adaptive-timeouts (default 1s).",
+    )
     parser.add_argument(
         "--retries",
         action="store",
@@ -167,6 +211,116 @@ def setup_arguments_parser(settings: Settings):
         default=settings.max_connections,
         help=f"Allowed number of concurrent connections (default {settings.max_connections}).",
     )
+    parser.add_argument(
+        "--adaptive-connections",
+        action="store_true",
+        dest="adaptive_connections",
+        default=False,
+        help="Adjust number of concurrent connections automatically by latency and errors, "
+        "using --max-connections as the upper bound.",
+    )
+    parser.add_argument(
+        "--min-connections",
+        action="store",
+        type=int,
+        dest="min_connections",
+        default=getattr(settings, 'min_connections', MIN_CONNECTIONS),
+        help="Lower bound of concurrent connections for --adaptive-connections "
+        f"(default {getattr(settings, 'min_connections', MIN_CONNECTIONS)}).",
+    )
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        metavar='WORKERS',
+        dest="workers",
+        default=1,
+        help="Number of processes to check sites in, --max-connections are divided "
+        "between them (default 1, checks in the main process).",
+    )
+    parser.add_argument(
+        "--record",
+        metavar='ARCHIVE',
+        dest="record",
+        default=None,
+        help="Save all requests and responses of the scan to a compressed archive.",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar='ARCHIVE',
+        dest="replay",
+        default=None,
+        help="Take responses from an archive saved with --record instead of network.",
+    )
+    parser.add_argument(
+        "--replay-time-scale",
+        metavar='SCALE',
+        dest="replay_time_scale",
+        type=float,
+        default=1.0,
+        help="Multiplier of recorded response times for --replay, "
+        "0 to reply instantly (default 1).",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        dest="profile",
+        default=False,
+        help="Measure time of the scan stages and show it at the end.",
+    )
+    parser.add_argument(
+        "--profile-pstats",
+        metavar='FILE',
+        dest="profile_pstats",
+        default=None,
+        help="Save cProfile statistics of the run to a pstats file, implies --profile.",
+    )
+    parser.add_argument(
+        "--profile-trace",
+        metavar='FILE',
+        dest="profile_trace",
+        default=None,
+        help="Save timeline of the scan stages in Chrome trace JSON format, "
+        "implies --profile.",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        metavar='PORT',
+        type=int,
+        nargs='?',
+        const=DEFAULT_METRICS_PORT,
+        default=None,
+        dest="metrics_port",
+        help="Expose scan metrics in Prometheus format on http://127.0.0.1:PORT/metrics "
+        f"(default: {DEFAULT_METRICS_PORT} if no PORT is provided).",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar='FILE',
+        dest="metrics_file",
+        default=None,
+        help="Keep scan metrics in Prometheus text format in a file, "
+        "e.g. for node_exporter textfile collector.",
+    )
+    parser.add_argument(
+        "--cluster-coordinator",
+        metavar='[HOST:]PORT',
+        nargs='?',
+        const=str(DEFAULT_CLUSTER_PORT),
+        default=None,
+        dest="cluster_coordinator",
+        help="Distribute checks between cluster workers connected to this address "
+        f"(default: port {DEFAULT_CLUSTER_PORT} on 127.0.0.1).",
+    )
+    parser.add_argument(
+        "--cluster-token",
+        metavar='TOKEN',
+        default=os.environ.get('MAIGRET_CLUSTER_TOKEN'),
+        dest="cluster_token",
+        help="Shared secret of the cluster coordinator and workers, required "
+        "for a coordinator on a non-loopback address "
+        "(default: MAIGRET_CLUSTER_TOKEN environment variable).",
+    )
     parser.add_argument(
         "--no-recursion",
         action="store_true",
@@ -194,6 +348,14 @@ def setup_arguments_parser(settings: Settings):
         default=False,
         help="Permute at least 2 usernames to generate more possible usernames.",
     )
+    parser.add_argument(
+        "--permute-limit",
+        metavar='LIMIT',
+        type=int,
+        default=1000,
+        dest="permute_limit",
+        help="Max number of the most likely permutations to check (default 1000).",
+    )
     parser.add_argument(
         "--db",
         metavar="DB_FILE",
@@ -234,6 +396,14 @@ def setup_arguments_parser(settings: Settings):
         default=settings.proxy_url,
         help="Make requests over a proxy. e.g. socks5://127.0.0.1:1080",
     )
+    parser.add_argument(
+        "--proxy-list",
+        metavar='FILE',
+        dest="proxy_list",
+        default=None,
+        help="Spread requests over proxies from a file (one URL per line) "
+        "according to their health, in addition to `proxy_list` of settings.",
+    )
     parser.add_argument(
         "--tor-proxy",
         metavar='TOR_PROXY_URL',
@@ -241,6 +411,15 @@ def setup_arguments_parser(settings: Settings):
         default=settings.tor_proxy_url,
         help="Specify URL of your Tor gateway. Default is socks5://127.0.0.1:9050",
     )
+    parser.add_argument(
+        "--tor-circuits",
+        metavar='N',
+        type=int,
+        default=TOR_CIRCUITS,
+        dest="tor_circuits",
+        help="Spread checks of onion sites over N isolated Tor circuits with "
+        f"keep-alive connections (default {TOR_CIRCUITS}, 0 to disable).",
+    )
     parser.add_argument(
         "--i2p-proxy",
         metavar='I2P_PROXY_URL',
@@ -254,6 +433,29 @@ def setup_arguments_parser(settings: Settings):
         default=settings.domain_search,
         help="Enable (experimental) feature of checking domains on usernames.",
     )
+    parser.add_argument(
+        "--dns-nameserver",
+        metavar='IP[:PORT]',
+        action="append",
+        dest="dns_nameservers",
+        help="Resolve domains with the given nameserver instead of the system "
+        "ones, may be repeated.",
+    )
+    parser.add_argument(
+        "--dns-queries",
+        metavar='N',
+        type=int,
+        default=DNS_QUERIES_LIMIT,
+        dest="dns_queries",
+        help=f"Limit of concurrent DNS queries (default {DNS_QUERIES_LIMIT}), "
+        "apart from connections of HTTP checks.",
+    )
+    parser.add_argument(
+        "--dns-all-records",
+        action="store_true",
+        default=False,
+        help="Count domains with AAAA or CNAME records only as existing too.",
+    )
 
     filter_group = parser.add_argument_group(
         'Site filtering', 'Options to set site search scope'
@@ -333,6 +535,24 @@ def setup_arguments_parser(settings: Settings):
         default=None,  # Explicitly set default to None
         help="Launch the web interface on the specified port (default: 5000 if no PORT is provided).",
     )
+    modes_group.add_argument(
+        "--serve",
+        metavar='PORT',
+        type=int,
+        nargs='?',
+        const=DEFAULT_SERVICE_PORT,
+        default=None,
+        help="Launch the scan service with JSON API on the specified port "
+        f"(default: {DEFAULT_SERVICE_PORT} if no PORT is provided).",
+    )
+    modes_group.add_argument(
+        "--cluster-worker",
+        metavar='COORDINATOR_URL',
+        default=None,
+        dest="cluster_worker",
+        help="Run as a cluster worker: check sites for the coordinator "
+        "(e.g. http://10.0.0.1:5006) until interrupted.",
+    )
     output_group = parser.add_argument_group(
         'Output options', 'Options to change verbosity and view of the console output'
     )
@@ -387,7 +607,7 @@ def setup_arguments_parser(settings: Settings):
         action="store_true",
         dest="no_progressbar",
         default=(not settings.show_progressbar),
-        help="Don't show progressbar.",
+        help="Don't show progressbar (it's never shown when output is not a terminal).",
     )
 
     report_group = parser.add_argument_group(
@@ -493,6 +713,14 @@ async def main():
         log_level = logging.WARNING
     logger.setLevel(log_level)
 
+    profiler = None
+    if args.profile or args.profile_pstats or args.profile_trace:
+        profiler = enable_profiler(trace=bool(args.profile_trace))
+    cprofile = None
+    if args.profile_pstats:
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+
     if args.web is not None:
         from maigret.web.app import app
 
@@ -502,6 +730,24 @@ async def main():
         app.run(port=port)
         return
 
+    metrics_runner = None
+    metrics_writer = None
+    if args.metrics_port or args.metrics_file:
+        enable_metrics()
+        if args.metrics_port:
+            metrics_runner = await start_metrics_server(port=args.metrics_port)
+        if args.metrics_file:
+            metrics_writer = asyncio.create_task(
+                write_textfile_periodically(args.metrics_file)
+            )
+
+    async def stop_metrics():
+        if metrics_writer:
+            metrics_writer.cancel()
+            await asyncio.gather(metrics_writer, return_exceptions=True)
+        if metrics_runner:
+            await metrics_runner.cleanup()
+
     # Usernames initial list
     usernames = {
         u: args.id_type
@@ -509,9 +755,14 @@ async def main():
         if u and u not in ['-'] and u not in args.ignore_ids_list
     }
     original_usernames = ""
+    permutations = iter(())
     if args.permute and len(usernames) > 1 and args.id_type == 'username':
         original_usernames = " ".join(usernames.keys())
-        usernames = Permute(usernames).gather(method='strict')
+        # candidates are generated while the scan goes, the likely ones first
+        permutations = Permute(usernames).generate(
+            method='strict', limit=args.permute_limit
+        )
+        usernames = {}
 
     parsing_enabled = not args.disable_extracting
     recursive_search_enabled = not args.disable_recursive_search
@@ -535,23 +786,109 @@ async def main():
         args.top_sites = sys.maxsize
 
     # Create notify object for query results.
+    output = TerminalWriter()
     query_notify = QueryNotifyPrint(
         result=None,
         verbose=args.verbose,
         print_found_only=not args.print_not_found,
         skip_check_errors=not args.print_check_errors,
         color=not args.no_color,
+        output=output,
     )
+    # plain output to pipes and files
+    if not output.is_tty:
+        args.no_progressbar = True
 
     # Create object with all information about sites we are aware of.
-    db = MaigretDatabase().load_from_path(db_file)
-    get_top_sites_for_id = lambda x: db.ranked_sites_dict(
-        top=args.top_sites,
-        tags=args.tags,
-        names=args.site_list,
-        disabled=args.use_disabled_sites,
-        id_type=x,
+    with stage('db_load'):
+        db = MaigretDatabase().load_from_path(db_file)
+        try:
+            db.load_stats_from_file(DEFAULT_STATS_FILE)
+        except ValueError as e:
+            logger.warning(e)
+
+    search_kwargs = dict(
+        proxy=args.proxy,
+        tor_proxy=args.tor_proxy,
+        tor_circuits=args.tor_circuits,
+        i2p_proxy=args.i2p_proxy,
+        timeout=args.timeout,
+        is_parsing_enabled=parsing_enabled,
+        debug=args.verbose,
+        cookies=args.cookie_file,
+        forced=args.use_disabled_sites,
+        max_connections=args.connections,
+        adaptive_connections=args.adaptive_connections,
+        min_connections=args.min_connections,
+        adaptive_timeouts=args.adaptive_timeouts,
+        min_timeout=args.min_timeout,
+        retries=args.retries,
+        check_domains=args.with_domains,
     )
+    if args.with_domains:
+        search_kwargs['dns_options'] = dict(
+            nameservers=args.dns_nameservers,
+            record_types=RECORD_TYPES if args.dns_all_records else ('A',),
+            max_queries=args.dns_queries,
+        )
+
+    proxies = list(getattr(settings, 'proxy_list', None) or [])
+    if args.proxy_list:
+        proxies += load_proxy_list(args.proxy_list)
+    if proxies:
+        if args.proxy:
+            proxies.insert(0, args.proxy)
+        search_kwargs['proxy'] = proxies
+
+    if args.cluster_worker:
+        worker = ClusterWorker(
+            args.cluster_worker,
+            db,
+            logger,
+            token=args.cluster_token or '',
+            **search_kwargs,
+        )
+        query_notify.warning(f'Checking sites for coordinator {args.cluster_worker}')
+        try:
+            await worker.run()
+        finally:
+            db.save_stats_to_file(DEFAULT_STATS_FILE)
+            await stop_metrics()
+        return
+
+    if args.serve is not None:
+        service = ScanService(
+            db,
+            logger,
+            timeout=args.timeout,
+            max_connections=args.connections,
+            adaptive_connections=args.adaptive_connections,
+            min_connections=args.min_connections,
+            retries=args.retries,
+            proxy=search_kwargs['proxy'],
+            tor_proxy=args.tor_proxy,
+            tor_circuits=args.tor_circuits,
+            i2p_proxy=args.i2p_proxy,
+            cookies=args.cookie_file,
+            check_domains=args.with_domains,
+            dns_options=search_kwargs.get('dns_options'),
+        )
+        try:
+            await serve(service, port=args.serve)
+        finally:
+            db.save_stats_to_file(DEFAULT_STATS_FILE)
+            await stop_metrics()
+        return
+
+    def get_top_sites_for_id(id_type):
+        with stage('ranked_sites_dict'):
+            return db.ranked_sites_dict(
+                top=args.top_sites,
+                tags=args.tags,
+                names=args.site_list,
+                disabled=args.use_disabled_sites,
+                id_type=id_type,
+            )
 
     site_data = get_top_sites_for_id(args.id_type)
 
@@ -583,6 +920,7 @@ async def main():
             i2p_proxy=args.i2p_proxy,
         )
         if is_need_update:
+            query_notify.flush()
             if input('Do you want to save changes permanently? [Yn]\n').lower() in (
                 'y',
                 '',
@@ -599,6 +937,7 @@ async def main():
 
     # Database statistics
     if args.stats:
+        query_notify.flush()
         print(db.get_db_stats())
 
     report_dir = path.join(os.getcwd(), args.folderoutput)
@@ -609,16 +948,18 @@ async def main():
     # Define one report filename template
     report_filepath_tpl = path.join(report_dir, 'report_{username}{postfix}')
 
-    if usernames == {}:
+    if usernames == {} and not original_usernames:
         # magic params to exit after init
         query_notify.warning('No usernames to check, exiting.')
         sys.exit(0)
 
-    if len(usernames) > 1 and args.permute and args.id_type == 'username':
+    permutation_sites = None
+    if original_usernames:
         query_notify.warning(
-            f"{len(usernames)} permutations from {original_usernames} to check..."
-            + get_dict_ascii_tree(usernames, prepend="\t")
+            f"Up to {args.permute_limit} permutations from {original_usernames} "
+            "to check on sites accepting them..."
         )
+        permutation_sites = UsernameSiteFilter(get_top_sites_for_id('username'))
 
     if not site_data:
         query_notify.warning('No sites to check, exiting!')
@@ -632,12 +973,76 @@ async def main():
             'You can run search by full list of sites with flag `-a`', '!'
         )
 
-    already_checked = set()
-    general_results = []
+    recorder = None
+    if args.replay:
+        replay = ReplayChecker(
+            ScanArchive.load(args.replay), time_scale=args.replay_time_scale
+        )
+        search_kwargs['wrap_checker'] = replay.wrap
+    elif args.record:
+        recorder = ArchiveWriter(args.record)
+        search_kwargs['wrap_checker'] = recorder.wrap
+
+    scanner = None
+    cluster_runner = None
+    if search_kwargs.get('wrap_checker') and (
+        args.cluster_coordinator or args.workers > 1
+    ):
+        query_notify.warning(
+            'Recording and replaying work only in the main process, '
+            'all sites are checked in it'
+        )
+    elif args.cluster_coordinator:
+        host, port = parse_address(args.cluster_coordinator)
+        if not args.cluster_token and not is_loopback(host):
+            query_notify.warning(f'Set --cluster-token to listen on {host}, exiting.')
+            sys.exit(2)
+        scanner = ClusterCoordinator(logger)
+        cluster_runner = await start_coordinator(
+            scanner, host, port, token=args.cluster_token or ''
+        )
+    elif args.workers > 1:
+        scanner = ShardedScanner(db, args.workers, logger, **search_kwargs)
+
+    # health of proxies and Tor circuits is kept between searches
+    cookie_jar = None
+    if not scanner and args.cookie_file:
+        cookie_jar = import_aiohttp_cookies(args.cookie_file)
+    proxy_pool = None
+    if len(proxies) > 1 and not scanner:
+        proxy_pool = ProxyPool(proxies, logger, cookie_jar=cookie_jar)
+        search_kwargs['proxy'] = proxy_pool
+    tor_pool = None
+    if args.tor_proxy and args.tor_circuits > 0 and not scanner:
+        tor_pool = TorCircuitPool(
+            args.tor_proxy, args.tor_circuits, logger, cookie_jar=cookie_jar
+        )
+        search_kwargs['tor_proxy'] = tor_pool
+    dns_resolver = None
+    if args.with_domains and not scanner:
+        dns_resolver = DnsResolver(logger=logger, **search_kwargs['dns_options'])
+        search_kwargs['dns_resolver'] = dns_resolver
+    transfer = None
+    if not scanner:
+        transfer = TransferStats()
+        search_kwargs['transfer'] = transfer
+        # site requests are compiled once for all the usernames
+        search_kwargs['site_plans'] = {}
 
-    while usernames:
-        username, id_type = list(usernames.items())[0]
-        del usernames[username]
+    already_checked = set()
+    # compact found accounts for the reports on all usernames
+    general_results = ResultStore()
+    rejected_permutations = 0
+
+    while True:
+        is_permutation = not usernames
+        if is_permutation:
+            username, id_type = next(permutations, (None, None))
+            if username is None:
+                break
+        else:
+            username, id_type = list(usernames.items())[0]
+            del usernames[username]
 
         if username.lower() in already_checked:
             continue
@@ -661,27 +1066,62 @@ async def main():
             )
             continue
 
-        sites_to_check = get_top_sites_for_id(id_type)
-
-        results = await maigret(
-            username=username,
-            site_dict=dict(sites_to_check),
-            query_notify=query_notify,
-            proxy=args.proxy,
-            tor_proxy=args.tor_proxy,
-            i2p_proxy=args.i2p_proxy,
-            timeout=args.timeout,
-            is_parsing_enabled=parsing_enabled,
-            id_type=id_type,
-            debug=args.verbose,
-            logger=logger,
-            cookies=args.cookie_file,
-            forced=args.use_disabled_sites,
-            max_connections=args.connections,
-            no_progressbar=args.no_progressbar,
-            retries=args.retries,
-            check_domains=args.with_domains,
+        if is_permutation:
+            # don't schedule checks which sites would reject by username format
+            sites_to_check = permutation_sites(username)
+            if not sites_to_check:
+                rejected_permutations += 1
+                continue
+        else:
+            sites_to_check = get_top_sites_for_id(id_type)
+
+        # CSV, TXT and JSON reports are written as checks finish, an
+        # interrupted search leaves complete reports of the checks done
+        report_writers = open_report_writers(
+            report_filepath_tpl,
+            username,
+            csv_report=args.csv,
+            txt_report=args.txt,
+            json_report=args.json,
         )
+        stream_reports = args.reports_sorting != "data"
+
+        def write_reports(sitename, site_result):
+            for writer in report_writers:
+                writer.add(sitename, site_result)
+
+        on_result = write_reports if report_writers and stream_reports else None
+        try:
+            if scanner:
+                results = await scanner.search(
+                    username,
+                    dict(sites_to_check),
+                    query_notify=query_notify,
+                    id_type=id_type,
+                    no_progressbar=args.no_progressbar,
+                    on_result=on_result,
+                )
+            else:
+                results = await maigret(
+                    username=username,
+                    site_dict=dict(sites_to_check),
+                    query_notify=query_notify,
+                    id_type=id_type,
+                    logger=logger,
+                    no_progressbar=args.no_progressbar,
+                    on_result=on_result,
+                    **search_kwargs,
+                )
+
+            if args.reports_sorting == "data":
+                results = sort_report_by_data_points(results)
+            if not stream_reports:
+                for sitename, site_result in results.items():
+                    write_reports(sitename, site_result)
+        finally:
+            with stage('reports'):
+                for writer in report_writers:
+                    writer.close()
 
         errs = errors.notify_about_errors(
             results, query_notify, show_statistics=args.verbose
@@ -689,10 +1129,7 @@ async def main():
         for e in errs:
             query_notify.warning(*e)
 
-        if args.reports_sorting == "data":
-            results = sort_report_by_data_points(results)
-
-        general_results.append((username, id_type, results))
+        general_results.add(username, id_type, results)
 
         # TODO: tests
         if recursive_search_enabled:
@@ -701,71 +1138,112 @@ async def main():
             usernames.update(extracted_ids)
 
         # reporting for a one username
-        if args.xmind:
-            username = username.replace('/', '_')
-            filename = report_filepath_tpl.format(username=username, postfix='.xmind')
-            save_xmind_report(filename, username, results)
-            query_notify.warning(f'XMind report for {username} saved in {filename}')
-
-        if args.csv:
-            username = username.replace('/', '_')
-            filename = report_filepath_tpl.format(username=username, postfix='.csv')
-            save_csv_report(filename, username, results)
-            query_notify.warning(f'CSV report for {username} saved in {filename}')
-
-        if args.txt:
-            username = username.replace('/', '_')
-            filename = report_filepath_tpl.format(username=username, postfix='.txt')
-            save_txt_report(filename, username, results)
-            query_notify.warning(f'TXT report for {username} saved in {filename}')
-
-        if args.json:
-            username = username.replace('/', '_')
-            filename = report_filepath_tpl.format(
-                username=username, postfix=f'_{args.json}.json'
-            )
-            save_json_report(filename, username, results, report_type=args.json)
-            query_notify.warning(
-                f'JSON {args.json} report for {username} saved in {filename}'
-            )
+        with stage('reports'):
+            if args.xmind:
+                username = username.replace('/', '_')
+                filename = report_filepath_tpl.format(
+                    username=username, postfix='.xmind'
+                )
+                save_xmind_report(filename, username, results)
+                query_notify.warning(f'XMind report for {username} saved in {filename}')
+
+            for writer in report_writers:
+                query_notify.warning(
+                    f'{writer.title} report for {writer.username} '
+                    f'saved in {writer.filename}'
+                )
+
+    if rejected_permutations:
+        query_notify.warning(
+            f'{rejected_permutations} permutations are not allowed by any site'
+        )
 
-    # reporting for all the result
-    if general_results:
-        if args.html or args.pdf:
-            query_notify.warning('Generating report info...')
-        report_context = generate_report_context(general_results)
-        # determine main username
-        username = report_context['username']
-
-        if args.html:
-            username = username.replace('/', '_')
-            filename = report_filepath_tpl.format(
-                username=username, postfix='_plain.html'
+    if transfer and transfer.responses:
+        query_notify.info(f'Responses: {transfer.summary()}')
+        for host, wire_bytes, decoded_bytes in transfer.top_hosts():
+            logger.info(
+                f'{host}: {format_size(wire_bytes)} transferred, '
+                f'{format_size(decoded_bytes)} decoded'
             )
-            save_html_report(filename, report_context)
-            query_notify.warning(f'HTML report on all usernames saved in {filename}')
-
-        if args.pdf:
-            username = username.replace('/', '_')
-            filename = report_filepath_tpl.format(username=username, postfix='.pdf')
-            save_pdf_report(filename, report_context)
-            query_notify.warning(f'PDF report on all usernames saved in {filename}')
-
-        if args.graph:
-            username = username.replace('/', '_')
-            filename = report_filepath_tpl.format(
-                username=username, postfix='_graph.html'
-            )
-            save_graph_report(filename, general_results, db)
-            query_notify.warning(f'Graph report on all usernames saved in {filename}')
 
-        text_report = get_plaintext_report(report_context)
-        if text_report:
-            query_notify.info('Short text report:')
-            print(text_report)
+    if proxy_pool:
+        logger.info(f'Proxies health at the end: {proxy_pool.stats()}')
+        await proxy_pool.close()
+    if tor_pool:
+        await tor_pool.close()
+    if dns_resolver:
+        logger.info(f'DNS resolver at the end: {dns_resolver.stats()}')
+        await dns_resolver.close()
+
+    if cluster_runner:
+        await cluster_runner.cleanup()
+    elif scanner:
+        scanner.close()
+
+    if recorder:
+        recorder.close()
+        query_notify.warning(
+            f'{recorder.count} requests of the scan are saved in {args.record}'
+        )
+
+    # reporting for all the result
+    with stage('reports'):
+        if general_results:
+            if args.html or args.pdf:
+                query_notify.warning('Generating report info...')
+            report_context = generate_report_context(general_results)
+            # determine main username
+            username = report_context['username']
+
+            if args.html:
+                username = username.replace('/', '_')
+                filename = report_filepath_tpl.format(
+                    username=username, postfix='_plain.html'
+                )
+                save_html_report(filename, report_context)
+                query_notify.warning(
+                    f'HTML report on all usernames saved in {filename}'
+                )
+
+            if args.pdf:
+                username = username.replace('/', '_')
+                filename = report_filepath_tpl.format(username=username, postfix='.pdf')
+                save_pdf_report(filename, report_context)
+                query_notify.warning(f'PDF report on all usernames saved in {filename}')
+
+            if args.graph:
+                username = username.replace('/', '_')
+                filename = report_filepath_tpl.format(
+                    username=username, postfix='_graph.html'
+                )
+                save_graph_report(filename, general_results, db)
+                query_notify.warning(
+                    f'Graph report on all usernames saved in {filename}'
+                )
+
+            text_report = get_plaintext_report(report_context)
+            if text_report:
+                query_notify.info('Short text report:')
+                query_notify.flush()
+                print(text_report)
+    general_results.close()
 
     # update database
     db.save_to_file(db_file)
+    db.save_stats_to_file(DEFAULT_STATS_FILE)
+    await stop_metrics()
+
+    if cprofile:
+        cprofile.disable()
+        cprofile.dump_stats(args.profile_pstats)
+        query_notify.warning(f'Profiling stats saved in {args.profile_pstats}')
+    if profiler:
+        query_notify.flush()
+        print(profiler.report())
+        if args.profile_trace:
+            profiler.save_trace(args.profile_trace)
+            query_notify.warning(f'Timeline of the scan saved in {args.profile_trace}')
+    output.close()
 
 
 def run():
@@ -0,0 +1,294 @@
+"""Maigret scan metrics in Prometheus text format
+
+Live counters of the checking pipeline, switched on by `enable()`: checks
+queued and requests in flight, check statuses, error types (the same ones
+`errors.extract_and_group` groups by), durations of the scan stages,
+decoded and on-the-wire bytes of responses, and retries. While metrics are
+off, the module functions return at once, so the instrumented code may call
+them unconditionally.
+
+Metrics are updated from the event loop thread only, so they are plain
+numbers without locks. Checks of sharded workers (`--workers`) run in
+other processes and aren't counted.
+
+The registry is exposed by a local HTTP server on /metrics
+(`start_metrics_server`), by the scan service app, or written to a file
+for the node_exporter textfile collector (`write_textfile`).
+"""
+
+import asyncio
+import math
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+
+DEFAULT_PORT = 9105
+# seconds between rewrites of the metrics textfile
+TEXTFILE_INTERVAL = 5
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+Labels = Tuple[str, ...]
+
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, description: str, labelnames: Labels = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+
+    def format_labels(self, labels: Labels, extra: str = '') -> str:
+        pairs = [
+            f'{name}="{escape_label(str(value))}"'
+            for name, value in zip(self.labelnames, labels)
+        ]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self) -> Iterable[str]:
+        return []
+
+    def render(self) -> List[str]:
+        return [
+            f'# HELP {self.name} {self.description}',
+            f'# TYPE {self.name} {self.type}',
+            *self.samples(),
+        ]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, description: str, labelnames: Labels = ()):
+        super().__init__(name, description, labelnames)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, value: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def get(self, *labels: str) -> float:
+        return self.values.get(labels, 0)
+
+    def samples(self) -> Iterable[str]:
+        if not self.values and not self.labelnames:
+            yield f'{self.name} 0'
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{self.format_labels(labels)} {format_value(value)}'
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, *labels: str, value: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - value
+
+    def set(self, value: float, *labels: str):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Labels = (),
+        buckets: Tuple[float, ...] = STAGE_BUCKETS,
+    ):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # per labels: counts of observations in each bucket (not cumulative),
+        # sum and count of all observations
+        self.values: Dict[Labels, List] = {}
+
+    def observe(self, value: float, *labels: str):
+        data = self.values.get(labels)
+        if data is None:
+            data = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                data[0][i] += 1
+                break
+        data[1] += value
+        data[2] += 1
+
+    def samples(self) -> Iterable[str]:
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = self.format_labels(labels, f'le="{format_value(bound)}"')
+                yield f'{self.name}_bucket{le} {cumulative}'
+            yield f'{self.name}_sum{self.format_labels(labels)} {total}'
+            yield f'{self.name}_count{self.format_labels(labels)} {count}'
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def add(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path: str):
+        """Atomic rewrite, the collector never reads a partial file"""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+
+class ScanMetrics(MetricsRegistry):
+    """Metrics of the checking pipeline"""
+
+    def __init__(self):
+        super().__init__()
+        self.checks_queued = self.add(
+            Gauge('maigret_checks_queued', 'Checks waiting to be started.')
+        )
+        self.requests_in_flight = self.add(
+            Gauge('maigret_requests_in_flight', 'Site requests being made now.')
+        )
+        self.checks = self.add(
+            Counter('maigret_checks_total', 'Finished checks by status.', ('status',))
+        )
+        self.errors = self.add(
+            Counter('maigret_check_errors_total', 'Check errors by type.', ('type',))
+        )
+        self.retries = self.add(
+            Counter('maigret_check_retries_total', 'Restarts of failed checks.')
+        )
+        self.response_bytes = self.add(
+            Counter('maigret_response_bytes_total', 'Decoded response bodies size.')
+        )
+        self.response_wire_bytes = self.add(
+            Counter(
+                'maigret_response_wire_bytes_total',
+                'Response bodies size on the wire, before decompression.',
+            )
+        )
+        self.stage_duration = self.add(
+            Histogram(
+                'maigret_stage_duration_seconds',
+                'Duration of the scan stages.',
+                ('stage',),
+            )
+        )
+
+
+_metrics: Optional[ScanMetrics] = None
+
+
+def enable() -> ScanMetrics:
+    global _metrics
+    if _metrics is None:
+        _metrics = ScanMetrics()
+    return _metrics
+
+
+def disable():
+    global _metrics
+    _metrics = None
+
+
+def get_metrics() -> Optional[ScanMetrics]:
+    return _metrics
+
+
+def checks_queued(value: int):
+    if _metrics is not None:
+        _metrics.checks_queued.inc(value=value)
+
+
+def check_started(retry: int = 0):
+    if _metrics is None:
+        return
+    if retry:
+        _metrics.retries.inc()
+    else:
+        _metrics.checks_queued.dec()
+
+
+def request_started():
+    if _metrics is not None:
+        _metrics.requests_in_flight.inc()
+
+
+def request_finished():
+    if _metrics is not None:
+        _metrics.requests_in_flight.dec()
+
+
+def check_finished(status: str, error_type: Optional[str] = None):
+    if _metrics is None:
+        return
+    _metrics.checks.inc(status)
+    if error_type:
+        _metrics.errors.inc(error_type)
+
+
+def response_received(size: int, wire_size: Optional[int] = None):
+    if _metrics is not None:
+        _metrics.response_bytes.inc(value=size)
+        _metrics.response_wire_bytes.inc(value=size if wire_size is None else wire_size)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    registry = get_metrics() or MetricsRegistry()
+    return web.Response(
+        body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE}
+    )
+
+
+def make_metrics_app() -> web.Application:
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    return app
+
+
+async def start_metrics_server(host='127.0.0.1', port=DEFAULT_PORT) -> web.AppRunner:
+    runner = web.AppRunner(make_metrics_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def write_textfile_periodically(path: str, interval: float = TEXTFILE_INTERVAL):
+    """Rewrite the metrics file until the task is cancelled, and the last time
+    on cancellation"""
+    try:
+        while True:
+            registry = get_metrics()
+            if registry:
+                registry.write_textfile(path)
+            await asyncio.sleep(interval)
+    finally:
+        registry = get_metrics()
+        if registry:
+            registry.write_textfile(path)
@@ -4,13 +4,119 @@ This module defines the objects for notifying the caller about the
 results of queries.
 """
 
+import atexit
 import sys
+import threading
+from typing import List, Optional
 
 from colorama import Fore, Style, init
 
 from .result import MaigretCheckStatus
 from .utils import get_dict_ascii_tree
 
+# seconds between writes of buffered notifications
+OUTPUT_FLUSH_INTERVAL = 0.1
+# pending lines written at once, without waiting for the interval
+OUTPUT_MAX_LINES = 500
+# seconds between redraws of progress bars
+PROGRESS_REFRESH_SECS = 0.1
+# erases the current terminal line (e.g. a progress bar) before notifications
+CLEAR_LINE = "\x1b[1K\r"
+
+
+class TerminalWriter:
+    """
+    Output of notifications.
+
+    Buffered writer collects lines in memory, a background thread writes
+    them every `interval` seconds or as soon as `max_lines` are pending.
+    So writes to a slow terminal or a pipe don't stall the event loop,
+    and the progress bar is cleared once for a batch of lines.
+    Without a TTY lines are written as is, in one chunk.
+
+    `stream` is sys.stdout by default, taken at each write to go through
+    the progress bar hooks.
+    """
+
+    def __init__(
+        self,
+        stream=None,
+        buffered=True,
+        interval=OUTPUT_FLUSH_INTERVAL,
+        max_lines=OUTPUT_MAX_LINES,
+    ):
+        self._stream = stream
+        self.buffered = buffered
+        self.interval = interval
+        self.max_lines = max_lines
+        isatty = getattr(self.stream, "isatty", None)
+        self.is_tty = bool(isatty and isatty())
+        self.lines: List[str] = []
+        self._lock = threading.Lock()
+        # batches of the thread and of `flush` callers are written in order
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    @property
+    def stream(self):
+        return self._stream or sys.stdout
+
+    def write_line(self, line: str):
+        if not self.buffered:
+            with self._write_lock:
+                self._write([line])
+            return
+
+        with self._lock:
+            self.lines.append(line)
+            pending = len(self.lines)
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(
+                    target=self._run, name="maigret-output", daemon=True
+                )
+                self._thread.start()
+                # e.g. the search is interrupted
+                atexit.register(self.close)
+        if pending >= self.max_lines:
+            self._wakeup.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Writes pending lines in the caller thread"""
+        with self._write_lock:
+            with self._lock:
+                lines, self.lines = self.lines, []
+            if lines:
+                self._write(lines)
+
+    def _write(self, lines: List[str]):
+        stream = self.stream
+        if self.is_tty:
+            stream.write(CLEAR_LINE)
+            # line by line, as print() does, for the progress bar hooks
+            for line in lines:
+                stream.write(line)
+                stream.write("\n")
+        else:
+            stream.write("\n".join(lines) + "\n")
+        stream.flush()
+
+    def close(self):
+        """Stops the thread, pending lines are written"""
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            atexit.unregister(self.close)
+        self.flush()
+
 
 class QueryNotify:
     """Query Notify Object.
@@ -78,6 +184,21 @@ class QueryNotify:
 
         return
 
+    def flush(self):
+        """Notify Flush.
+
+        Notify method called when all the pending results must be shown,
+        e.g. before the progress bar of a search is closed.
+
+        Keyword Arguments:
+        self                   -- This object.
+
+        Return Value:
+        Nothing.
+        """
+
+        return
+
     def finish(self, message=None):
         """Notify Finish.
 
@@ -124,6 +245,7 @@ class QueryNotifyPrint(QueryNotify):
         print_found_only=False,
         skip_check_errors=False,
         color=True,
+        output=None,
     ):
         """Create Query Notify Print Object.
 
@@ -137,6 +259,8 @@ class QueryNotifyPrint(QueryNotify):
         verbose                -- Boolean indicating whether to give verbose output.
         print_found_only       -- Boolean indicating whether to only print found sites.
         color                  -- Boolean indicating whether to color terminal output
+        output                 -- TerminalWriter, lines are printed unbuffered
+                                  by default.
 
         Return Value:
         Nothing.
@@ -150,6 +274,7 @@ class QueryNotifyPrint(QueryNotify):
         self.print_found_only = print_found_only
         self.skip_check_errors = skip_check_errors
         self.color = color
+        self.output = output or TerminalWriter(buffered=False)
 
         return
 
@@ -190,7 +315,7 @@ class QueryNotifyPrint(QueryNotify):
 
         title = f"Checking {id_type}"
         if self.color:
-            print(
+            self.output.write_line(
                 Style.BRIGHT
                 + Fore.GREEN
                 + "["
@@ -204,13 +329,13 @@ class QueryNotifyPrint(QueryNotify):
                 + " on:"
             )
         else:
-            print(f"[*] {title} {message} on:")
+            self.output.write_line(f"[*] {title} {message} on:")
 
     def _colored_print(self, fore_color, msg):
         if self.color:
-            print(Style.BRIGHT + fore_color + msg)
+            self.output.write_line(Style.BRIGHT + fore_color + msg)
         else:
-            print(msg)
+            self.output.write_line(msg)
 
     def success(self, message, symbol="+"):
         msg = f"[{symbol}] {message}"
@@ -240,6 +365,10 @@ class QueryNotifyPrint(QueryNotify):
         notify = None
         self.result = result
 
+        # skipped results are not formatted at all
+        if not self.is_printed(result.status):
+            return None
+
         ids_data_text = ""
         if self.result.ids_data:
             ids_data_text = get_dict_ascii_tree(self.result.ids_data.items(), " ")
@@ -256,33 +385,30 @@ class QueryNotifyPrint(QueryNotify):
                 result.site_url_user + ids_data_text,
             )
         elif result.status == MaigretCheckStatus.AVAILABLE:
-            if not self.print_found_only:
-                notify = self.make_terminal_notify(
-                    "-",
-                    result.site_name,
-                    Fore.RED,
-                    Fore.YELLOW,
-                    "Not found!" + ids_data_text,
-                )
+            notify = self.make_terminal_notify(
+                "-",
+                result.site_name,
+                Fore.RED,
+                Fore.YELLOW,
+                "Not found!" + ids_data_text,
+            )
         elif result.status == MaigretCheckStatus.UNKNOWN:
-            if not self.skip_check_errors:
-                notify = self.make_terminal_notify(
-                    "?",
-                    result.site_name,
-                    Fore.RED,
-                    Fore.RED,
-                    str(self.result.error) + ids_data_text,
-                )
+            notify = self.make_terminal_notify(
+                "?",
+                result.site_name,
+                Fore.RED,
+                Fore.RED,
+                str(self.result.error) + ids_data_text,
+            )
         elif result.status == MaigretCheckStatus.ILLEGAL:
-            if not self.print_found_only:
-                text = "Illegal Username Format For This Site!"
-                notify = self.make_terminal_notify(
-                    "-",
-                    result.site_name,
-                    Fore.RED,
-                    Fore.YELLOW,
-                    text + ids_data_text,
-                )
+            text = "Illegal Username Format For This Site!"
+            notify = self.make_terminal_notify(
+                "-",
+                result.site_name,
+                Fore.RED,
+                Fore.YELLOW,
+                text + ids_data_text,
+            )
         else:
             # It should be impossible to ever get here...
             raise ValueError(
@@ -291,11 +417,23 @@ class QueryNotifyPrint(QueryNotify):
             )
 
         if notify:
-            sys.stdout.write("\x1b[1K\r")
-            print(notify)
+            self.output.write_line(notify)
 
         return notify
 
+    def is_printed(self, status):
+        if status in (MaigretCheckStatus.AVAILABLE, MaigretCheckStatus.ILLEGAL):
+            return not self.print_found_only
+        if status == MaigretCheckStatus.UNKNOWN:
+            return not self.skip_check_errors
+        return True
+
+    def flush(self):
+        self.output.flush()
+
+    def finish(self, message=None):
+        self.output.flush()
+
     def __str__(self):
         """Convert Object To String.
 
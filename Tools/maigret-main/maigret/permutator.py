@@ -1,26 +1,83 @@
 # License MIT. by balestek https://github.com/balestek
-from itertools import permutations
+import re
+from itertools import islice, permutations
+from typing import Dict, Iterator, List, Optional, Pattern, Tuple
+
+from .sites import MaigretSite
 
 
 class Permute:
     def __init__(self, elements: dict):
-        self.separators = ["", "_", "-", "."]
+        # the most common separators of usernames go first
+        self.separators = ["", ".", "_", "-"]
         self.elements = elements
 
+    def generate(
+        self, method: str = "strict" or "all", limit: Optional[int] = None
+    ) -> Iterator[Tuple[str, str]]:
+        """
+        Lazy unique permutations with the identifier types of their first
+        parts, the likely ones first: fewer parts, parts in the given order,
+        common separators, and underscore-decorated variants at the end
+        of each length.
+        """
+        return islice(self._generate(method), limit)
+
+    def _generate(self, method: str) -> Iterator[Tuple[str, str]]:
+        seen = set()
+
+        def unseen(variants):
+            for perm, first in variants:
+                if perm not in seen:
+                    seen.add(perm)
+                    yield perm, self.elements[first]
+
+        if method == "all":
+            yield from unseen((e, e) for e in self.elements)
+            yield from unseen((v, e) for e in self.elements for v in ("_" + e, e + "_"))
+
+        for i in range(2, len(self.elements) + 1):
+            for separator in self.separators:
+                yield from unseen(
+                    (separator.join(subset), subset[0])
+                    for subset in permutations(self.elements, i)
+                )
+            yield from unseen(
+                (v, subset[0])
+                for subset in permutations(self.elements, i)
+                for v in ("_" + "".join(subset), "".join(subset) + "_")
+            )
+
     def gather(self, method: str = "strict" or "all") -> dict:
-        permutations_dict = {}
-        for i in range(1, len(self.elements) + 1):
-            for subset in permutations(self.elements, i):
-                if i == 1:
-                    if method == "all":
-                        permutations_dict[subset[0]] = self.elements[subset[0]]
-                        permutations_dict["_" + subset[0]] = self.elements[subset[0]]
-                        permutations_dict[subset[0] + "_"] = self.elements[subset[0]]
-                else:
-                    for separator in self.separators:
-                        perm = separator.join(subset)
-                        permutations_dict[perm] = self.elements[subset[0]]
-                        if separator == "":
-                            permutations_dict["_" + perm] = self.elements[subset[0]]
-                            permutations_dict[perm + "_"] = self.elements[subset[0]]
-        return permutations_dict
+        return dict(self.generate(method))
+
+
+class UsernameSiteFilter:
+    """
+    Sites which username format (regexCheck) accepts a username.
+
+    Sites are grouped by their patterns, so a username is matched once
+    per distinct pattern, and impossible (username, site) checks are never
+    scheduled.
+    """
+
+    def __init__(self, sites: Dict[str, MaigretSite]):
+        self.free: List[Tuple[str, MaigretSite]] = []
+        self.groups: Dict[str, Tuple[Pattern, List[Tuple[str, MaigretSite]]]] = {}
+        for name, site in sites.items():
+            if not site.regex_check:
+                self.free.append((name, site))
+                continue
+            if site.regex_check not in self.groups:
+                self.groups[site.regex_check] = (re.compile(site.regex_check), [])
+            self.groups[site.regex_check][1].append((name, site))
+        self.order = {name: i for i, name in enumerate(sites)}
+
+    def __call__(self, username: str) -> Dict[str, MaigretSite]:
+        accepted = list(self.free)
+        for regex, group in self.groups.values():
+            if regex.search(username):
+                accepted.extend(group)
+        # keep the original (ranked) order of sites
+        accepted.sort(key=lambda x: self.order[x[0]])
+        return dict(accepted)
@@ -0,0 +1,185 @@
+"""Maigret scan stages profiler
+
+Timers and counters of the main stages of a scan, switched on by `enable()`.
+While it's off, `stage()` returns a shared no-op context manager, so
+instrumented code pays only for one function call.
+
+    with stage('check', site.name):
+        response = await checker.check()
+
+Stages may be nested (e.g. extraction is a part of results processing),
+time of a stage includes its nested stages. The timeline of stages can be
+saved in Chrome trace format (chrome://tracing, Perfetto), each concurrent
+asyncio task gets its own row.
+
+Stages are also observed by the duration histogram of scan metrics, when
+they are enabled (see `metrics`).
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from .metrics import ScanMetrics, get_metrics
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NO_STAGE = _NoStage()
+
+
+class StageStats:
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+class Stage:
+    __slots__ = ('profiler', 'metrics', 'name', 'detail', 'started')
+
+    def __init__(
+        self,
+        profiler: Optional["StageProfiler"],
+        metrics: Optional[ScanMetrics],
+        name: str,
+        detail: Optional[str],
+    ):
+        self.profiler = profiler
+        self.metrics = metrics
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *args):
+        finished = time.perf_counter_ns()
+        if self.profiler:
+            self.profiler.record(self.name, self.started, finished, self.detail)
+        if self.metrics:
+            self.metrics.stage_duration.observe(
+                (finished - self.started) / 1e9, self.name
+            )
+        return False
+
+
+class StageProfiler:
+    def __init__(self, trace: bool = False):
+        self.trace = trace
+        self.started = time.perf_counter_ns()
+        self.stages: Dict[str, StageStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.events: List[Dict[str, Any]] = []
+        self._lanes: Dict[int, int] = {}
+
+    def _lane(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is None:
+            return 0
+        return self._lanes.setdefault(id(task), len(self._lanes) + 1)
+
+    def record(self, name: str, started: int, finished: int, detail=None):
+        duration = finished - started
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        stats.count += 1
+        stats.total += duration
+        if duration > stats.max:
+            stats.max = duration
+
+        if self.trace:
+            event = {
+                'name': name,
+                'ph': 'X',
+                'ts': (started - self.started) / 1000,
+                'dur': duration / 1000,
+                'pid': 1,
+                'tid': self._lane(),
+            }
+            if detail:
+                event['args'] = {'detail': detail}
+            self.events.append(event)
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> str:
+        wall = (time.perf_counter_ns() - self.started) / 1e9
+        lines = [
+            f'Scan stages, wall time {wall:.2f}s:',
+            f"{'stage':<26} {'count':>7} {'total, s':>10} {'mean, ms':>9} "
+            f"{'max, ms':>9} {'% wall':>7}",
+        ]
+        stages = sorted(self.stages.items(), key=lambda x: x[1].total, reverse=True)
+        for name, stats in stages:
+            total = stats.total / 1e9
+            lines.append(
+                f'{name:<26} {stats.count:>7} {total:>10.3f} '
+                f'{stats.total / stats.count / 1e6:>9.2f} {stats.max / 1e6:>9.2f} '
+                f'{100 * total / wall if wall else 0:>6.1f}%'
+            )
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'{name:<26} {value:>7}')
+        return '\n'.join(lines)
+
+    def save_trace(self, filename: str):
+        lanes = [
+            {
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': 1,
+                'tid': lane,
+                'args': {'name': f'task {lane}' if lane else 'main'},
+            }
+            for lane in [0] + list(self._lanes.values())
+        ]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': lanes + self.events}, f)
+
+
+_profiler: Optional[StageProfiler] = None
+
+
+def enable(trace: bool = False) -> StageProfiler:
+    global _profiler
+    _profiler = StageProfiler(trace=trace)
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler() -> Optional[StageProfiler]:
+    return _profiler
+
+
+def stage(name: str, detail: Optional[str] = None):
+    """Context manager measuring a stage, no-op if profiling and metrics are off"""
+    metrics = get_metrics()
+    if _profiler is None and metrics is None:
+        return NO_STAGE
+    return Stage(_profiler, metrics, name, detail)
+
+
+def count(name: str, value: int = 1):
+    if _profiler is not None:
+        _profiler.count(name, value)
@@ -0,0 +1,213 @@
+"""Maigret scans recording and replaying
+
+`RecordingChecker` wraps a real checker and writes every request with its
+response (status, headers, body, error and time) to a gzipped JSON lines archive,
+equal bodies are stored once. `ReplayChecker` serves responses from such
+an archive without network, with original or scaled delays, so detection,
+extraction and reporting can be run and profiled offline on real traffic.
+
+    recorder = ArchiveWriter('scan.jsonl.gz')
+    await maigret(..., wrap_checker=recorder.wrap)
+    recorder.close()
+
+    replay = ReplayChecker(ScanArchive.load('scan.jsonl.gz'), time_scale=0)
+    await maigret(..., wrap_checker=replay.wrap)
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from multidict import CIMultiDict
+
+from .checking import CheckerBase
+from .errors import CheckError
+from .transfer import Body, ResponseBody
+
+ARCHIVE_FORMAT = 'maigret-scan-archive'
+ARCHIVE_VERSION = 1
+
+Response = Tuple[Body, int, Optional[CheckError]]
+
+
+def body_hash(body: str) -> str:
+    return hashlib.sha1(body.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+class ArchiveWriter:
+    """Writes exchanges to the archive as they come"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._bodies: set = set()
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._write({'format': ARCHIVE_FORMAT, 'version': ARCHIVE_VERSION})
+
+    def _write(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def add(self, request: Dict[str, Any], response: Response, elapsed: float):
+        body, status_code, error = response
+        # bodies of real checkers are bytes with a charset and headers
+        headers = getattr(body, 'headers', None)
+        body = str(body)
+        digest = body_hash(body)
+        if digest not in self._bodies:
+            self._bodies.add(digest)
+            self._write({'body_hash': digest, 'body': body})
+
+        self._write(
+            dict(
+                request,
+                status=status_code,
+                response_headers=list(headers.items()) if headers is not None else None,
+                body_hash=digest,
+                error=[error.type, error.desc, error.retry_after] if error else None,
+                elapsed=round(elapsed, 6),
+            )
+        )
+        self.count += 1
+
+    def wrap(self, checker) -> "RecordingChecker":
+        return RecordingChecker(checker, self)
+
+    def close(self):
+        self._file.close()
+
+
+class ScanArchive:
+    """Recorded exchanges by method and URL"""
+
+    def __init__(self):
+        self.exchanges: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self.bodies: Dict[str, str] = {}
+        self._positions: Dict[Tuple[str, str], int] = {}
+
+    def __len__(self):
+        return sum(len(v) for v in self.exchanges.values())
+
+    @classmethod
+    def load(cls, path: str) -> "ScanArchive":
+        archive = cls()
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline() or '{}')
+            if header.get('format') != ARCHIVE_FORMAT:
+                raise ValueError(f'{path} is not a maigret scan archive')
+            if header.get('version', 0) > ARCHIVE_VERSION:
+                raise ValueError(f'Unsupported archive version {header["version"]}')
+
+            for line in f:
+                record = json.loads(line)
+                if 'url' not in record:
+                    archive.bodies[record['body_hash']] = record['body']
+                    continue
+                key = (record['method'], record['url'])
+                archive.exchanges.setdefault(key, []).append(record)
+        return archive
+
+    def next(self, method: str, url: str) -> Optional[Dict[str, Any]]:
+        """Exchanges of the same request are served in the recorded order,
+        the last one is repeated"""
+        key = (method, url)
+        exchanges = self.exchanges.get(key)
+        if not exchanges:
+            return None
+        position = self._positions.get(key, 0)
+        self._positions[key] = position + 1
+        return exchanges[min(position, len(exchanges) - 1)]
+
+    def response(self, exchange: Dict[str, Any]) -> Response:
+        error = exchange['error']
+        body: Body = self.bodies[exchange['body_hash']]
+        headers = exchange.get('response_headers')
+        if headers is not None:
+            # the text is already decoded with the recorded charset
+            body = ResponseBody(
+                body.encode('utf-8', 'surrogatepass'), 'utf-8', CIMultiDict(headers)
+            )
+        return (
+            body,
+            exchange['status'],
+            CheckError(*error) if error else None,
+        )
+
+
+class RecordingChecker(CheckerBase):
+    """Checker proxy writing all requests and responses to the archive"""
+
+    def __init__(self, checker, writer: ArchiveWriter):
+        self.checker = checker
+        self.writer = writer
+        self.request: Dict[str, Any] = {}
+
+    @property
+    def proxy(self):
+        return getattr(self.checker, 'proxy', None)
+
+    def prepare(self, url, headers=None, allow_redirects=True, timeout=0, method='get'):
+        self.request = {
+            'method': method,
+            'url': url,
+            'headers': dict(headers or {}),
+            'allow_redirects': allow_redirects,
+        }
+        return self.checker.prepare(
+            url,
+            headers=headers,
+            allow_redirects=allow_redirects,
+            timeout=timeout,
+            method=method,
+        )
+
+    async def check(self) -> Response:
+        # checker is shared by all checks, the request is taken before awaiting
+        request = self.request
+        started_at = time.monotonic()
+        response = await self.checker.check()
+        self.writer.add(request, response, time.monotonic() - started_at)
+        return response
+
+    async def close(self):
+        await self.checker.close()
+
+
+class ReplayChecker(CheckerBase):
+    """
+    Serves responses from the archive instead of network.
+
+    Delays are the recorded ones multiplied by `time_scale`, 0 disables them.
+    Requests missing in the archive get a "Replay" error.
+    """
+
+    def __init__(self, archive: ScanArchive, time_scale: float = 1.0):
+        self.archive = archive
+        self.time_scale = time_scale
+        self.url = None
+        self.method = 'get'
+        self.missing = 0
+
+    def prepare(self, url, headers=None, allow_redirects=True, timeout=0, method='get'):
+        self.url = url
+        self.method = method
+        return None
+
+    def wrap(self, checker) -> "ReplayChecker":
+        return self
+
+    async def check(self) -> Response:
+        exchange = self.archive.next(self.method, self.url)
+        if exchange is None:
+            self.missing += 1
+            await asyncio.sleep(0)
+            return '', 0, CheckError('Replay', f'{self.url} is not recorded')
+
+        delay = exchange['elapsed'] * self.time_scale
+        await asyncio.sleep(delay)
+        return self.archive.response(exchange)
+
+    async def close(self):
+        pass
@@ -4,8 +4,9 @@ import io
 import json
 import logging
 import os
+from abc import ABC, abstractmethod
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 
 import xmind
 from dateutil.tz import gettz
@@ -23,6 +24,8 @@ SUPPORTED_JSON_REPORT_FORMATS = [
     "simple",
     "ndjson",
 ]
+# rows of streaming reports written to disk at once
+REPORT_FLUSH_ROWS = 50
 
 """
 UTILS
@@ -58,13 +61,11 @@ REPORTS SAVING
 
 
 def save_csv_report(filename: str, username: str, results: dict):
-    with open(filename, "w", newline="", encoding="utf-8") as f:
-        generate_csv_report(username, results, f)
+    save_report(CsvReportWriter.open(filename, username), results)
 
 
 def save_txt_report(filename: str, username: str, results: dict):
-    with open(filename, "w", encoding="utf-8") as f:
-        generate_txt_report(username, results, f)
+    save_report(TxtReportWriter.open(filename, username), results)
 
 
 def save_html_report(filename: str, context: dict):
@@ -77,17 +78,28 @@ def save_html_report(filename: str, context: dict):
 def save_pdf_report(filename: str, context: dict):
     template, css = generate_report_template(is_pdf=True)
     filled_template = template.render(**context)
+    convert_html_to_pdf(filename, filled_template, css)
+
 
+def convert_html_to_pdf(filename: str, html: str, css: str):
+    """CPU-heavy part of PDF report saving, can be run in a separate process"""
     # moved here to speed up the launch of Maigret
     from xhtml2pdf import pisa
 
     with open(filename, "w+b") as f:
-        pisa.pisaDocument(io.StringIO(filled_template), dest=f, default_css=css)
+        pisa.pisaDocument(io.StringIO(html), dest=f, default_css=css)
 
 
 def save_json_report(filename: str, username: str, results: dict, report_type: str):
-    with open(filename, "w", encoding="utf-8") as f:
-        generate_json_report(username, results, f, report_type=report_type)
+    save_report(JsonReportWriter.open(filename, username, report_type), results)
+
+
+def save_report(writer: "ReportWriter", results: dict):
+    try:
+        for sitename, site_result in results.items():
+            writer.add(sitename, site_result)
+    finally:
+        writer.close()
 
 
 class MaigretGraph:
@@ -221,7 +233,8 @@ def save_graph_report(filename: str, username_results: list, db: MaigretDatabase
 
     # Generate interactive visualization
     from pyvis.network import Network
-    nt = Network(notebook=True, height="750px", width="100%")
+    # scripts are embedded, nothing is written next to the report
+    nt = Network(notebook=True, height="750px", width="100%", cdn_resources="in_line")
     nt.from_nx(G)
     nt.show(filename)
 
@@ -402,71 +415,219 @@ def generate_report_context(username_results: list):
 
 
 def generate_csv_report(username: str, results: dict, csvfile):
-    writer = csv.writer(csvfile)
-    writer.writerow(
-        ["username", "name", "url_main", "url_user", "exists", "http_status"]
-    )
+    writer = CsvReportWriter(username, csvfile)
     for site in results:
+        writer.add(site, results[site])
+    writer.finish()
+
+
+def generate_txt_report(username: str, results: dict, file):
+    writer = TxtReportWriter(username, file)
+    for website_name in results:
+        writer.add(website_name, results[website_name])
+    writer.finish()
+
+
+def generate_json_report(username: str, results: dict, file, report_type):
+    writer = JsonReportWriter(username, file, report_type)
+    for sitename in results:
+        writer.add(sitename, results[sitename])
+    writer.finish()
+
+
+"""
+STREAMING REPORTS
+"""
+
+
+class ReportWriter(ABC):
+    """
+    Report of one username, written row by row as checks finish.
+
+    Rows are written to the file in batches of `flush_rows`. After every
+    batch the footer of the format (e.g. the closing brace of a JSON object)
+    is written and flushed too, and overwritten by the next batch, so the
+    file on disk is always a complete report of the checks done so far.
+    """
+
+    title = ""
+    newline: Optional[str] = None
+
+    def __init__(self, username: str, file, flush_rows: int = REPORT_FLUSH_ROWS):
+        self.username = username
+        self.file = file
+        self.flush_rows = flush_rows
+        self.filename: Optional[str] = None
+        self.rows: List[str] = []
+        self.count = 0
+
+    @classmethod
+    def open(cls, filename: str, username: str, *args, **kwargs) -> "ReportWriter":
+        file = open(filename, "w", newline=cls.newline, encoding="utf-8")
+        writer = cls(username, file, *args, **kwargs)
+        writer.filename = filename
+        # an empty report until the first batch
+        writer.flush()
+        return writer
+
+    @abstractmethod
+    def make_row(self, sitename: str, site_result: dict) -> Optional[str]:
+        """Row of the site result, None to skip it"""
+
+    def footer(self) -> str:
+        return ""
+
+    def add(self, sitename: str, site_result: dict):
+        row = self.make_row(sitename, site_result)
+        if row is None:
+            return
+        self.rows.append(row)
+        self.count += 1
+        if len(self.rows) >= self.flush_rows:
+            self.flush()
+
+    def _write_rows(self):
+        if self.rows:
+            self.file.write("".join(self.rows))
+            self.rows = []
+
+    def flush(self):
+        self._write_rows()
+        position = self.file.tell()
+        self.file.write(self.footer())
+        self.file.truncate()
+        self.file.flush()
+        self.file.seek(position)
+
+    def finish(self):
+        self._write_rows()
+        self.file.write(self.footer())
+
+    def close(self):
+        """Finishes the report and closes the file opened by `open`"""
+        self.finish()
+        if self.filename:
+            self.file.truncate()
+            self.file.close()
+
+
+class CsvReportWriter(ReportWriter):
+    title = "CSV"
+    newline = ""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buffer = io.StringIO()
+        self.csv = csv.writer(self.buffer)
+        self.csv.writerow(
+            ["username", "name", "url_main", "url_user", "exists", "http_status"]
+        )
+        self.rows.append(self._pop_buffer())
+
+    def _pop_buffer(self) -> str:
+        row = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return row
+
+    def make_row(self, sitename: str, site_result: dict) -> Optional[str]:
         # TODO: fix the reason
         status = 'Unknown'
-        if "status" in results[site]:
-            status = str(results[site]["status"].status)
-        writer.writerow(
+        if "status" in site_result:
+            status = str(site_result["status"].status)
+        self.csv.writerow(
             [
-                username,
-                site,
-                results[site].get("url_main", ""),
-                results[site].get("url_user", ""),
+                self.username,
+                sitename,
+                site_result.get("url_main", ""),
+                site_result.get("url_user", ""),
                 status,
-                results[site].get("http_status", 0),
+                site_result.get("http_status", 0),
             ]
         )
+        return self._pop_buffer()
 
 
-def generate_txt_report(username: str, results: dict, file):
-    exists_counter = 0
-    for website_name in results:
-        dictionary = results[website_name]
+class TxtReportWriter(ReportWriter):
+    title = "TXT"
+
+    def make_row(self, sitename: str, site_result: dict) -> Optional[str]:
         # TODO: fix no site data issue
-        if not dictionary:
-            continue
+        if not site_result:
+            return None
         if (
-            dictionary.get("status")
-            and dictionary["status"].status == MaigretCheckStatus.CLAIMED
+            site_result.get("status")
+            and site_result["status"].status == MaigretCheckStatus.CLAIMED
         ):
-            exists_counter += 1
-            file.write(dictionary["url_user"] + "\n")
-    file.write(f"Total Websites Username Detected On : {exists_counter}")
+            return site_result["url_user"] + "\n"
+        return None
 
+    def footer(self) -> str:
+        return f"Total Websites Username Detected On : {self.count}"
 
-def generate_json_report(username: str, results: dict, file, report_type):
-    is_report_per_line = report_type.startswith("ndjson")
-    all_json = {}
 
-    for sitename in results:
-        site_result = results[sitename]
+class JsonReportWriter(ReportWriter):
+    """
+    Found accounts as JSON lines (ndjson) or one JSON object (simple),
+    encoded entry by entry as `json.dumps` of the whole object would do.
+    """
+
+    def __init__(self, username: str, file, report_type: str, *args, **kwargs):
+        super().__init__(username, file, *args, **kwargs)
+        self.report_type = report_type
+        self.is_report_per_line = report_type.startswith("ndjson")
+        self.title = f"JSON {report_type}"
+
+    def make_row(self, sitename: str, site_result: dict) -> Optional[str]:
         # TODO: fix no site data issue
         if not site_result or not site_result.get("status"):
-            continue
+            return None
 
         if site_result["status"].status != MaigretCheckStatus.CLAIMED:
-            continue
+            return None
 
         data = dict(site_result)
         data["status"] = data["status"].json()
         data["site"] = data["site"].json
-        for field in ["future", "checker"]:
+        for field in ["future", "checker", "plan"]:
             if field in data:
                 del data[field]
 
-        if is_report_per_line:
+        if self.is_report_per_line:
             data["sitename"] = sitename
-            file.write(json.dumps(data) + "\n")
-        else:
-            all_json[sitename] = data
-
-    if not is_report_per_line:
-        file.write(json.dumps(all_json))
+            return json.dumps(data) + "\n"
+
+        separator = ", " if self.count else "{"
+        return f"{separator}{json.dumps(sitename)}: {json.dumps(data)}"
+
+    def footer(self) -> str:
+        if self.is_report_per_line:
+            return ""
+        return "}" if self.count else "{}"
+
+
+def open_report_writers(
+    filename_tpl: str,
+    username: str,
+    csv_report: bool = False,
+    txt_report: bool = False,
+    json_report: Optional[str] = None,
+) -> List[ReportWriter]:
+    """Streaming reports of the username enabled by the flags"""
+    username = username.replace('/', '_')
+    writers: List[ReportWriter] = []
+    if csv_report:
+        filename = filename_tpl.format(username=username, postfix='.csv')
+        writers.append(CsvReportWriter.open(filename, username))
+    if txt_report:
+        filename = filename_tpl.format(username=username, postfix='.txt')
+        writers.append(TxtReportWriter.open(filename, username))
+    if json_report:
+        filename = filename_tpl.format(
+            username=username, postfix=f'_{json_report}.json'
+        )
+        writers.append(JsonReportWriter.open(filename, username, json_report))
+    return writers
 
 
 """
@@ -0,0 +1,241 @@
+"""Maigret DNS check engine
+
+Domain checks (`--with-domains`) only ask whether a name resolves, so they
+don't need HTTP workers: `DnsResolver` makes them with one asynchronous
+resolver on the running loop, under its own limit of concurrent queries.
+Queries of the same domain are made once, answers are cached for the
+record TTL (clamped to DNS_MIN_TTL..DNS_MAX_TTL), nonexistent domains for
+DNS_NEGATIVE_TTL. Resolving failures (SERVFAIL, timeouts, refused queries)
+are not cached.
+
+A records are queried first; AAAA and CNAME ones, when enabled, only for
+names existing without A records.
+
+    resolver = DnsResolver(nameservers=['1.1.1.1'], record_types=RECORD_TYPES)
+    answer = await resolver.resolve('soxoj.com')
+    answer.found, answer.address
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiodns
+from aiodns import error as dns_errors
+from aiodns.error import DNSError
+
+try:
+    from mock import Mock
+except ImportError:
+    from unittest.mock import Mock
+
+from .errors import CheckError
+
+# concurrent queries of a resolver
+DNS_QUERIES_LIMIT = 200
+# seconds
+DNS_TIMEOUT = 3
+DNS_NEGATIVE_TTL = 300
+DNS_MIN_TTL = 30
+DNS_MAX_TTL = 3600
+DNS_CACHE_SIZE = 100000
+DNS_TRIES = 2
+
+RECORD_TYPES = ('A', 'AAAA', 'CNAME')
+# the domain exists, without records of the type
+NO_DATA_ERRORS = (dns_errors.ARES_ENODATA,)
+# the domain doesn't exist
+NOT_FOUND_ERRORS = (dns_errors.ARES_ENOTFOUND, dns_errors.ARES_ENONAME)
+
+
+class DnsAnswer:
+    __slots__ = ('domain', 'records', 'error', 'expires_at')
+
+    def __init__(self, domain: str):
+        self.domain = domain
+        # record type -> values
+        self.records: Dict[str, List[str]] = {}
+        self.error: Optional[CheckError] = None
+        self.expires_at = 0.0
+
+    @property
+    def found(self) -> bool:
+        return bool(self.records)
+
+    @property
+    def address(self) -> str:
+        for values in self.records.values():
+            return values[0]
+        return ''
+
+
+def record_value(record: Any) -> str:
+    # pycares >= 5 records keep values in `data`
+    data = getattr(record, 'data', record)
+    for attr in ('addr', 'host', 'cname'):
+        value = getattr(data, attr, None)
+        if value:
+            return str(value)
+    return str(data)
+
+
+class DnsResolver:
+    """
+    Shared resolver of domain checks, may be used by several scans.
+    """
+
+    def __init__(
+        self,
+        nameservers: Optional[List[str]] = None,
+        record_types: Tuple[str, ...] = ('A',),
+        max_queries: int = DNS_QUERIES_LIMIT,
+        logger=None,
+        **kwargs,
+    ):
+        unknown = set(record_types) - set(RECORD_TYPES)
+        if unknown:
+            raise ValueError(f'Unsupported DNS record types: {", ".join(unknown)}')
+        self.nameservers = nameservers or []
+        self.record_types = record_types
+        self.max_queries = max_queries
+        self.logger = logger or Mock()
+        self.timeout = kwargs.get('timeout', DNS_TIMEOUT)
+        self.tries = kwargs.get('tries', DNS_TRIES)
+        self.negative_ttl = kwargs.get('negative_ttl', DNS_NEGATIVE_TTL)
+        self.min_ttl = kwargs.get('min_ttl', DNS_MIN_TTL)
+        self.max_ttl = kwargs.get('max_ttl', DNS_MAX_TTL)
+        self.cache_size = kwargs.get('cache_size', DNS_CACHE_SIZE)
+        self.cache: OrderedDict = OrderedDict()
+        self.pending: Dict[str, asyncio.Task] = {}
+        self.queries = 0
+        self.cache_hits = 0
+        self.deduplicated = 0
+        self.errors = 0
+        self._resolver = None
+        self._loop = None
+        self._semaphore = None
+
+    def _get_resolver(self):
+        # the resolver and the limit are bound to the loop of the scan
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._resolver = aiodns.DNSResolver(
+                nameservers=self.nameservers or None,
+                loop=loop,
+                timeout=self.timeout,
+                tries=self.tries,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_queries)
+            self._loop = loop
+        return self._resolver
+
+    def cached(self, domain: str) -> Optional[DnsAnswer]:
+        answer = self.cache.get(domain)
+        if answer is None:
+            return None
+        if answer.expires_at <= time.monotonic():
+            del self.cache[domain]
+            return None
+        self.cache.move_to_end(domain)
+        return answer
+
+    def _store(self, answer: DnsAnswer, ttl: Optional[int]):
+        if answer.error:
+            return
+        if ttl is None:
+            ttl = self.negative_ttl
+        ttl = min(self.max_ttl, max(self.min_ttl, ttl))
+        answer.expires_at = time.monotonic() + ttl
+        self.cache[answer.domain] = answer
+        self.cache.move_to_end(answer.domain)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def resolve(self, domain: str) -> DnsAnswer:
+        domain = domain.strip().rstrip('.').lower()
+        answer = self.cached(domain)
+        if answer:
+            self.cache_hits += 1
+            return answer
+
+        task = self.pending.get(domain)
+        if task:
+            self.deduplicated += 1
+        else:
+            task = asyncio.ensure_future(self._resolve(domain))
+            self.pending[domain] = task
+            task.add_done_callback(lambda _: self.pending.pop(domain, None))
+        # a cancelled check doesn't cancel the query awaited by others
+        return await asyncio.shield(task)
+
+    async def _query(self, domain: str, qtype: str) -> Tuple[List[str], int]:
+        """Values of the records and their minimal TTL"""
+        resolver = self._get_resolver()
+        if hasattr(resolver, 'query_dns'):
+            # aiodns >= 4
+            result = await resolver.query_dns(domain, qtype)
+            type_code = aiodns.query_type_map[qtype]
+            records = [r for r in result.answer if r.type == type_code]
+        else:
+            result = await resolver.query(domain, qtype)
+            records = result if isinstance(result, list) else [result]
+        if not records:
+            return [], 0
+        return [record_value(r) for r in records], min(r.ttl for r in records)
+
+    async def _resolve(self, domain: str) -> DnsAnswer:
+        self._get_resolver()
+        answer = DnsAnswer(domain)
+        ttl = None
+        async with self._semaphore:
+            for qtype in self.record_types:
+                self.queries += 1
+                try:
+                    values, record_ttl = await self._query(domain, qtype)
+                except DNSError as e:
+                    code = e.args[0] if e.args else None
+                    if code in NOT_FOUND_ERRORS:
+                        break
+                    if code in NO_DATA_ERRORS:
+                        continue
+                    message = e.args[1] if len(e.args) > 1 else str(e)
+                    answer.error = CheckError('DNS resolve error', message)
+                    break
+                except Exception as e:
+                    self.logger.warning(f'DNS query {qtype} {domain} failed: {e}')
+                    answer.error = CheckError('DNS resolve error', str(e))
+                    break
+                if values:
+                    answer.records[qtype] = values
+                    ttl = record_ttl
+                    break
+
+        if answer.error:
+            self.errors += 1
+            self.logger.debug(f'{domain}: {answer.error}')
+        self._store(answer, ttl)
+        return answer
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queries': self.queries,
+            'cache_hits': self.cache_hits,
+            'deduplicated': self.deduplicated,
+            'errors': self.errors,
+            'cached': len(self.cache),
+        }
+
+    async def close(self):
+        for task in list(self.pending.values()):
+            task.cancel()
+        resolver, self._resolver, self._loop = self._resolver, None, None
+        if resolver is None:
+            return
+        close = getattr(resolver, 'close', None)
+        if close is None:
+            resolver.cancel()
+        elif asyncio.iscoroutinefunction(close):
+            await close()
+        else:
+            close()
@@ -92,6 +92,17 @@ class MaigretCheckResult:
             "tags": self.tags,
         }
 
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            data["username"],
+            data["site_name"],
+            data["url"],
+            MaigretCheckStatus(data["status"]),
+            ids_data=data["ids"] or None,
+            tags=data["tags"],
+        )
+
     def is_found(self):
         return self.status == MaigretCheckStatus.CLAIMED
 
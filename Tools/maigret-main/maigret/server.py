@@ -0,0 +1,583 @@
+"""Maigret scan service
+
+Long-running asyncio server with a JSON API. Sites database, HTTP
+connections pool, DNS cache, activation tokens (kept in site headers)
+and recent check results stay warm between scans, and the concurrency
+limit is shared by all running scans. Proxies, Tor circuits and the DNS
+resolver are shared as well, sites of protocols without a configured
+checker (Tor, I2P, domains) are skipped.
+
+API:
+    POST /api/scans                 start a scan, returns its id
+    GET  /api/scans/{id}            scan status and results
+    GET  /api/scans/{id}/events     results stream (Server-Sent Events)
+    GET  /api/scans/{id}/ws         results stream (WebSocket)
+    GET  /api/status                service statistics
+    GET  /metrics                   scan metrics in Prometheus text format
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import ClientSession, DummyCookieJar, TCPConnector, WSMsgType, web
+
+from . import metrics
+from .activation import import_aiohttp_cookies
+from .checking import (
+    BAD_CHARS,
+    MIN_CONNECTIONS,
+    SUPPORTED_IDS,
+    TOR_CIRCUITS,
+    ProxyPool,
+    SitePlan,
+    TorCircuitPool,
+    maigret,
+)
+from .executors import AdaptiveConcurrencyLimiter
+from .notify import QueryNotify
+from .resolver import DnsResolver
+from .result import MaigretCheckResult, MaigretCheckStatus
+from .sites import MaigretDatabase
+from .types import QueryResultWrapper
+
+DEFAULT_PORT = 5005
+DEFAULT_TOP_SITES = 500
+# seconds to keep successful check results
+RESULTS_CACHE_TTL = 600
+RESULTS_CACHE_SIZE = 100000
+DNS_CACHE_TTL = 300
+# finished scans kept in memory
+MAX_FINISHED_JOBS = 1000
+MAX_USERNAMES_PER_JOB = 100
+# events of a scan kept for late subscribers
+JOB_EVENTS_BUFFER_SIZE = 512
+# events waiting for a subscriber, a slower one is disconnected
+SUBSCRIBER_QUEUE_SIZE = 2 * JOB_EVENTS_BUFFER_SIZE
+
+
+class ScanRequestError(ValueError):
+    pass
+
+
+def check_result_json(result: MaigretCheckResult) -> Dict[str, Any]:
+    data = result.json()
+    data['error'] = str(result.error) if result.error else None
+    return data
+
+
+class ResultsCache:
+    """
+    LRU cache of conclusive check results with TTL.
+
+    Errors and unknown statuses are never cached.
+    """
+
+    def __init__(self, ttl=RESULTS_CACHE_TTL, max_size=RESULTS_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        item = self._items.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key: Tuple, result: MaigretCheckResult):
+        if self.ttl <= 0 or result.error:
+            return
+        if result.status not in (
+            MaigretCheckStatus.CLAIMED,
+            MaigretCheckStatus.AVAILABLE,
+        ):
+            return
+
+        self._items[key] = (time.monotonic() + self.ttl, check_result_json(result))
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+
+class ScanJob:
+    """
+    Scan of one or several usernames, keeps its last events for subscribers
+    """
+
+    def __init__(self, usernames: List[str], params: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.usernames = usernames
+        self.params = params
+        self.status = 'queued'
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.results: Dict[str, Dict[str, Any]] = {u: {} for u in usernames}
+        self.events: deque = deque(maxlen=JOB_EVENTS_BUFFER_SIZE)
+        self._subscribers: List[asyncio.Queue] = []
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ('completed', 'failed')
+
+    def publish(self, event: str, data: Dict[str, Any]):
+        self.events.append((event, data))
+        for queue in list(self._subscribers):
+            # the last place is kept for the end of the stream
+            if queue.qsize() >= queue.maxsize - 1:
+                self._subscribers.remove(queue)
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait((event, data))
+
+    def add_result(self, data: Dict[str, Any], cached=False):
+        self.results[data['username']][data['site_name']] = data
+        self.publish('result', dict(data, cached=cached))
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        self.publish('done', self.summary())
+        for queue in self._subscribers:
+            queue.put_nowait(None)
+        self._subscribers = []
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Queue with the kept past and all future events, ends with None,
+        also when the subscriber doesn't keep up with the events
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        for event in self.events:
+            queue.put_nowait(event)
+        if self.is_finished:
+            queue.put_nowait(None)
+        else:
+            self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'usernames': self.usernames,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'found': {
+                username: sorted(
+                    name
+                    for name, data in results.items()
+                    if data['status'] == str(MaigretCheckStatus.CLAIMED)
+                )
+                for username, results in self.results.items()
+            },
+        }
+
+    def json(self) -> Dict[str, Any]:
+        return dict(self.summary(), results=self.results)
+
+
+class JobQueryNotify(QueryNotify):
+    """Sends check results to the scan job and the results cache"""
+
+    def __init__(self, job: ScanJob, cache: ResultsCache, id_type: str):
+        super().__init__()
+        self.job = job
+        self.cache = cache
+        self.id_type = id_type
+
+    def update(self, result, is_similar=False):
+        self.result = result
+        key = (self.id_type, self.job.params['parsing'], result.username)
+        self.cache.put(key + (result.site_name,), result)
+        self.job.add_result(check_result_json(result))
+
+
+class ScanService:
+    """
+    Warm state shared by all scans: sites database, HTTP session with
+    connections pool and DNS cache, concurrency limiter and results cache.
+
+    Proxy options are the same as for `maigret.search`, `cookies` is
+    a cookies file for all the scans.
+    """
+
+    def __init__(self, db: MaigretDatabase, logger=None, **kwargs):
+        self.db = db
+        self.logger = logger or logging.getLogger('maigret')
+        self.timeout = kwargs.get('timeout', 30)
+        self.max_connections = kwargs.get('max_connections', 100)
+        self.adaptive_connections = kwargs.get('adaptive_connections', False)
+        self.min_connections = kwargs.get('min_connections', MIN_CONNECTIONS)
+        self.retries = kwargs.get('retries', 0)
+        self.dns_cache_ttl = kwargs.get('dns_cache_ttl', DNS_CACHE_TTL)
+        self.cache = ResultsCache(ttl=kwargs.get('cache_ttl', RESULTS_CACHE_TTL))
+        self.proxy = kwargs.get('proxy')
+        self.tor_proxy = kwargs.get('tor_proxy')
+        self.tor_circuits = kwargs.get('tor_circuits', TOR_CIRCUITS)
+        self.i2p_proxy = kwargs.get('i2p_proxy')
+        self.cookies = kwargs.get('cookies')
+        self.check_domains = kwargs.get('check_domains', False)
+        self.dns_options = kwargs.get('dns_options')
+        self.dns_resolver: Optional[DnsResolver] = None
+        self.jobs: OrderedDict = OrderedDict()
+        # compiled site requests, shared by all scans
+        self.site_plans: Dict[Tuple[str, str, str], SitePlan] = {}
+        self.session: Optional[ClientSession] = None
+        self.limiter = AdaptiveConcurrencyLimiter(
+            logger=self.logger,
+            min_limit=(
+                min(self.min_connections, self.max_connections)
+                if self.adaptive_connections
+                else self.max_connections
+            ),
+            max_limit=self.max_connections,
+            initial_limit=self.max_connections,
+        )
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def start(self):
+        metrics.enable()
+        connector = TCPConnector(
+            ssl=False,
+            limit=self.max_connections,
+            use_dns_cache=True,
+            ttl_dns_cache=self.dns_cache_ttl,
+        )
+        # cookies must not leak between sites and scans, but the given ones
+        cookie_jar = (
+            import_aiohttp_cookies(self.cookies) if self.cookies else DummyCookieJar()
+        )
+        self.session = ClientSession(
+            connector=connector, trust_env=True, cookie_jar=cookie_jar
+        )
+        # keep-alive connections over proxies and their health are shared too
+        proxies = [self.proxy] if isinstance(self.proxy, str) else self.proxy
+        if proxies:
+            self.proxy = ProxyPool(proxies, self.logger, cookie_jar=cookie_jar)
+        if isinstance(self.tor_proxy, str) and self.tor_circuits > 0:
+            self.tor_proxy = TorCircuitPool(
+                self.tor_proxy, self.tor_circuits, self.logger, cookie_jar=cookie_jar
+            )
+        if self.check_domains:
+            self.dns_resolver = DnsResolver(
+                logger=self.logger, **(self.dns_options or {})
+            )
+
+    async def close(self):
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        if self.session:
+            await self.session.close()
+        for pool in (self.proxy, self.tor_proxy):
+            if isinstance(pool, ProxyPool):
+                await pool.close()
+        if self.dns_resolver:
+            await self.dns_resolver.close()
+
+    def is_checkable(self, protocol: str) -> bool:
+        """Sites of the protocol have a real checker, not a mock"""
+        return {
+            'tor': bool(self.tor_proxy),
+            'i2p': bool(self.i2p_proxy),
+            'dns': self.check_domains,
+        }.get(protocol, True)
+
+    def parse_request(self, data: Dict[str, Any]) -> Tuple[List[str], Dict]:
+        if not isinstance(data, dict):
+            raise ScanRequestError('JSON object expected')
+
+        usernames = data.get('usernames') or []
+        if data.get('username'):
+            usernames = [data['username']] + list(usernames)
+        if isinstance(usernames, str) or not all(isinstance(u, str) for u in usernames):
+            raise ScanRequestError('"usernames" must be a list of strings')
+
+        usernames = list(dict.fromkeys(u.strip() for u in usernames if u and u.strip()))
+        if not usernames:
+            raise ScanRequestError('At least one username is required')
+        if len(usernames) > MAX_USERNAMES_PER_JOB:
+            raise ScanRequestError(
+                f'Too many usernames, max {MAX_USERNAMES_PER_JOB} per scan'
+            )
+        bad = [u for u in usernames if set(BAD_CHARS).intersection(u)]
+        if bad:
+            raise ScanRequestError(f'Unsupported characters in usernames: {bad}')
+
+        for key in ('tags', 'sites'):
+            value = data.get(key, [])
+            valid = isinstance(value, list) and all(isinstance(v, str) for v in value)
+            if not valid:
+                raise ScanRequestError(f'"{key}" must be a list of strings')
+
+        id_type = data.get('id_type', 'username')
+        if id_type not in SUPPORTED_IDS:
+            raise ScanRequestError(f'Unsupported identifier type "{id_type}"')
+
+        try:
+            params = {
+                'id_type': id_type,
+                'top_sites': int(data.get('top_sites', DEFAULT_TOP_SITES)),
+                'tags': list(data.get('tags', [])),
+                'sites': list(data.get('sites', [])),
+                'timeout': min(float(data.get('timeout', self.timeout)), self.timeout),
+                'parsing': bool(data.get('parsing', False)),
+                'use_cache': bool(data.get('use_cache', True)),
+            }
+        except (TypeError, ValueError) as e:
+            raise ScanRequestError(f'Invalid scan parameters: {e}')
+
+        return usernames, params
+
+    def submit(self, data: Dict[str, Any]) -> ScanJob:
+        usernames, params = self.parse_request(data)
+        job = ScanJob(usernames, params)
+        self.jobs[job.id] = job
+        self._cleanup_jobs()
+        self._tasks[job.id] = asyncio.create_task(self.run_job(job))
+        return job
+
+    def _cleanup_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.is_finished]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    async def run_job(self, job: ScanJob):
+        job.status = 'running'
+        try:
+            for username in job.usernames:
+                await self.scan_username(job, username)
+            job.finish('completed')
+        except asyncio.CancelledError:
+            job.finish('failed', 'Service is stopped')
+            raise
+        except Exception as e:
+            self.logger.error(f'Scan {job.id} failed: {e}', exc_info=True)
+            job.finish('failed', str(e))
+        finally:
+            self._tasks.pop(job.id, None)
+
+    async def scan_username(
+        self, job: ScanJob, username: str
+    ) -> Dict[str, QueryResultWrapper]:
+        params = job.params
+        id_type = params['id_type']
+        sites = self.db.ranked_sites_dict(
+            top=params['top_sites'],
+            tags=params['tags'],
+            names=params['sites'],
+            disabled=False,
+            id_type=id_type,
+        )
+        sites = {n: s for n, s in sites.items() if self.is_checkable(s.protocol)}
+        job.publish('started', {'username': username, 'sites': len(sites)})
+
+        sites_to_check = {}
+        for name, site in sites.items():
+            cached = (
+                self.cache.get((id_type, params['parsing'], username, name))
+                if params['use_cache']
+                else None
+            )
+            if cached:
+                job.add_result(cached, cached=True)
+            else:
+                sites_to_check[name] = site
+
+        results = {}
+        if sites_to_check:
+            results = await maigret(
+                username=username,
+                site_dict=sites_to_check,
+                logger=self.logger,
+                query_notify=JobQueryNotify(job, self.cache, id_type),
+                timeout=params['timeout'],
+                id_type=id_type,
+                is_parsing_enabled=params['parsing'],
+                max_connections=self.max_connections,
+                retries=self.retries,
+                no_progressbar=True,
+                proxy=self.proxy,
+                tor_proxy=self.tor_proxy,
+                tor_circuits=self.tor_circuits,
+                i2p_proxy=self.i2p_proxy,
+                cookies=self.cookies,
+                check_domains=self.check_domains,
+                dns_resolver=self.dns_resolver,
+                session=self.session,
+                limiter=self.limiter,
+                site_plans=self.site_plans,
+            )
+
+        job.publish(
+            'finished',
+            {
+                'username': username,
+                'found': len(job.summary()['found'][username]),
+                'cached': len(sites) - len(sites_to_check),
+            },
+        )
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        statuses: Dict[str, int] = {}
+        for job in self.jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            'sites': len(self.db.sites),
+            'jobs': statuses,
+            'cache': self.cache.stats(),
+            'concurrency': self.limiter.stats(),
+        }
+
+
+SERVICE_KEY = web.AppKey('service', ScanService)
+
+
+def get_job(request: web.Request) -> ScanJob:
+    job = request.app[SERVICE_KEY].jobs.get(request.match_info['job_id'])
+    if not job:
+        raise web.HTTPNotFound(
+            text=json.dumps({'error': 'Scan not found'}),
+            content_type='application/json',
+        )
+    return job
+
+
+async def handle_status(request: web.Request) -> web.Response:
+    return web.json_response(request.app[SERVICE_KEY].stats())
+
+
+async def handle_create_scan(request: web.Request) -> web.Response:
+    try:
+        data = await request.json()
+        job = request.app[SERVICE_KEY].submit(data)
+    except json.JSONDecodeError:
+        return web.json_response({'error': 'Invalid JSON'}, status=400)
+    except ScanRequestError as e:
+        return web.json_response({'error': str(e)}, status=400)
+
+    return web.json_response(job.summary(), status=202)
+
+
+async def handle_get_scan(request: web.Request) -> web.Response:
+    return web.json_response(get_job(request).json())
+
+
+async def handle_scan_events(request: web.Request) -> web.StreamResponse:
+    job = get_job(request)
+    response = web.StreamResponse(
+        headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+        }
+    )
+    await response.prepare(request)
+
+    queue = job.subscribe()
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            event, data = item
+            message = f'event: {event}\ndata: {json.dumps(data)}\n\n'
+            await response.write(message.encode())
+    finally:
+        job.unsubscribe(queue)
+
+    await response.write_eof()
+    return response
+
+
+async def handle_scan_websocket(request: web.Request) -> web.WebSocketResponse:
+    job = get_job(request)
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+
+    queue = job.subscribe()
+
+    async def send_events():
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            event, data = item
+            await ws.send_json({'event': event, 'data': data})
+
+    sender = asyncio.create_task(send_events())
+    receiver = asyncio.create_task(ws.receive())
+    try:
+        # stop on the end of the scan or when the client leaves
+        await asyncio.wait((sender, receiver), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (sender, receiver):
+            task.cancel()
+        job.unsubscribe(queue)
+
+    if receiver.done() and not receiver.cancelled():
+        msg = receiver.result()
+        if msg.type == WSMsgType.ERROR:
+            request.app[SERVICE_KEY].logger.warning(
+                f'WebSocket error: {ws.exception()}'
+            )
+
+    await ws.close()
+    return ws
+
+
+def make_app(service: ScanService) -> web.Application:
+    app = web.Application()
+    app[SERVICE_KEY] = service
+
+    async def on_startup(app):
+        await service.start()
+
+    async def on_cleanup(app):
+        await service.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+
+    app.router.add_get('/api/status', handle_status)
+    app.router.add_post('/api/scans', handle_create_scan)
+    app.router.add_get('/api/scans/{job_id}', handle_get_scan)
+    app.router.add_get('/api/scans/{job_id}/events', handle_scan_events)
+    app.router.add_get('/api/scans/{job_id}/ws', handle_scan_websocket)
+    app.router.add_get('/metrics', metrics.handle_metrics)
+    return app
+
+
+async def serve(service: ScanService, host='127.0.0.1', port=DEFAULT_PORT):
+    """Run the service until the task is cancelled"""
+    runner = web.AppRunner(make_app(service))
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    service.logger.warning(f'Maigret scan service is listening on {host}:{port}')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
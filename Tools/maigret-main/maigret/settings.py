@@ -16,12 +16,14 @@ class Settings:
     sites_db_path: str
     timeout: int
     max_connections: int
+    min_connections: int
     recursive_search: bool
     info_extracting: bool
     cookie_jar_file: str
     ignore_ids_list: List
     reports_path: str
     proxy_url: str
+    proxy_list: List
     tor_proxy_url: str
     i2p_proxy_url: str
     domain_search: bool
@@ -2,9 +2,11 @@
 """Maigret Sites Information"""
 import copy
 import json
+import os
 import sys
 from typing import Optional, List, Dict, Any, Tuple
 
+from .latency import LatencyHistogram
 from .utils import CaseConverter, URLMatcher, is_country_tag
 
 
@@ -96,6 +98,8 @@ class MaigretSite:
     def __init__(self, name, information):
         self.name = name
         self.url_subpath = ""
+        # don't share statistics dict of the class between sites
+        self.stats = {}
 
         for k, v in information.items():
             self.__dict__[CaseConverter.camel_to_snake(k)] = v
@@ -407,6 +411,43 @@ class MaigretDatabase:
 
         return self
 
+    def save_stats_to_file(self, filename: str) -> "MaigretDatabase":
+        """Save collected sites statistics (latency) to separate JSON file"""
+        stats_data = {
+            site.name: {"latency": site.stats["latency"].json}
+            for site in self._sites
+            if "latency" in site.stats
+        }
+        if not stats_data:
+            return self
+
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        with open(filename, "w") as f:
+            json.dump(stats_data, f)
+
+        return self
+
+    def load_stats_from_file(self, filename: str) -> "MaigretDatabase":
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                stats_data = json.load(f)
+        except FileNotFoundError:
+            return self
+        except Exception as error:
+            raise ValueError(
+                f"Problem parsing json contents of sites stats "
+                f"file '{filename}':  {str(error)}."
+            )
+
+        sites_dict = self.sites_dict
+        for site_name, stats in stats_data.items():
+            site = sites_dict.get(site_name)
+            if not site or "latency" not in stats:
+                continue
+            site.stats["latency"] = LatencyHistogram.from_json(stats["latency"])
+
+        return self
+
     def load_from_json(self, json_data: dict) -> "MaigretDatabase":
         # Add all of site information from the json file to internal site list.
         site_data = json_data.get("sites", {})
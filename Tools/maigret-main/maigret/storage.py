@@ -0,0 +1,135 @@
+"""Maigret search results storage
+
+Results of a search keep references to sites, checkers, requests plans and
+futures, they are needed only until reports of the username are saved.
+Reports on all the usernames (HTML, PDF, graph and the short text one) read
+only found accounts, so `ResultStore` keeps compact copies of them
+(`compact_results`): encoded in memory for the first usernames, then in an
+append-only JSON lines file, one line per username, with an index of line
+offsets. Reports iterate over the store and get results of one username at
+a time, so memory doesn't grow with the number of searched usernames.
+
+    store = ResultStore()
+    store.add(username, id_type, results)
+    context = generate_report_context(store)
+    store.close()
+"""
+
+import json
+import os
+import tempfile
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple
+
+from .result import MaigretCheckResult, MaigretCheckStatus
+from .types import QueryResultWrapper
+
+# usernames kept in memory before spilling to disk
+RESULTS_IN_MEMORY = 16
+
+# fields of site results read by reports
+COMPACT_FIELDS = (
+    'url_main',
+    'url_user',
+    'http_status',
+    'is_similar',
+    'rank',
+    'ids_usernames',
+    'ids_links',
+)
+
+StoredResults = Tuple[str, str, Dict[str, Dict[str, Any]]]
+
+
+def compact_results(results: QueryResultWrapper) -> Dict[str, Dict[str, Any]]:
+    """JSON-serializable found accounts of the search results"""
+    compact = {}
+    for sitename, site_result in results.items():
+        status = site_result.get('status') if site_result else None
+        if not status or status.status != MaigretCheckStatus.CLAIMED:
+            continue
+        data = {f: site_result[f] for f in COMPACT_FIELDS if f in site_result}
+        data['status'] = status.json()
+        compact[sitename] = data
+    return compact
+
+
+def expand_results(compact: Dict[str, Dict[str, Any]]) -> QueryResultWrapper:
+    """Site results of compact ones, as they are after `generate_report_context`"""
+    for data in compact.values():
+        status = MaigretCheckResult.from_json(data['status'])
+        data['status'] = status
+        data['found'] = True
+        if status.ids_data:
+            data['ids_data'] = status.ids_data
+    return compact
+
+
+class ResultStore:
+    """
+    Compact results of searched usernames, a sequence of
+    (username, id_type, results) like the list of `main()` used to be.
+
+    Without `path` the spilled results are written to a temporary file,
+    removed on `close()`.
+    """
+
+    def __init__(
+        self, path: Optional[str] = None, max_in_memory: int = RESULTS_IN_MEMORY
+    ):
+        self.path = path
+        self.max_in_memory = max_in_memory
+        self.usernames: List[Tuple[str, str]] = []
+        # encoded results, until they are spilled
+        self.lines: List[bytes] = []
+        self.offsets: List[int] = []
+        self.file: Optional[IO[bytes]] = None
+
+    def __len__(self) -> int:
+        return len(self.usernames)
+
+    def __iter__(self) -> Iterator[StoredResults]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i: int) -> StoredResults:
+        if self.file is None:
+            line = self.lines[i]
+        else:
+            self.file.seek(self.offsets[i])
+            line = self.file.readline()
+        username, id_type, compact = json.loads(line)
+        return username, id_type, expand_results(compact)
+
+    @property
+    def spilled(self) -> bool:
+        return self.file is not None
+
+    def add(self, username: str, id_type: str, results: QueryResultWrapper):
+        record = [username, id_type, compact_results(results)]
+        line = json.dumps(record, default=str).encode('utf-8') + b'\n'
+        self.usernames.append((username, id_type))
+        if self.file is None:
+            if len(self.lines) < self.max_in_memory:
+                self.lines.append(line)
+                return
+            self._spill()
+        self._append(line)
+
+    def _spill(self):
+        if self.path:
+            self.file = open(self.path, 'w+b')
+        else:
+            self.file = tempfile.TemporaryFile(prefix='maigret-results-')
+        lines, self.lines = self.lines, []
+        for line in lines:
+            self._append(line)
+
+    def _append(self, line: bytes):
+        # reads move the position
+        self.file.seek(0, os.SEEK_END)
+        self.offsets.append(self.file.tell())
+        self.file.write(line)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
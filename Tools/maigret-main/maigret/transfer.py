@@ -0,0 +1,237 @@
+"""Maigret compressed transfers
+
+Site requests negotiate compression (`ACCEPT_ENCODING`) and bodies are
+decoded by `decode_content`, so both sizes of every response are known:
+`TransferStats` sums bytes on the wire and decoded ones per site host and
+for the whole scan. A host which sends a body that can't be decoded with
+its Content-Encoding is asked for uncompressed ones from then on.
+
+Decompressed bodies stay bytes (`ResponseBody`): site markers are encoded
+to the body charset once and searched in the raw bytes, the text is
+decoded only when it's really needed, e.g. for extraction of a found
+account data.
+"""
+
+import codecs
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Mapping, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+if brotli and not hasattr(brotli.Decompressor, 'can_accept_more_data'):
+    # older versions can't limit the decompressed size
+    brotli = None
+
+# decoded bodies are cut at this size, against decompression bombs
+MAX_DECODED_SIZE = 10 * 1024 * 1024
+
+ACCEPT_ENCODING = 'gzip, deflate, br' if brotli else 'gzip, deflate'
+IDENTITY_ENCODING = 'identity'
+
+
+class DecodingError(Exception):
+    pass
+
+
+def _decompress(data: bytes, wbits: int, max_size: int) -> bytes:
+    decompressor = zlib.decompressobj(wbits)
+    return decompressor.decompress(data, max_size)
+
+
+def _decode(data: bytes, encoding: str, max_size: int) -> bytes:
+    if encoding in ('', IDENTITY_ENCODING):
+        return data
+    if encoding in ('gzip', 'x-gzip'):
+        # 32: gzip or zlib header is detected automatically
+        return _decompress(data, 32 + zlib.MAX_WBITS, max_size)
+    if encoding == 'deflate':
+        try:
+            return _decompress(data, 32 + zlib.MAX_WBITS, max_size)
+        except zlib.error:
+            # raw deflate stream without zlib header, sent by some servers
+            return _decompress(data, -zlib.MAX_WBITS, max_size)
+    if encoding == 'br' and brotli:
+        decompressor = brotli.Decompressor()
+        return decompressor.process(data, output_buffer_limit=max_size)[:max_size]
+    raise DecodingError(f'unsupported content encoding "{encoding}"')
+
+
+def decode_content(
+    data: bytes, content_encoding: str, max_size: int = MAX_DECODED_SIZE
+) -> bytes:
+    """Body decoded from all the encodings, applied in the listed order"""
+    encodings = [e.strip().lower() for e in content_encoding.split(',')]
+    try:
+        for encoding in reversed(encodings):
+            data = _decode(data, encoding, max_size)
+    except DecodingError:
+        raise
+    except Exception as e:
+        raise DecodingError(f'broken {content_encoding} body: {e}') from e
+    return data
+
+
+# charsets in which bytes of ASCII characters never are parts of other
+# characters, so an encoded marker is found in bytes iff it's in the text
+BYTES_MATCHING_CHARSETS = ('utf-8', 'ascii', 'iso8859', 'latin', 'cp125', 'koi8')
+
+
+@lru_cache(maxsize=16384)
+def encode_marker(marker: str, charset: str) -> Optional[bytes]:
+    """Bytes of the marker in a body of the charset, None if the marker must
+    be searched in the decoded text"""
+    try:
+        name = codecs.lookup(charset).name
+    except LookupError:
+        return None
+    if not name.startswith(BYTES_MATCHING_CHARSETS):
+        return None
+    if name == 'utf-8-sig':
+        # the BOM is only at the start of a body, not of every marker
+        name = 'utf-8'
+    try:
+        return marker.encode(name)
+    except UnicodeEncodeError:
+        return None
+
+
+class ResponseBody:
+    """
+    Response body bytes with their charset and the response headers, decoded
+    on the first access to `text`. Supports `marker in body` and falls back
+    to decoding for charsets and markers which can't be matched as bytes.
+    """
+
+    __slots__ = ('raw', 'charset', 'headers', '_text', '_ascii')
+
+    def __init__(
+        self,
+        raw: bytes,
+        charset: str = 'utf-8',
+        headers: Optional[Mapping[str, str]] = None,
+    ):
+        self.raw = raw
+        self.charset = charset
+        self.headers = headers if headers is not None else {}
+        self._text: Optional[str] = None
+        self._ascii: Optional[bool] = None
+
+    @property
+    def is_ascii(self) -> bool:
+        if self._ascii is None:
+            self._ascii = self.raw.isascii()
+        return self._ascii
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            try:
+                self._text = self.raw.decode(self.charset, 'ignore')
+            except LookupError:
+                self._text = self.raw.decode('utf-8', 'ignore')
+        return self._text
+
+    def __contains__(self, marker: str) -> bool:
+        if self._text is None:
+            needle = encode_marker(marker, self.charset)
+            if needle is not None:
+                # most of pages are ASCII, most of non-ASCII markers are
+                # of other languages: no need to search
+                if not marker.isascii() and self.is_ascii:
+                    return False
+                return needle in self.raw
+        return marker in self.text
+
+    def __bool__(self) -> bool:
+        return bool(self.raw)
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ResponseBody):
+            return self.text == other.text
+        if isinstance(other, str):
+            return self.text == other
+        return NotImplemented
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return f'<ResponseBody {len(self.raw)} bytes, {self.charset}>'
+
+
+# text of checkers without network (replay, mocks), or bytes of responses
+Body = Union[str, ResponseBody]
+
+
+def site_host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+class TransferStats:
+    """Sizes of responses bodies on the wire and decoded, per host and total"""
+
+    def __init__(self):
+        # host -> [responses, wire bytes, decoded bytes]
+        self.hosts: Dict[str, List[int]] = {}
+        self.responses = 0
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        # hosts mis-encoding compressed bodies
+        self.identity_hosts = set()
+
+    def add(self, url: str, wire_size: int, decoded_size: int):
+        host = self.hosts.setdefault(site_host(url), [0, 0, 0])
+        host[0] += 1
+        host[1] += wire_size
+        host[2] += decoded_size
+        self.responses += 1
+        self.wire_bytes += wire_size
+        self.decoded_bytes += decoded_size
+
+    def accept_encoding(self, url: str) -> str:
+        if self.identity_hosts and site_host(url) in self.identity_hosts:
+            return IDENTITY_ENCODING
+        return ACCEPT_ENCODING
+
+    def disable_compression(self, url: str):
+        self.identity_hosts.add(site_host(url))
+
+    @property
+    def saved_ratio(self) -> float:
+        if not self.decoded_bytes:
+            return 0.0
+        return 1 - self.wire_bytes / self.decoded_bytes
+
+    def top_hosts(self, count: int = 10) -> List[Tuple[str, int, int]]:
+        """Hosts with the largest transfers: (host, wire bytes, decoded bytes)"""
+        hosts = sorted(self.hosts.items(), key=lambda x: x[1][1], reverse=True)
+        return [(host, wire, decoded) for host, (_, wire, decoded) in hosts[:count]]
+
+    def summary(self) -> str:
+        return (
+            f'{format_size(self.wire_bytes)} transferred, '
+            f'{format_size(self.decoded_bytes)} decoded '
+            f'({round(self.saved_ratio * 100)}% saved by compression) '
+            f'in {self.responses} responses'
+        )
+
+
+def format_size(size: float) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{round(size, 1):g} {unit}'
+        size /= 1024
+    return f'{round(size, 1):g} GB'
@@ -1,5 +1,6 @@
 from flask import (
     Flask,
+    jsonify,
     render_template,
     request,
     send_file,
@@ -11,29 +12,69 @@ from flask import (
 import logging
 import os
 import asyncio
-from datetime import datetime
-from threading import Thread
+import hashlib
+import json
+import threading
+from collections import OrderedDict
 import maigret
 import maigret.settings
-from maigret.sites import MaigretDatabase
-from maigret.report import generate_report_context
+from maigret.executors import AdaptiveConcurrencyLimiter
+from maigret.web.autocomplete import DEFAULT_LIMIT, MAX_LIMIT, SiteIndex
+from maigret.web.jobs import (
+    JobProgress,
+    ProgressQueryNotify,
+    QueueFullError,
+    SearchWorkerPool,
+    SharedDatabase,
+)
+from maigret.web.reports import JobReports, UnknownReportError
+from maigret.web.store import JobStore
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 
-#add background job tracking
+# progress of running jobs, finished ones are in the job store
 background_jobs = {}
-job_results = {}
 
 # Configuration
 MAIGRET_DB_FILE = os.path.join('maigret', 'resources', 'data.json')
 COOKIES_FILE = "cookies.txt"
 UPLOAD_FOLDER = 'uploads'
 REPORTS_FOLDER = os.path.abspath('/tmp/maigret_reports')
+# searches running at the same time and waiting for a free worker
+MAX_SEARCH_WORKERS = 2
+MAX_QUEUED_SEARCHES = 8
+# connections limit shared by all running searches
+MAX_CONNECTIONS = 100
+# seconds between keep-alive comments in progress streams
+PROGRESS_KEEPALIVE = 15
+JOBS_DB_FILE = os.path.join(REPORTS_FOLDER, 'jobs.sqlite3')
+# reports of recent jobs kept in memory
+MAX_CACHED_REPORTS = 32
+
+shared_db = SharedDatabase(MAIGRET_DB_FILE)
+search_pool = SearchWorkerPool(
+    max_workers=MAX_SEARCH_WORKERS, max_queued=MAX_QUEUED_SEARCHES
+)
+search_limiter = AdaptiveConcurrencyLimiter(
+    min_limit=MAX_CONNECTIONS,
+    max_limit=MAX_CONNECTIONS,
+    initial_limit=MAX_CONNECTIONS,
+)
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(REPORTS_FOLDER, exist_ok=True)
 
+job_store = JobStore(JOBS_DB_FILE, REPORTS_FOLDER)
+job_store.fail_interrupted_jobs()
+job_store.cleanup()
+
+job_reports = OrderedDict()
+job_reports_lock = threading.Lock()
+
+site_index = None
+site_index_lock = threading.Lock()
+
 
 def setup_logger(log_level, name):
     logger = logging.getLogger(name)
@@ -41,11 +82,10 @@ def setup_logger(log_level, name):
     return logger
 
 
-async def maigret_search(username, options):
+async def maigret_search(username, options, db, progress):
     logger = setup_logger(logging.WARNING, 'maigret')
     try:
-        db = MaigretDatabase().load_from_path(MAIGRET_DB_FILE)
-        
+
         top_sites = int(options.get('top_sites') or 500) 
         if options.get('all_sites'):
             top_sites = 999999999  # effectively all
@@ -63,12 +103,14 @@ async def maigret_search(username, options):
         )
         
         logger.info(f"Found {len(sites)} sites matching the tag criteria")
+        progress.start(username, len(sites))
 
         results = await maigret.search(
             username=username,
             site_dict=sites,
             timeout=int(options.get('timeout', 30)),
             logger=logger,
+            query_notify=ProgressQueryNotify(progress, username),
             id_type='username',
             cookies=COOKIES_FILE if options.get('use_cookies') else None,
             is_parsing_enabled=(not options.get('disable_extracting', False)),  
@@ -77,6 +119,9 @@ async def maigret_search(username, options):
             proxy=options.get('proxy', None),
             tor_proxy=options.get('tor_proxy', None),
             i2p_proxy=options.get('i2p_proxy', None),
+            max_connections=MAX_CONNECTIONS,
+            limiter=search_limiter,
+            no_progressbar=True,
         )
         return results
     except Exception as e:
@@ -84,125 +129,106 @@ async def maigret_search(username, options):
         raise
 
 
-async def search_multiple_usernames(usernames, options):
+async def search_multiple_usernames(usernames, options, db, progress):
+    # all usernames are checked concurrently, connections are limited
+    # by the limiter shared with other searches
+    usernames = [username.strip() for username in usernames]
+    searches = await asyncio.gather(
+        *(
+            maigret_search(username, options, db, progress)
+            for username in usernames
+        ),
+        return_exceptions=True,
+    )
+
     results = []
-    for username in usernames:
-        try:
-            search_results = await maigret_search(username.strip(), options)
-            results.append((username.strip(), 'username', search_results))
-        except Exception as e:
-            logging.error(f"Error searching username {username}: {str(e)}")
+    for username, search_results in zip(usernames, searches):
+        if isinstance(search_results, Exception):
+            logging.error(f"Error searching username {username}: {search_results}")
+            continue
+        results.append((username, 'username', search_results))
     return results
 
 
-def process_search_task(usernames, options, timestamp):
+async def process_search_task(usernames, options, job_id):
+    progress = background_jobs[job_id]['progress']
+    general_results, error = [], None
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
-        general_results = loop.run_until_complete(
-            search_multiple_usernames(usernames, options)
+        db = shared_db.get()
+        general_results = await search_multiple_usernames(
+            usernames, options, db, progress
         )
+        # reports are rendered later, on the first download
+        cache_job_reports(
+            job_id,
+            JobReports(job_store.report_folder(job_id), general_results, db),
+        )
+    except Exception as e:
+        logging.error(f"Error in search task {job_id}: {str(e)}")
+        error = str(e)
+    finally:
+        try:
+            job_store.finish_job(job_id, general_results, error)
+        except Exception as e:
+            logging.error(f"Error saving search results {job_id}: {str(e)}")
+            error = str(e)
+        progress.finish('failed' if error else 'completed', error)
+        background_jobs.pop(job_id, None)
 
-        session_folder = os.path.join(REPORTS_FOLDER, f"search_{timestamp}")
-        os.makedirs(session_folder, exist_ok=True)
 
-        graph_path = os.path.join(session_folder, "combined_graph.html")
-        maigret.report.save_graph_report(
-            graph_path,
-            general_results,
-            MaigretDatabase().load_from_path(MAIGRET_DB_FILE),
-        )
+def cache_job_reports(job_id, reports):
+    with job_reports_lock:
+        job_reports[job_id] = reports
+        job_reports.move_to_end(job_id)
+        while len(job_reports) > MAX_CACHED_REPORTS:
+            job_reports.popitem(last=False)
 
-        individual_reports = []
-        for username, id_type, results in general_results:
-            report_base = os.path.join(session_folder, f"report_{username}")
 
-            csv_path = f"{report_base}.csv"
-            json_path = f"{report_base}.json"
-            pdf_path = f"{report_base}.pdf"
-            html_path = f"{report_base}.html"
+def get_job_reports(job_id):
+    with job_reports_lock:
+        reports = job_reports.get(job_id)
+    if reports is None:
+        # e.g. after restart, results are loaded from the job store
+        db = shared_db.get()
+        general_results = job_store.load_results(job_id, db)
+        reports = JobReports(job_store.report_folder(job_id), general_results, db)
+        cache_job_reports(job_id, reports)
+    return reports
 
-            context = generate_report_context(general_results)
 
-            maigret.report.save_csv_report(csv_path, username, results)
-            maigret.report.save_json_report(
-                json_path, username, results, report_type='ndjson'
-            )
-            maigret.report.save_pdf_report(pdf_path, context)
-            maigret.report.save_html_report(html_path, context)
-
-            claimed_profiles = []
-            for site_name, site_data in results.items():
-                if (
-                    site_data.get('status')
-                    and site_data['status'].status
-                    == maigret.result.MaigretCheckStatus.CLAIMED
-                ):
-                    claimed_profiles.append(
-                        {
-                            'site_name': site_name,
-                            'url': site_data.get('url_user', ''),
-                            'tags': (
-                                site_data.get('status').tags
-                                if site_data.get('status')
-                                else []
-                            ),
-                        }
-                    )
-
-            individual_reports.append(
-                {
-                    'username': username,
-                    'csv_file': os.path.join(
-                        f"search_{timestamp}", f"report_{username}.csv"
-                    ),
-                    'json_file': os.path.join(
-                        f"search_{timestamp}", f"report_{username}.json"
-                    ),
-                    'pdf_file': os.path.join(
-                        f"search_{timestamp}", f"report_{username}.pdf"
-                    ),
-                    'html_file': os.path.join(
-                        f"search_{timestamp}", f"report_{username}.html"
-                    ),
-                    'claimed_profiles': claimed_profiles,
-                }
-            )
+def get_completed_job(job_id):
+    job = job_store.get_job(job_id)
+    if not job or job['status'] != 'completed':
+        return None
+    return job
 
-        # save results and mark job as complete using timestamp as key
-        job_results[timestamp] = {
-            'status': 'completed',
-            'session_folder': f"search_{timestamp}",
-            'graph_file': os.path.join(f"search_{timestamp}", "combined_graph.html"),
-            'usernames': usernames,
-            'individual_reports': individual_reports,
-        }
 
-    except Exception as e:
-        logging.error(f"Error in search task for timestamp {timestamp}: {str(e)}")
-        job_results[timestamp] = {'status': 'failed', 'error': str(e)}
-    finally:
-        background_jobs[timestamp]['completed'] = True
+def get_site_index():
+    """Autocomplete index of the current sites database version"""
+    global site_index
+    db = shared_db.get()
+    with site_index_lock:
+        if site_index is None or site_index.version != shared_db.version:
+            site_index = SiteIndex(db, version=shared_db.version)
+        return site_index
 
 
 @app.route('/')
 def index():
-    #load site data for autocomplete
-    db = MaigretDatabase().load_from_path(MAIGRET_DB_FILE)
-    site_options = []
-    
-    for site in db.sites:
-        #add main site name
-        site_options.append(site.name)
-        #add URL if different from name
-        if site.url_main and site.url_main not in site_options:
-            site_options.append(site.url_main)
-    
-    #sort and deduplicate
-    site_options = sorted(set(site_options))
-    
-    return render_template('index.html', site_options=site_options)
+    return render_template('index.html')
+
+
+@app.route('/api/sites')
+def sites_autocomplete():
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', DEFAULT_LIMIT, type=int), MAX_LIMIT)
+    index = get_site_index()
+
+    etag = hashlib.md5(f'{index.version}:{limit}:{query}'.encode()).hexdigest()
+    response = jsonify({'query': query, 'results': index.search(query, limit)})
+    response.set_etag(etag)
+    response.cache_control.max_age = 60
+    return response.make_conditional(request)
 
 
 # Modified search route
@@ -217,9 +243,6 @@ def search():
         u.strip() for u in usernames_input.replace(',', ' ').split() if u.strip()
     ]
 
-    # Create timestamp for this search session
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
     # Get selected tags - ensure it's a list
     selected_tags = request.form.getlist('tags')
     logging.info(f"Selected tags: {selected_tags}")
@@ -242,83 +265,126 @@ def search():
 
     logging.info(f"Starting search for usernames: {usernames} with tags: {selected_tags}")
 
-    # Start background job
-    background_jobs[timestamp] = {
-        'completed': False,
-        'thread': Thread(
-            target=process_search_task, args=(usernames, options, timestamp)
-        ),
-    }
-    background_jobs[timestamp]['thread'].start()
+    # Start background job, if there is a free place in the queue
+    job_id = job_store.create_job(usernames, options)
+    background_jobs[job_id] = {'progress': JobProgress()}
+    try:
+        background_jobs[job_id]['future'] = search_pool.submit(
+            process_search_task, usernames, options, job_id
+        )
+    except QueueFullError as e:
+        del background_jobs[job_id]
+        job_store.delete_job(job_id)
+        logging.warning(f"Search rejected: {e}")
+        flash('Too many searches are in progress, try again later.', 'warning')
+        return redirect(url_for('index'))
 
-    return redirect(url_for('status', timestamp=timestamp))
+    job_store.cleanup()
 
-@app.route('/status/<timestamp>')
-def status(timestamp):
-    logging.info(f"Status check for timestamp: {timestamp}")
+    return redirect(url_for('status', job_id=job_id))
 
-    # Validate timestamp
-    if timestamp not in background_jobs:
+@app.route('/status/<job_id>')
+def status(job_id):
+    logging.info(f"Status check for job: {job_id}")
+
+    # Validate job
+    job = job_store.get_job(job_id)
+    if not job:
         flash('Invalid search session.', 'danger')
-        logging.error(f"Invalid search session: {timestamp}")
+        logging.error(f"Invalid search session: {job_id}")
         return redirect(url_for('index'))
 
     # Check if job is completed
-    if background_jobs[timestamp]['completed']:
-        result = job_results.get(timestamp)
-        if not result:
-            flash('No results found for this search session.', 'warning')
-            logging.error(f"No results found for completed session: {timestamp}")
-            return redirect(url_for('index'))
-
-        if result['status'] == 'completed':
-            # Note: use the session_folder from the results to redirect
-            return redirect(url_for('results', session_id=result['session_folder']))
-        else:
-            error_msg = result.get('error', 'Unknown error occurred.')
-            flash(f'Search failed: {error_msg}', 'danger')
-            logging.error(f"Search failed for session {timestamp}: {error_msg}")
-            return redirect(url_for('index'))
+    if job['status'] == 'completed':
+        return redirect(url_for('results', job_id=job_id))
+    elif job['status'] == 'failed':
+        error_msg = job.get('error') or 'Unknown error occurred.'
+        flash(f'Search failed: {error_msg}', 'danger')
+        logging.error(f"Search failed for session {job_id}: {error_msg}")
+        return redirect(url_for('index'))
 
     # If job is still running, show a status page
-    return render_template('status.html', timestamp=timestamp)
-
-
-@app.route('/results/<session_id>')
-def results(session_id):
-    # Find completed results that match this session_folder
-    result_data = next(
-        (
-            r
-            for r in job_results.values()
-            if r.get('status') == 'completed' and r['session_folder'] == session_id
-        ),
-        None,
+    return render_template('status.html', job_id=job_id)
+
+
+@app.route('/status/<job_id>/events')
+def status_events(job_id):
+    if job_id in background_jobs:
+        progress = background_jobs[job_id]['progress']
+    else:
+        job = job_store.get_job(job_id)
+        if not job:
+            return "Search session not found", 404
+        # the job is already finished
+        progress = JobProgress()
+        progress.finish(job['status'], job['error'])
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+
+    def format_event(event_id, event, data):
+        return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+    def stream():
+        last_id = last_event_id
+        while True:
+            events = None if last_id is None else progress.wait_events(
+                last_id, PROGRESS_KEEPALIVE
+            )
+            if events is None:
+                # new client or too old events were requested
+                last_id, state = progress.snapshot()
+                yield format_event(last_id, 'snapshot', state)
+                if progress.finished:
+                    return
+                continue
+
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+
+            for event_id, event, data in events:
+                last_id = event_id
+                yield format_event(event_id, event, data)
+                if event == 'done':
+                    return
+
+    return Response(
+        stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
     )
 
-    if not result_data:
+
+@app.route('/results/<job_id>')
+def results(job_id):
+    job = get_completed_job(job_id)
+    if not job:
         flash('No results found for this session ID.', 'danger')
-        logging.error(f"Results for session {session_id} not found in job_results.")
+        logging.error(f"Results for session {job_id} not found.")
         return redirect(url_for('index'))
 
+    claimed_profiles = job_store.get_claimed_profiles(job_id)
     return render_template(
         'results.html',
-        usernames=result_data['usernames'],
-        graph_file=result_data['graph_file'],
-        individual_reports=result_data['individual_reports'],
-        timestamp=session_id.replace('search_', ''),
+        job_id=job_id,
+        usernames=job['usernames'],
+        individual_reports=[
+            {'username': u, 'claimed_profiles': claimed_profiles.get(u, [])}
+            for u in job['usernames']
+        ],
     )
 
 
-@app.route('/reports/<path:filename>')
-def download_report(filename):
+@app.route('/reports/<job_id>/<fmt>')
+@app.route('/reports/<job_id>/<fmt>/<username>')
+def download_report(job_id, fmt, username=None):
+    if not get_completed_job(job_id):
+        return "File not found", 404
+
     try:
-        file_path = os.path.normpath(os.path.join(REPORTS_FOLDER, filename))
-        if not file_path.startswith(REPORTS_FOLDER):
-            raise Exception("Invalid file path")
+        file_path = get_job_reports(job_id).get(fmt, username)
         return send_file(file_path)
-    except Exception as e:
-        logging.error(f"Error serving file {filename}: {str(e)}")
+    except UnknownReportError as e:
+        logging.error(f"Error serving report {job_id}/{fmt}: {str(e)}")
         return "File not found", 404
 
 
@@ -0,0 +1,92 @@
+"""Sites autocomplete index of the web interface
+
+Built once per sites database version: names and main URLs of sites
+are searched by prefix (binary search in the sorted keys) and by substring
+(trigrams posting lists), more popular sites go first.
+"""
+
+import bisect
+import re
+import sys
+from typing import Dict, List, Set, Tuple
+
+from maigret.sites import MaigretDatabase
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+URL_PREFIX_RE = re.compile(r'^(https?://)?(www\.)?')
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class SiteIndex:
+    def __init__(self, db: MaigretDatabase, version=None):
+        self.version = version
+        # sorted search keys with entry ids for prefix search
+        self._keys: List[Tuple[str, int]] = []
+        self._lowered: List[str] = []
+        self._trigrams: Dict[str, Set[int]] = {}
+
+        ranks: Dict[str, int] = {}
+        for site in db.sites:
+            rank = site.alexa_rank or sys.maxsize
+            for value in (site.name, site.url_main):
+                if value and rank < ranks.get(value, sys.maxsize + 1):
+                    ranks[value] = rank
+
+        # site name or URL and its rank, the most popular sites first
+        self.entries: List[Tuple[str, int]] = sorted(
+            ranks.items(), key=lambda x: (x[1], x[0].lower())
+        )
+        for entry_id, (value, _) in enumerate(self.entries):
+            lowered = value.lower()
+            self._lowered.append(lowered)
+            keys = {lowered, URL_PREFIX_RE.sub('', lowered)}
+            for key in keys:
+                self._keys.append((key, entry_id))
+            for trigram in trigrams(lowered):
+                self._trigrams.setdefault(trigram, set()).add(entry_id)
+
+        self._keys.sort()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _prefix_matches(self, query: str) -> Dict[int, bool]:
+        """Ids of entries with the prefix, and are they exact matches"""
+        matches: Dict[int, bool] = {}
+        position = bisect.bisect_left(self._keys, (query, -1))
+        while position < len(self._keys) and self._keys[position][0].startswith(query):
+            key, entry_id = self._keys[position]
+            matches[entry_id] = matches.get(entry_id, False) or key == query
+            position += 1
+        return matches
+
+    def _substring_matches(self, query: str) -> Set[int]:
+        if len(query) < 3:
+            return {i for i, value in enumerate(self._lowered) if query in value}
+
+        postings = sorted(
+            (self._trigrams.get(t, set()) for t in trigrams(query)), key=len
+        )
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return {i for i in candidates if query in self._lowered[i]}
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT) -> List[str]:
+        """Top sites names and URLs for the query: exact matches go first,
+        then prefix matches, then substring matches"""
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        prefix_matches = self._prefix_matches(query)
+        results = sorted(prefix_matches, key=lambda i: (not prefix_matches[i], i))
+        results = results[:limit]
+        if len(results) < limit:
+            other_matches = self._substring_matches(query) - set(prefix_matches)
+            results += sorted(other_matches)[: limit - len(results)]
+
+        return [self.entries[i][0] for i in results]
@@ -0,0 +1,248 @@
+"""Shared state of the web interface: sites database, search workers
+and progress of search jobs"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple
+
+from maigret.notify import QueryNotify
+from maigret.result import MaigretCheckStatus
+from maigret.sites import MaigretDatabase
+
+# events kept for reconnecting clients, older ones are replaced by a snapshot
+PROGRESS_BUFFER_SIZE = 512
+# min interval between progress events of one username, seconds
+PROGRESS_INTERVAL = 0.5
+
+
+class SharedDatabase:
+    """
+    Sites database loaded once per process and reloaded
+    when the file modification time changes
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[MaigretDatabase] = None
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> MaigretDatabase:
+        mtime = os.path.getmtime(self.path)
+        with self._lock:
+            if self._db is None or mtime != self._mtime:
+                self._db = MaigretDatabase().load_from_path(self.path)
+                self._mtime = mtime
+                logging.info(f"Loaded sites database from {self.path}")
+            return self._db
+
+    @property
+    def version(self) -> Optional[float]:
+        """Modification time of the loaded database file"""
+        return self._mtime
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class SearchWorkerPool:
+    """
+    Runs search jobs in one persistent event loop in a background thread.
+
+    At most `max_workers` jobs run at the same time, up to `max_queued` more
+    jobs wait for a free worker, new jobs over that are rejected.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queued: int = 8):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._run_loop, name='maigret-search-loop', daemon=True
+                )
+                self._thread.start()
+        return self._loop
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def queued(self) -> int:
+        return self._pending - self._running
+
+    def submit(
+        self, coro_func: Callable[..., Coroutine], *args: Any, **kwargs: Any
+    ) -> Future:
+        """Schedule `coro_func(*args, **kwargs)`, raise QueueFullError if busy"""
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queued:
+                raise QueueFullError(
+                    f"{self._pending} searches are already running or queued"
+                )
+            self._pending += 1
+
+        return asyncio.run_coroutine_threadsafe(
+            self._run_job(coro_func, *args, **kwargs), self.loop
+        )
+
+    async def _run_job(self, coro_func, *args, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        try:
+            async with self._semaphore:
+                self._running += 1
+                try:
+                    return await coro_func(*args, **kwargs)
+                finally:
+                    self._running -= 1
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def shutdown(self):
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+            self._semaphore = None
+        if loop:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+
+class JobProgress:
+    """
+    Progress of a search job: current state and a ring buffer of events.
+
+    Written by the search loop, read by any number of SSE clients threads.
+    """
+
+    def __init__(self, buffer_size: int = PROGRESS_BUFFER_SIZE):
+        self.usernames: Dict[str, Dict[str, Any]] = {}
+        self.status = 'running'
+        self._events: deque = deque(maxlen=buffer_size)
+        self._last_id = 0
+        self._last_progress: Dict[str, float] = {}
+        self._condition = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status != 'running'
+
+    def _publish(self, event: str, data: Dict[str, Any]):
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, event, data))
+            self._condition.notify_all()
+
+    def _publish_progress(self, username: str, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_progress.get(username, 0) < PROGRESS_INTERVAL:
+            return
+        self._last_progress[username] = now
+        state = self.usernames[username]
+        self._publish(
+            'progress',
+            {
+                'username': username,
+                'done': state['done'],
+                'total': state['total'],
+                'errors': dict(state['errors']),
+            },
+        )
+
+    def start(self, username: str, total: int):
+        with self._condition:
+            self.usernames[username] = {
+                'done': 0,
+                'total': total,
+                'found': [],
+                'errors': {},
+            }
+            self._publish_progress(username, force=True)
+
+    def update(self, username: str, result):
+        with self._condition:
+            state = self.usernames[username]
+            state['done'] += 1
+
+            if result.status == MaigretCheckStatus.CLAIMED:
+                found = {'site_name': result.site_name, 'url': result.site_url_user}
+                state['found'].append(found)
+                self._publish('found', dict(found, username=username))
+            elif result.status == MaigretCheckStatus.UNKNOWN and result.error:
+                errors = state['errors']
+                errors[result.error.type] = errors.get(result.error.type, 0) + 1
+
+            self._publish_progress(username, force=state['done'] >= state['total'])
+
+    def finish(self, status: str, error: Optional[str] = None):
+        with self._condition:
+            self.status = status
+            self._publish('done', {'status': status, 'error': error})
+
+    def snapshot(self) -> Tuple[int, Dict[str, Any]]:
+        """Id of the last event and the current state of the job"""
+        with self._condition:
+            usernames = {
+                username: dict(
+                    state, found=list(state['found']), errors=dict(state['errors'])
+                )
+                for username, state in self.usernames.items()
+            }
+            return self._last_id, {'status': self.status, 'usernames': usernames}
+
+    def wait_events(
+        self, last_id: int, timeout: float
+    ) -> Optional[List[Tuple[int, str, Dict[str, Any]]]]:
+        """
+        Events after `last_id`, waits up to `timeout` for new ones.
+
+        Returns None if some events after `last_id` are already dropped
+        from the buffer, the client must start from the snapshot then.
+        """
+        with self._condition:
+            if last_id >= self._last_id and not self.finished:
+                self._condition.wait(timeout)
+
+            if last_id < self._last_id and (
+                not self._events or last_id < self._events[0][0] - 1
+            ):
+                return None
+
+            return [e for e in self._events if e[0] > last_id]
+
+
+class ProgressQueryNotify(QueryNotify):
+    """Sends check results of one username to the job progress"""
+
+    def __init__(self, progress: JobProgress, username: str):
+        super().__init__()
+        self.progress = progress
+        self.username = username
+
+    def update(self, result, is_similar=False):
+        self.result = result
+        self.progress.update(self.username, result)
@@ -0,0 +1,112 @@
+"""Lazy rendering of the web interface reports
+
+Search results are kept as is, each report is rendered on the first
+download and saved in the search folder for the next ones.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+import maigret.report
+from maigret.report import generate_report_context, generate_report_template
+from maigret.sites import MaigretDatabase
+
+# reports of one username, other ones are made for all usernames of the search
+USERNAME_REPORT_FORMATS = ('csv', 'json')
+REPORT_FORMATS = USERNAME_REPORT_FORMATS + ('html', 'pdf', 'graph')
+PDF_WORKERS = 2
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
+
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # don't fork threads of the web server and the search loop
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pdf_pool
+
+
+class UnknownReportError(ValueError):
+    pass
+
+
+class JobReports:
+    """Reports of one search, rendered on demand"""
+
+    def __init__(self, folder: str, general_results: list, db: MaigretDatabase):
+        self.folder = folder
+        self.general_results = general_results
+        self.db = db
+        self.usernames = [username for username, _, _ in general_results]
+        self._context: Optional[dict] = None
+        self._lock = threading.Lock()
+        self._file_locks: Dict[str, threading.Lock] = {}
+
+    @property
+    def context(self) -> dict:
+        """Report context of all usernames, computed once per search"""
+        with self._lock:
+            if self._context is None:
+                self._context = generate_report_context(self.general_results)
+            return self._context
+
+    def filename(self, fmt: str, username: Optional[str] = None) -> str:
+        if fmt not in REPORT_FORMATS:
+            raise UnknownReportError(f"Unknown report format {fmt}")
+
+        if fmt in USERNAME_REPORT_FORMATS:
+            if username not in self.usernames:
+                raise UnknownReportError(f"Unknown username {username}")
+            return f"report_{username}.{fmt}"
+        if fmt == 'graph':
+            return "combined_graph.html"
+        return f"report.{fmt}"
+
+    def get(self, fmt: str, username: Optional[str] = None) -> str:
+        """Path to the report file, renders it if it doesn't exist yet"""
+        path = os.path.join(self.folder, self.filename(fmt, username))
+
+        with self._lock:
+            file_lock = self._file_locks.setdefault(path, threading.Lock())
+
+        with file_lock:
+            if not os.path.exists(path):
+                os.makedirs(self.folder, exist_ok=True)
+                # write to a temporary file to never serve a partial report
+                root, ext = os.path.splitext(path)
+                tmp_path = f"{root}.tmp{ext}"
+                self._render(fmt, username, tmp_path)
+                os.replace(tmp_path, path)
+                logging.info(f"Rendered report {path}")
+
+        return path
+
+    def _render(self, fmt: str, username: Optional[str], path: str):
+        if fmt in USERNAME_REPORT_FORMATS:
+            results = next(r for u, _, r in self.general_results if u == username)
+            if fmt == 'csv':
+                maigret.report.save_csv_report(path, username, results)
+            else:
+                maigret.report.save_json_report(
+                    path, username, results, report_type='ndjson'
+                )
+        elif fmt == 'graph':
+            maigret.report.save_graph_report(path, self.general_results, self.db)
+        elif fmt == 'html':
+            maigret.report.save_html_report(path, self.context)
+        elif fmt == 'pdf':
+            template, css = generate_report_template(is_pdf=True)
+            html = template.render(**self.context)
+            get_pdf_pool().submit(
+                maigret.report.convert_html_to_pdf, path, html, css
+            ).result()
@@ -0,0 +1,276 @@
+"""SQLite storage of the web interface search jobs
+
+Jobs and check results of every site are kept on disk, so finished searches
+survive restarts of the web server. Reports are rendered from stored results.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from maigret.errors import CheckError
+from maigret.result import MaigretCheckResult, MaigretCheckStatus
+from maigret.sites import MaigretDatabase, MaigretSite
+from maigret.types import QueryResultWrapper
+
+# finished jobs and their reports are removed after this time, seconds
+JOBS_RETENTION = 7 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    options TEXT NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_created_at ON jobs (created_at);
+
+CREATE TABLE IF NOT EXISTS job_usernames (
+    job_id TEXT NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    id_type TEXT NOT NULL,
+    PRIMARY KEY (job_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS site_results (
+    job_id TEXT NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    username TEXT NOT NULL,
+    site_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    url_main TEXT,
+    url_user TEXT,
+    http_status INTEGER,
+    is_similar INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    tags TEXT,
+    ids_data TEXT,
+    ids_usernames TEXT,
+    PRIMARY KEY (job_id, username, site_name)
+);
+CREATE INDEX IF NOT EXISTS site_results_status ON site_results (job_id, status);
+CREATE INDEX IF NOT EXISTS site_results_username ON site_results (username, status);
+"""
+
+
+def dump_json(value) -> Optional[str]:
+    return json.dumps(value, default=str) if value else None
+
+
+def load_json(value, default=None):
+    return json.loads(value) if value else default
+
+
+def load_check_error(value: Optional[str]) -> Optional[CheckError]:
+    """CheckError of its string, as it's stored"""
+    if not value:
+        return None
+    typename, sep, desc = value.partition(' error: ')
+    if not sep and value.endswith(' error'):
+        typename = value[: -len(' error')]
+    return CheckError(typename, desc)
+
+
+class JobStore:
+    """
+    Search jobs storage, safe to use from several threads:
+    each thread has its own connection.
+    """
+
+    def __init__(self, path: str, reports_folder: Optional[str] = None):
+        self.path = path
+        self.reports_folder = reports_folder
+        self._local = threading.local()
+        with self.connection as conn:
+            conn.executescript(SCHEMA)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.connection = conn
+        return conn
+
+    def report_folder(self, job_id: str) -> Optional[str]:
+        if not self.reports_folder:
+            return None
+        return os.path.join(self.reports_folder, f"search_{job_id}")
+
+    def create_job(
+        self, usernames: List[str], options: Dict[str, Any], id_type: str = 'username'
+    ) -> str:
+        job_id = uuid.uuid4().hex
+        with self.connection as conn:
+            conn.execute(
+                'INSERT INTO jobs (id, status, created_at, options) VALUES (?, ?, ?, ?)',
+                (job_id, 'running', time.time(), json.dumps(options)),
+            )
+            conn.executemany(
+                'INSERT INTO job_usernames (job_id, position, username, id_type) '
+                'VALUES (?, ?, ?, ?)',
+                [(job_id, i, u, id_type) for i, u in enumerate(usernames)],
+            )
+        return job_id
+
+    def finish_job(
+        self, job_id: str, general_results: list, error: Optional[str] = None
+    ):
+        rows, id_types = [], []
+        for username, id_type, results in general_results:
+            id_types.append((id_type, job_id, username))
+            for site_name, site_result in results.items():
+                status = site_result.get('status')
+                if not status:
+                    continue
+                rows.append(
+                    (
+                        job_id,
+                        username,
+                        site_name,
+                        str(status.status),
+                        site_result.get('url_main'),
+                        site_result.get('url_user'),
+                        site_result.get('http_status') or None,
+                        int(bool(site_result.get('is_similar'))),
+                        str(status.error) if status.error else None,
+                        dump_json(status.tags),
+                        dump_json(status.ids_data),
+                        dump_json(site_result.get('ids_usernames')),
+                    )
+                )
+
+        with self.connection as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO site_results VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+            conn.executemany(
+                'UPDATE job_usernames SET id_type = ? WHERE job_id = ? AND username = ?',
+                id_types,
+            )
+            conn.execute(
+                'UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?',
+                ('failed' if error else 'completed', time.time(), error, job_id),
+            )
+
+    def delete_job(self, job_id: str):
+        with self.connection as conn:
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self.connection.execute(
+            'SELECT * FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+
+        job = dict(row)
+        job['options'] = json.loads(job['options'])
+        rows = self.connection.execute(
+            'SELECT username, id_type FROM job_usernames WHERE job_id = ? '
+            'ORDER BY position',
+            (job_id,),
+        ).fetchall()
+        job['usernames'] = [r['username'] for r in rows]
+        job['id_types'] = {r['username']: r['id_type'] for r in rows}
+        return job
+
+    def get_site_results(
+        self, job_id: str, status: Optional[str] = None
+    ) -> List[sqlite3.Row]:
+        query = 'SELECT * FROM site_results WHERE job_id = ?'
+        params: List[Any] = [job_id]
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        return self.connection.execute(query, params).fetchall()
+
+    def get_claimed_profiles(self, job_id: str) -> Dict[str, List[Dict[str, Any]]]:
+        profiles: Dict[str, List[Dict[str, Any]]] = {}
+        for row in self.get_site_results(job_id, str(MaigretCheckStatus.CLAIMED)):
+            profiles.setdefault(row['username'], []).append(
+                {
+                    'site_name': row['site_name'],
+                    'url': row['url_user'] or '',
+                    'tags': load_json(row['tags'], []),
+                }
+            )
+        return profiles
+
+    def load_results(self, job_id: str, db: MaigretDatabase) -> list:
+        """Search results of the job in the format of `maigret.search`"""
+        job = self.get_job(job_id)
+        if not job:
+            return []
+
+        results: Dict[str, Dict[str, QueryResultWrapper]] = {
+            u: {} for u in job['usernames']
+        }
+        statuses = {str(s): s for s in MaigretCheckStatus}
+        for row in self.get_site_results(job_id):
+            username, site_name = row['username'], row['site_name']
+            site = db.sites_dict.get(site_name) or MaigretSite(site_name, {})
+            status = MaigretCheckResult(
+                username,
+                site_name,
+                row['url_user'] or '',
+                statuses[row['status']],
+                ids_data=load_json(row['ids_data']),
+                error=load_check_error(row['error']),
+                tags=load_json(row['tags'], []),
+            )
+            site_result = {
+                'site': site,
+                'username': username,
+                'url_main': row['url_main'],
+                'url_user': row['url_user'],
+                'http_status': row['http_status'],
+                'is_similar': bool(row['is_similar']),
+                'status': status,
+            }
+            if row['ids_usernames']:
+                site_result['ids_usernames'] = load_json(row['ids_usernames'])
+            results.setdefault(username, {})[site_name] = site_result
+
+        return [(u, job['id_types'][u], results[u]) for u in job['usernames']]
+
+    def fail_interrupted_jobs(self):
+        """Jobs left running by the previous process will never finish"""
+        with self.connection as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, finished_at = ?, error = ? '
+                'WHERE status = ?',
+                ('failed', time.time(), 'Interrupted by restart', 'running'),
+            )
+
+    def cleanup(self, retention: float = JOBS_RETENTION) -> int:
+        """Remove old finished jobs and their report folders"""
+        threshold = time.time() - retention
+        rows = self.connection.execute(
+            'SELECT id FROM jobs WHERE created_at < ? AND status != ?',
+            (threshold, 'running'),
+        ).fetchall()
+        job_ids = [r['id'] for r in rows]
+
+        with self.connection as conn:
+            conn.executemany('DELETE FROM jobs WHERE id = ?', [(i,) for i in job_ids])
+
+        for job_id in job_ids:
+            folder = self.report_folder(job_id)
+            if folder and os.path.isdir(folder):
+                shutil.rmtree(folder, ignore_errors=True)
+
+        return len(job_ids)
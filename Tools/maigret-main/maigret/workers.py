@@ -0,0 +1,250 @@
+"""Maigret multi-process scanning
+
+Sites of a username are split into small chunks which are checked by worker
+processes, each one with its own event loop, HTTP session and a slice of the
+connections limit. Chunks wait in the shared queue of the process pool and
+an idle worker takes the next one, so slow chunks don't hold other workers.
+
+Results are sent back without unpicklable parts (checkers, sessions), and
+the parent process attaches its own site objects to them, so they can be
+used for reports as usual.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from alive_progress import alive_bar
+from aiohttp import ClientSession, TCPConnector
+
+try:
+    from mock import Mock
+except ImportError:
+    from unittest.mock import Mock
+
+from .checking import maigret
+from .errors import CheckError
+from .latency import AdaptiveTimeouts
+from .notify import PROGRESS_REFRESH_SECS
+from .result import MaigretCheckResult, MaigretCheckStatus
+from .sites import MaigretDatabase, MaigretSite
+from .types import QueryResultWrapper
+
+# every worker gets about this number of chunks of each username sites
+CHUNKS_PER_WORKER = 8
+MAX_CHUNK_SIZE = 50
+DNS_CACHE_TTL = 300
+
+# state of a worker process
+_worker: Dict[str, Any] = {}
+
+
+async def make_session(limit: int) -> ClientSession:
+    connector = TCPConnector(ssl=False, limit=limit, ttl_dns_cache=DNS_CACHE_TTL)
+    return ClientSession(connector=connector, trust_env=True)
+
+
+def _init_worker(db: MaigretDatabase, log_level: int, connections: int, shared_session):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    logger = logging.getLogger('maigret')
+    logger.setLevel(log_level)
+
+    _worker.update(
+        db=db,
+        loop=loop,
+        logger=logger,
+        # compiled for all the usernames checked by the worker
+        site_plans={},
+        session=(
+            loop.run_until_complete(make_session(connections))
+            if shared_session
+            else None
+        ),
+    )
+
+
+def _check_chunk(
+    username: str, id_type: str, site_names: List[str], search_kwargs: Dict
+) -> List[Tuple[str, QueryResultWrapper]]:
+    """Check sites of the chunk in the worker event loop"""
+    sites_dict = _worker['db'].sites_dict
+    results = _worker['loop'].run_until_complete(
+        maigret(
+            username=username,
+            site_dict={name: sites_dict[name] for name in site_names},
+            logger=_worker['logger'],
+            id_type=id_type,
+            no_progressbar=True,
+            session=_worker['session'],
+            site_plans=_worker['site_plans'],
+            **search_kwargs,
+        )
+    )
+    return [(name, strip_result(result)) for name, result in results.items()]
+
+
+def strip_result(result: QueryResultWrapper) -> QueryResultWrapper:
+    """Result without objects which can't be sent to another process"""
+    return {
+        k: v
+        for k, v in result.items()
+        if k not in ('site', 'checker', 'future', 'plan')
+    }
+
+
+def make_chunks(site_names: List[str], workers: int) -> List[List[str]]:
+    size = -(-len(site_names) // (workers * CHUNKS_PER_WORKER))
+    size = min(MAX_CHUNK_SIZE, max(1, size))
+    return [site_names[i : i + size] for i in range(0, len(site_names), size)]
+
+
+class ShardedScanner:
+    """
+    Pool of worker processes checking sites for usernames.
+
+    Search arguments are the same as for `maigret.search`,
+    `max_connections` is divided between workers.
+    """
+
+    def __init__(self, db: MaigretDatabase, workers: int, logger, **kwargs):
+        self.db = db
+        self.workers = workers
+        self.logger = logger
+        self.search_kwargs = dict(kwargs)
+
+        max_connections = self.search_kwargs.pop('max_connections', 100)
+        self.worker_connections = max(1, max_connections // workers)
+        self.search_kwargs['max_connections'] = self.worker_connections
+        if 'min_connections' in self.search_kwargs:
+            self.search_kwargs['min_connections'] = min(
+                self.search_kwargs['min_connections'], self.worker_connections
+            )
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            kwargs = self.search_kwargs
+            # sessions with proxies and cookies are made for each search
+            shared_session = not any(
+                kwargs.get(k) for k in ('proxy', 'tor_proxy', 'i2p_proxy', 'cookies')
+            )
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # forked children would inherit the running event loop
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(
+                    self.db,
+                    self.logger.level,
+                    self.worker_connections,
+                    shared_session,
+                ),
+            )
+        return self._executor
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def _failed_chunk_results(
+        self, username, site_names, error
+    ) -> List[Tuple[str, QueryResultWrapper]]:
+        return [
+            (
+                name,
+                {
+                    'username': username,
+                    'status': MaigretCheckResult(
+                        username,
+                        name,
+                        '',
+                        MaigretCheckStatus.UNKNOWN,
+                        error=CheckError('Worker failure', str(error)),
+                    ),
+                },
+            )
+            for name in site_names
+        ]
+
+    async def search(
+        self,
+        username: str,
+        site_dict: Dict[str, MaigretSite],
+        query_notify=None,
+        id_type: str = 'username',
+        no_progressbar: bool = False,
+        on_result=None,
+    ) -> Dict[str, QueryResultWrapper]:
+        if not query_notify:
+            query_notify = Mock()
+
+        query_notify.start(username, id_type)
+
+        site_names = list(site_dict)
+        if self.search_kwargs.get('adaptive_timeouts'):
+            # start long-running checks first to shorten the tail of the scan
+            timeouts = AdaptiveTimeouts(
+                self.search_kwargs.get('min_timeout', 1),
+                self.search_kwargs.get('timeout', 3),
+            )
+            site_names.sort(
+                key=lambda x: timeouts.expected_duration(site_dict[x]), reverse=True
+            )
+
+        pending = {}
+        for chunk in make_chunks(site_names, self.workers):
+            future = self.executor.submit(
+                _check_chunk, username, id_type, chunk, self.search_kwargs
+            )
+            pending[asyncio.wrap_future(future)] = chunk
+
+        all_results: Dict[str, QueryResultWrapper] = {}
+
+        with alive_bar(
+            len(site_names),
+            title="Searching",
+            force_tty=True,
+            disable=no_progressbar,
+            refresh_secs=PROGRESS_REFRESH_SECS,
+        ) as progress:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending.keys(), return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    chunk = pending.pop(future)
+                    try:
+                        chunk_results = future.result()
+                    except Exception as e:
+                        self.logger.error(f'Worker failed to check {chunk}: {e}')
+                        chunk_results = self._failed_chunk_results(
+                            username, chunk, e
+                        )
+
+                    for name, result in chunk_results:
+                        site = site_dict[name]
+                        result['site'] = site
+                        all_results[name] = result
+                        if on_result:
+                            on_result(name, result)
+
+                        status = result.get('status')
+                        if not status:
+                            continue
+                        if status.query_time and not status.error:
+                            AdaptiveTimeouts.record(site, status.query_time)
+                        query_notify.update(status, site.similar_search)
+                        progress()
+            query_notify.flush()
+
+        query_notify.finish()
+
+        # keep order of sites as in a usual search
+        return {name: all_results[name] for name in site_dict if name in all_results}
@@ -1,6 +1,8 @@
+import asyncio
 import glob
 import logging
 import os
+import socket
 
 import pytest
 from _pytest.mark import Mark
@@ -10,7 +12,6 @@ from maigret.maigret import setup_arguments_parser
 from maigret.settings import Settings
 from aiohttp import web
 
-
 LOCAL_SERVER_PORT = 8080
 
 CUR_PATH = os.path.dirname(os.path.realpath(__file__))
@@ -116,3 +117,186 @@ async def cookie_test_server():
     await server.start()
     yield server
     await runner.cleanup()
+
+
+class SocksProxyStub:
+    """Local SOCKS5 proxy stand-in, with optional username/password auth"""
+
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.connections = 0
+        self.streams = 0
+        # auth usernames of all the connections
+        self.usernames = []
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f'socks5://{host}:{port}'
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return self
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            if self.broken:
+                return
+            _, methods_count = await reader.readexactly(2)
+            methods = await reader.readexactly(methods_count)
+            if 2 in methods:
+                writer.write(b'\x05\x02')
+                _, length = await reader.readexactly(2)
+                self.usernames.append((await reader.readexactly(length)).decode())
+                length = (await reader.readexactly(1))[0]
+                await reader.readexactly(length)
+                writer.write(b'\x01\x00')
+            else:
+                writer.write(b'\x05\x00')
+
+            _, _, _, address_type = await reader.readexactly(4)
+            if address_type == 1:
+                host = socket.inet_ntoa(await reader.readexactly(4))
+            elif address_type == 4:
+                host = socket.inet_ntop(socket.AF_INET6, await reader.readexactly(16))
+            else:
+                length = (await reader.readexactly(1))[0]
+                host = (await reader.readexactly(length)).decode()
+            port = int.from_bytes(await reader.readexactly(2), 'big')
+
+            target_reader, target_writer = await asyncio.open_connection(host, port)
+            writer.write(b'\x05\x00\x00\x01' + bytes(6))
+            self.streams += 1
+            await asyncio.gather(
+                self.pipe(reader, target_writer),
+                self.pipe(target_reader, writer),
+            )
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def pipe(reader, writer):
+        try:
+            while data := await reader.read(65536):
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+@pytest.fixture
+async def socks_proxy():
+    """Factory of started SOCKS5 proxy stand-ins"""
+    proxies = []
+
+    async def make(**kwargs):
+        proxy = await SocksProxyStub(**kwargs).start()
+        proxies.append(proxy)
+        return proxy
+
+    yield make
+    for proxy in proxies:
+        await proxy.close()
+
+
+class DnsServerStub(asyncio.DatagramProtocol):
+    """Local UDP nameserver stand-in answering from `records`"""
+
+    TYPES = {1: 'A', 5: 'CNAME', 28: 'AAAA'}
+
+    def __init__(self, records=None, servfail=()):
+        # (domain, record type) -> (ttl, values)
+        self.records = records or {}
+        self.servfail = set(servfail)
+        self.queries = []
+        self.transport = None
+
+    @property
+    def address(self):
+        host, port = self.transport.get_extra_info('sockname')[:2]
+        return f'{host}:{port}'
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=('127.0.0.1', 0))
+        return self
+
+    def close(self):
+        self.transport.close()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    @staticmethod
+    def encode_name(name):
+        labels = [label.encode() for label in name.split('.') if label]
+        return b''.join(bytes([len(label)]) + label for label in labels) + b'\0'
+
+    def encode_value(self, qtype, value):
+        if qtype == 'A':
+            return socket.inet_aton(value)
+        if qtype == 'AAAA':
+            return socket.inet_pton(socket.AF_INET6, value)
+        return self.encode_name(value)
+
+    def datagram_received(self, data, addr):
+        end = data.index(b'\0', 12) + 5
+        question = data[12:end]
+        name, i = [], 12
+        while data[i]:
+            name.append(data[i + 1 : i + 1 + data[i]].decode())
+            i += 1 + data[i]
+        domain = '.'.join(name).lower()
+        qtype = self.TYPES.get(int.from_bytes(data[i + 1 : i + 3], 'big'))
+        self.queries.append((domain, qtype))
+
+        answers = []
+        if domain in self.servfail:
+            rcode = 2
+        elif (domain, qtype) in self.records:
+            rcode = 0
+            ttl, values = self.records[(domain, qtype)]
+            type_code = {v: k for k, v in self.TYPES.items()}[qtype]
+            for value in values:
+                rdata = self.encode_value(qtype, value)
+                answers.append(
+                    b'\xc0\x0c'
+                    + type_code.to_bytes(2, 'big')
+                    + b'\x00\x01'
+                    + ttl.to_bytes(4, 'big')
+                    + len(rdata).to_bytes(2, 'big')
+                    + rdata
+                )
+        elif any(domain == d for d, _ in self.records):
+            # the name exists without records of the type
+            rcode = 0
+        else:
+            rcode = 3
+        header = data[:2] + bytes([0x81, 0x80 | rcode]) + b'\x00\x01'
+        header += len(answers).to_bytes(2, 'big') + bytes(4)
+        self.transport.sendto(header + question + b''.join(answers), addr)
+
+
+@pytest.fixture
+async def dns_server():
+    """Factory of started nameserver stand-ins"""
+    servers = []
+
+    async def make(**kwargs):
+        server = await DnsServerStub(**kwargs).start()
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.close()
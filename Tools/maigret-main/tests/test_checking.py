@@ -2,6 +2,17 @@ from mock import Mock
 import pytest
 
 from maigret import search
+from maigret.checking import (
+    SimpleAiohttpChecker,
+    SitePlan,
+    get_site_plan,
+    make_site_result,
+    parse_retry_after,
+    process_site_result,
+)
+from maigret.result import MaigretCheckStatus
+from maigret.sites import MaigretSite
+from maigret.transfer import ACCEPT_ENCODING, ResponseBody
 
 
 def site_result_except(server, username, **kwargs):
@@ -24,6 +35,29 @@ async def test_checking_by_status_code(httpserver, local_test_db):
     assert result['StatusCode']['status'].is_found() is False
 
 
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_site_plans_shared_by_searches(httpserver, local_test_db):
+    sites_dict = local_test_db.sites_dict
+    site_result_except(httpserver, 'claimed', status=200)
+    site_result_except(httpserver, 'unclaimed', status=404)
+    site_plans = {}
+
+    result = await search(
+        'claimed', site_dict=sites_dict, logger=Mock(), site_plans=site_plans
+    )
+    assert result['StatusCode']['status'].is_found() is True
+    plans = dict(site_plans)
+    assert len(plans) == len(sites_dict)
+
+    result = await search(
+        'unclaimed', site_dict=sites_dict, logger=Mock(), site_plans=site_plans
+    )
+    assert result['StatusCode']['status'].is_found() is False
+    # compiled by the first search only
+    assert all(site_plans[key] is plan for key, plan in plans.items())
+
+
 @pytest.mark.slow
 @pytest.mark.asyncio
 async def test_checking_by_message_positive_full(httpserver, local_test_db):
@@ -67,3 +101,196 @@ async def test_checking_by_message_negative(httpserver, local_test_db):
 
     result = await search('unclaimed', site_dict=sites_dict, logger=Mock())
     assert result['Message']['status'].is_found() is True
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_checking_with_adaptive_connections(httpserver, local_test_db):
+    sites_dict = local_test_db.sites_dict
+
+    site_result_except(httpserver, 'claimed', response_data="user profile")
+
+    result = await search(
+        'claimed',
+        site_dict=sites_dict,
+        logger=Mock(),
+        adaptive_connections=True,
+        min_connections=1,
+        max_connections=4,
+    )
+    assert result['Message']['status'].is_found() is True
+    assert result['StatusCode']['status'].is_found() is True
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_checking_with_adaptive_timeouts(httpserver, local_test_db):
+    sites_dict = local_test_db.sites_dict
+
+    site_result_except(httpserver, 'claimed', response_data="user profile")
+
+    for _ in range(2):
+        result = await search(
+            'claimed',
+            site_dict=sites_dict,
+            logger=Mock(),
+            adaptive_timeouts=True,
+            min_timeout=1,
+            timeout=10,
+        )
+        assert result['Message']['status'].is_found() is True
+        assert result['Message']['status'].query_time < 10
+
+    assert sites_dict['Message'].stats['latency'].total == 2
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_checking_retry_after_too_many_requests(httpserver, local_test_db):
+    sites_dict = {'StatusCode': local_test_db.sites_dict['StatusCode']}
+
+    httpserver.expect_oneshot_request(
+        '/url', query_string='id=claimed'
+    ).respond_with_data(status=429, headers={'Retry-After': '0'})
+    site_result_except(httpserver, 'claimed', status=200)
+
+    result = await search('claimed', site_dict=sites_dict, logger=Mock(), retries=0)
+    assert result['StatusCode']['status'].error.type == 'Too many requests'
+
+    httpserver.expect_oneshot_request(
+        '/url', query_string='id=claimed'
+    ).respond_with_data(status=429, headers={'Retry-After': '0'})
+
+    result = await search('claimed', site_dict=sites_dict, logger=Mock(), retries=1)
+    assert result['StatusCode']['status'].is_found() is True
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert parse_retry_after('soon') is None
+
+
+def plan_options(**kwargs):
+    return dict(
+        {
+            'checkers': {'': SimpleAiohttpChecker()},
+            'parsing': False,
+            'timeout': 3,
+            'id_type': 'username',
+            'forced': False,
+            'site_plans': {},
+        },
+        **kwargs,
+    )
+
+
+def test_site_plan_urls():
+    site = MaigretSite(
+        'Site',
+        {
+            'url': '{urlMain}{urlSubpath}//users/{username}',
+            'urlMain': 'https://example.com/',
+            'urlSubpath': '/forum',
+            'urlProbe': '{urlMain}api?name={username}',
+            'getParams': {'a': 1},
+            'checkType': 'status_code',
+            'requestHeadOnly': True,
+            'headers': {'X-Token': 'secret'},
+        },
+    )
+    plan = SitePlan(site, site.url_main, plan_options(), Mock())
+
+    assert plan.make_url('alice') == 'https://example.com/forum/users/alice'
+    assert plan.make_url('a b') == 'https://example.com/forum/users/a%20b'
+    # slashes of username are merged as before plans
+    assert plan.make_url('/alice') == 'https://example.com/forum/users/alice'
+    assert plan.make_url('') == 'https://example.com/forum/users/'
+    assert plan.make_probe_url('a b', '') == 'https://example.com/api?name=a b&a=1'
+    assert plan.method == 'head'
+    assert plan.allow_redirects is True
+
+    headers = plan.make_headers()
+    assert headers['X-Token'] == 'secret'
+    assert headers['Connection'] == 'close'
+    assert 'User-Agent' in headers
+    assert headers['Accept-Encoding'] == ACCEPT_ENCODING
+
+    site.headers['X-Token'] = 'activated'
+    plan.update_headers()
+    assert plan.make_headers()['X-Token'] == 'activated'
+
+
+def test_site_plan_reused_for_usernames():
+    site = MaigretSite(
+        'Site',
+        {
+            'url': 'https://example.com/{username}',
+            'urlMain': 'https://example.com/',
+            'regexCheck': '^[a-z]+$',
+            'checkType': 'response_url',
+        },
+    )
+    options = plan_options()
+
+    result = make_site_result(site, 'alice', options, Mock())
+    assert result['url_user'] == 'https://example.com/alice'
+    assert 'status' not in result
+    assert options['checkers'][''].url == 'https://example.com/alice'
+    assert result['plan'] is get_site_plan(site, site.url_main, options, Mock())
+
+    result = make_site_result(site, 'Bob1', options, Mock())
+    assert result['status'].status == MaigretCheckStatus.ILLEGAL
+    assert result['url_user'] == ''
+    assert len(options['site_plans']) == 1
+
+    # plans of other identifier types and reloaded sites are separate
+    options['id_type'] = 'gaia_id'
+    assert get_site_plan(site, site.url_main, options, Mock()).illegal_error
+    options['id_type'] = 'username'
+    reloaded = MaigretSite('Site', dict(site.__dict__))
+    assert get_site_plan(reloaded, site.url_main, options, Mock()).site is reloaded
+    assert len(options['site_plans']) == 2
+
+    site.disabled = True
+    options = plan_options()
+    result = make_site_result(site, 'alice', options, Mock())
+    assert result['status'].error.type == 'Check is disabled'
+
+
+def test_process_result_matches_bytes():
+    site = MaigretSite(
+        'Site',
+        {
+            'url': 'https://example.com/{username}',
+            'urlMain': 'https://example.com/',
+            'checkType': 'message',
+            'presenseStrs': ['Профиль'],
+            'absenceStrs': ['not found'],
+        },
+    )
+
+    def process(body, parsing=False):
+        results_info = {
+            'username': 'alice',
+            'parsing_enabled': parsing,
+            'url_user': 'https://example.com/alice',
+        }
+        return process_site_result(
+            (body, 200, None), Mock(), Mock(), results_info, site
+        )['status']
+
+    body = ResponseBody('<h1>Профиль alice</h1>'.encode('cp1251'), 'windows-1251')
+    assert process(body).status == MaigretCheckStatus.CLAIMED
+    # markers are found in bytes, the body isn't decoded
+    assert body._text is None
+
+    body = ResponseBody(b'<h1>alice not found</h1>')
+    assert process(body).status == MaigretCheckStatus.AVAILABLE
+    assert body._text is None
+
+    # found accounts are decoded for extraction
+    body = ResponseBody('<h1>Профиль alice</h1>'.encode())
+    assert process(body, parsing=True).status == MaigretCheckStatus.CLAIMED
+    assert body._text == '<h1>Профиль alice</h1>'
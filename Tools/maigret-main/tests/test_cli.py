@@ -4,20 +4,32 @@ from argparse import Namespace
 from typing import Dict, Any
 
 DEFAULT_ARGS: Dict[str, Any] = {
+    'adaptive_connections': False,
+    'adaptive_timeouts': False,
     'all_sites': False,
     'connections': 100,
+    'cluster_coordinator': None,
+    'cluster_token': None,
+    'cluster_worker': None,
     'cookie_file': None,
     'csv': False,
     'db_file': 'resources/data.json',
     'debug': False,
     'disable_extracting': False,
     'disable_recursive_search': False,
+    'dns_all_records': False,
+    'dns_nameservers': None,
+    'dns_queries': 200,
     'folderoutput': 'reports',
     'html': False,
     'graph': False,
     'id_type': 'username',
     'ignore_ids_list': [],
     'info': False,
+    'metrics_file': None,
+    'metrics_port': None,
+    'min_connections': 5,
+    'min_timeout': 1,
     'json': '',
     'new_site_to_submit': False,
     'no_color': False,
@@ -25,16 +37,26 @@ DEFAULT_ARGS: Dict[str, Any] = {
     'parse_url': '',
     'pdf': False,
     'permute': False,
+    'permute_limit': 1000,
     'print_check_errors': False,
     'print_not_found': False,
+    'profile': False,
+    'profile_pstats': None,
+    'profile_trace': None,
     'proxy': None,
+    'proxy_list': None,
+    'record': None,
+    'replay': None,
+    'replay_time_scale': 1.0,
     'reports_sorting': 'default',
     'retries': 0,
     'self_check': False,
+    'serve': None,
     'site_list': [],
     'stats': False,
     'tags': '',
     'timeout': 30,
+    'tor_circuits': 4,
     'tor_proxy': 'socks5://127.0.0.1:9050',
     'i2p_proxy': 'http://127.0.0.1:4444',
     'top_sites': 500,
@@ -44,6 +66,7 @@ DEFAULT_ARGS: Dict[str, Any] = {
     'verbose': False,
     'web': None,
     'with_domains': False,
+    'workers': 1,
     'xmind': False,
 }
 
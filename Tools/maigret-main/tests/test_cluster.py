@@ -0,0 +1,196 @@
+"""Maigret distributed scanning test functions"""
+
+import asyncio
+import logging
+
+import pytest
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+
+from maigret.cluster import (
+    ClusterCoordinator,
+    ClusterScan,
+    ClusterWorker,
+    TOKEN_HEADER,
+    is_loopback,
+    make_coordinator_app,
+    parse_address,
+    result_from_json,
+    result_to_json,
+    start_coordinator,
+)
+from maigret.errors import CheckError
+from maigret.result import MaigretCheckResult, MaigretCheckStatus
+from maigret.sites import MaigretSite
+
+
+def site_result_except(server, username, **kwargs):
+    query = f'id={username}'
+    server.expect_request('/url', query_string=query).respond_with_data(**kwargs)
+
+
+def make_site(name, host):
+    return MaigretSite(
+        name, {'url': f'https://{host}/{{username}}', 'urlMain': f'https://{host}/'}
+    )
+
+
+def test_parse_address():
+    assert parse_address('5006') == ('127.0.0.1', 5006)
+    assert parse_address('0.0.0.0:8000') == ('0.0.0.0', 8000)
+    assert is_loopback('127.0.0.1')
+    assert is_loopback('localhost')
+    assert is_loopback('[::1]')
+    assert not is_loopback('0.0.0.0')
+    assert not is_loopback('10.0.0.1')
+
+
+@pytest.mark.asyncio
+async def test_token_is_required():
+    with pytest.raises(ValueError):
+        await start_coordinator(ClusterCoordinator(), '0.0.0.0', 0)
+
+    server = TestServer(make_coordinator_app(ClusterCoordinator(), token='secret'))
+    await server.start_server()
+    url = str(server.make_url('/api/cluster/status'))
+    try:
+        async with ClientSession() as session:
+            async with session.get(url) as response:
+                assert response.status == 401
+            async with session.get(url, headers={TOKEN_HEADER: 'wrong'}) as response:
+                assert response.status == 401
+            async with session.get(url, headers={TOKEN_HEADER: 'secret'}) as response:
+                assert response.status == 200
+    finally:
+        await server.close()
+
+
+def test_result_json_roundtrip():
+    site = make_site('Site', 'example.com')
+    result = {
+        'site': site,
+        'username': 'alice',
+        'url_user': 'https://example.com/alice',
+        'http_status': 503,
+        'ids_usernames': {'bob': 'username'},
+        'status': MaigretCheckResult(
+            'alice',
+            'Site',
+            'https://example.com/alice',
+            MaigretCheckStatus.UNKNOWN,
+            query_time=0.5,
+            error=CheckError('Server', '503'),
+            tags=['us'],
+        ),
+    }
+
+    restored = result_from_json(result_to_json(result), site)
+    assert restored['site'] is site
+    assert restored['http_status'] == 503
+    assert restored['ids_usernames'] == {'bob': 'username'}
+    status = restored['status']
+    assert status.status == MaigretCheckStatus.UNKNOWN
+    assert str(status.error) == 'Server error: 503'
+    assert status.query_time == 0.5
+    assert status.tags == ['us']
+
+
+def test_units_and_host_politeness():
+    sites = {f'A{i}': make_site(f'A{i}', 'a.com') for i in range(5)}
+    sites.update({f'B{i}': make_site(f'B{i}', 'b.com') for i in range(3)})
+    coordinator = ClusterCoordinator(unit_size=4, per_host_limit=2)
+
+    units = coordinator.make_units(ClusterScan('alice', 'username', sites))
+    assert sorted(sum((u.sites for u in units), [])) == sorted(sites)
+    assert all(max(u.hosts.values()) <= 2 for u in units)
+    assert all(len(u.sites) <= 4 for u in units)
+
+    for unit in units:
+        coordinator.units[unit.id] = unit
+        coordinator._queue.append(unit)
+
+    worker_id = coordinator.register('test')['worker_id']
+    leased = coordinator.lease(worker_id, max_units=10)
+    # hosts of the first unit are busy, other units of a.com must wait
+    assert leased == [units[0]]
+    assert coordinator.lease(worker_id, max_units=10) == []
+
+    coordinator.release(worker_id, units[0].id, 'test')
+    assert coordinator.lease(worker_id, max_units=1) == [units[0]]
+
+
+@pytest.mark.asyncio
+async def test_lost_unit_is_requeued():
+    sites = {'A': make_site('A', 'a.com')}
+    coordinator = ClusterCoordinator(lease_timeout=0.2, max_attempts=2)
+    scan = ClusterScan('alice', 'username', sites)
+    unit = coordinator.make_units(scan)[0]
+    coordinator.units[unit.id] = unit
+    coordinator._queue.append(unit)
+
+    lost_worker = coordinator.register('lost')['worker_id']
+    assert coordinator.lease(lost_worker, 1) == [unit]
+
+    await asyncio.sleep(0.3)
+    assert coordinator.requeue_expired() == 1
+
+    worker = coordinator.register('alive')['worker_id']
+    assert coordinator.lease(worker, 1) == [unit]
+    assert coordinator.heartbeat(lost_worker, [unit.id]) == [unit.id]
+
+    # the second lost lease exhausts the attempts
+    await asyncio.sleep(0.3)
+    coordinator.requeue_expired()
+    assert not coordinator.units
+    assert scan.remaining == 0
+    assert scan.results['A']['status'].error.type == 'Cluster failure'
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_cluster_search(httpserver, local_test_db):
+    site_result_except(httpserver, 'claimed', status=200, response_data='user')
+    site_result_except(httpserver, 'unclaimed', status=404, response_data='404')
+
+    coordinator = ClusterCoordinator(unit_size=1)
+    server = TestServer(make_coordinator_app(coordinator, token='secret'))
+    await server.start_server()
+    url = str(server.make_url(''))
+
+    logger = logging.getLogger('maigret')
+    workers = [
+        ClusterWorker(
+            url, local_test_db, logger, name=f'w{i}', token='secret', timeout=5
+        )
+        for i in range(2)
+    ]
+    tasks = [asyncio.create_task(w.run()) for w in workers]
+
+    try:
+        sites = local_test_db.sites_dict
+        results = await asyncio.wait_for(
+            coordinator.search('claimed', sites, no_progressbar=True), 10
+        )
+        assert list(results) == list(sites)
+        for name, result in results.items():
+            assert result['status'].status == MaigretCheckStatus.CLAIMED
+            assert result['site'] is sites[name]
+
+        results = await asyncio.wait_for(
+            coordinator.search('unclaimed', sites, no_progressbar=True), 10
+        )
+        assert all(
+            r['status'].status == MaigretCheckStatus.AVAILABLE
+            for r in results.values()
+        )
+
+        stats = coordinator.stats()
+        assert len(stats['workers']) == 2
+        # workers count their checks after the coordinator gets the results
+        assert sum(w['checked'] for w in stats['workers'].values()) == 4
+        assert not coordinator.units
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await server.close()
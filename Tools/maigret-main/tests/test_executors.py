@@ -4,11 +4,14 @@ import pytest
 import asyncio
 import logging
 from maigret.executors import (
+    AdaptiveConcurrencyLimiter,
     AsyncioSimpleExecutor,
     AsyncioProgressbarExecutor,
     AsyncioProgressbarSemaphoreExecutor,
     AsyncioProgressbarQueueExecutor,
     AsyncioQueueGeneratorExecutor,
+    RetryPolicy,
+    merge_runs,
 )
 
 logger = logging.getLogger(__name__)
@@ -109,3 +112,164 @@ async def test_asyncio_queue_generator_executor():
     assert results == [0, 3, 6, 9, 1, 4, 7, 2, 5, 8]
     assert executor.execution_time > 0.2
     assert executor.execution_time < 0.3
+
+
+@pytest.mark.asyncio
+async def test_merge_runs():
+    slow = AsyncioQueueGeneratorExecutor(logger=logger, in_parallel=1)
+    fast = AsyncioQueueGeneratorExecutor(logger=logger, in_parallel=10)
+    slow_tasks = [(func, [n], {}) for n in (5, 8)]
+    fast_tasks = [(func, [n], {}) for n in (10, 30)]
+
+    results = [r async for r in merge_runs(slow.run(slow_tasks), fast.run(fast_tasks))]
+    # the busy executor doesn't hold back results of the other one
+    assert results == [30, 10, 5, 8]
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_increases_on_success():
+    limiter = AdaptiveConcurrencyLimiter(
+        logger=logger, min_limit=1, max_limit=10, initial_limit=2
+    )
+
+    for _ in range(5):
+        started_at = await limiter.acquire()
+        await limiter.acquire()
+        await limiter.release(None, started_at)
+        await limiter.release(None, started_at)
+
+    assert limiter.limit > 2
+    assert limiter.limit <= 10
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_decreases_on_congestion():
+    limiter = AdaptiveConcurrencyLimiter(
+        logger=logger, min_limit=2, max_limit=10, initial_limit=8
+    )
+
+    started_at = [await limiter.acquire() for _ in range(4)]
+    # burst of timeouts from one window is one congestion event
+    for t in started_at:
+        await limiter.release(None, t, 'Request timeout')
+    assert limiter.limit == 6
+
+    for _ in range(10):
+        t = await limiter.acquire()
+        await limiter.release(None, t, 'Connecting failure')
+    assert limiter.limit == 2
+
+    # permanent errors are not congestion signals
+    t = await limiter.acquire()
+    await limiter.release(None, t, 'Site-specific')
+    assert limiter.limit == 3
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_per_key():
+    limiter = AdaptiveConcurrencyLimiter(
+        logger=logger, min_limit=1, max_limit=10, initial_limit=4
+    )
+
+    t = await limiter.acquire('socks5://proxy1')
+    await limiter.release('socks5://proxy1', t, 'Bot protection')
+
+    assert limiter.limits == {'socks5://proxy1': 3}
+    assert limiter.limit == 3
+
+    t = await limiter.acquire('socks5://proxy2')
+    await limiter.release('socks5://proxy2', t)
+    assert limiter.limits['socks5://proxy2'] == 4
+
+
+@pytest.mark.asyncio
+async def test_asyncio_queue_generator_executor_with_limiter():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def tracked_func(n):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return n
+
+    limiter = AdaptiveConcurrencyLimiter(
+        logger=logger, min_limit=1, max_limit=3, initial_limit=1
+    )
+    tasks = [(tracked_func, [n], {}) for n in range(20)]
+    executor = AsyncioQueueGeneratorExecutor(
+        logger=logger, in_parallel=3, limiter=limiter
+    )
+    results = [result async for result in executor.run(tasks)]
+
+    assert sorted(results) == list(range(20))
+    assert max_in_flight <= 3
+    assert limiter.limit == 3
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_asyncio_queue_generator_executor_retries():
+    attempts = {}
+
+    async def flaky_func(n, retry=0, **kwargs):
+        attempts[n] = attempts.get(n, 0) + 1
+        await asyncio.sleep(0)
+        # odd tasks fail on the first attempt
+        return n, n % 2 == 1 and retry == 0
+
+    retry_policy = RetryPolicy(
+        max_retries=2,
+        base_delay=0.01,
+        retry_info_func=lambda result: (result[1], None),
+    )
+    tasks = [(flaky_func, [n], {'retry': 0}) for n in range(6)]
+    executor = AsyncioQueueGeneratorExecutor(
+        logger=logger, in_parallel=2, retry_policy=retry_policy
+    )
+    results = [result async for result in executor.run(tasks)]
+
+    assert sorted(results) == [(n, False) for n in range(6)]
+    assert attempts == {0: 1, 1: 2, 2: 1, 3: 2, 4: 1, 5: 2}
+    assert retry_policy.retries_count == 3
+
+
+@pytest.mark.asyncio
+async def test_asyncio_queue_generator_executor_retries_budget():
+    async def failing_func(n, **kwargs):
+        return n
+
+    retry_policy = RetryPolicy(
+        max_retries=3,
+        budget=2,
+        base_delay=0.01,
+        retry_info_func=lambda result: (True, None),
+    )
+    tasks = [(failing_func, [n], {}) for n in range(5)]
+    executor = AsyncioQueueGeneratorExecutor(
+        logger=logger, in_parallel=5, retry_policy=retry_policy
+    )
+    results = [result async for result in executor.run(tasks)]
+
+    assert sorted(results) == list(range(5))
+    assert retry_policy.retries_count == 2
+
+
+def test_retry_policy_delays():
+    retry_policy = RetryPolicy(
+        max_retries=5,
+        base_delay=1,
+        max_delay=4,
+        max_retry_after=30,
+        retry_info_func=lambda result: result,
+    )
+
+    assert 0.5 <= retry_policy.next_delay(0, (True, None)) <= 1
+    assert 2 <= retry_policy.next_delay(3, (True, None)) <= 4
+    assert retry_policy.next_delay(0, (True, 20)) == 20
+    assert retry_policy.next_delay(0, (True, 120)) is None
+    assert retry_policy.next_delay(0, (False, None)) is None
+    assert retry_policy.next_delay(5, (True, None)) is None
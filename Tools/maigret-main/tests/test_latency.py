@@ -0,0 +1,95 @@
+"""Maigret sites latency statistics test functions"""
+
+import os
+
+from maigret.latency import (
+    AdaptiveTimeouts,
+    LatencyHistogram,
+    MIN_SAMPLES,
+    get_site_latency,
+)
+from maigret.sites import MaigretDatabase, MaigretSite
+
+
+def test_latency_histogram_percentiles():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(0.5) is None
+
+    for _ in range(99):
+        histogram.add(0.2)
+    histogram.add(10)
+
+    assert 0.2 <= histogram.percentile(0.5) < 0.3
+    assert histogram.percentile(0.999) >= 10
+    assert histogram.total == 100
+
+
+def test_latency_histogram_decay():
+    histogram = LatencyHistogram()
+    for _ in range(10):
+        histogram.add(10)
+    for _ in range(100):
+        histogram.add(0.1)
+
+    # old slow samples are forgotten
+    assert histogram.percentile(0.99) < 0.2
+
+
+def test_latency_histogram_json():
+    histogram = LatencyHistogram()
+    histogram.add(1.5)
+
+    restored = LatencyHistogram.from_json(histogram.json)
+    assert restored.total == 1
+    assert restored.percentile(0.5) == histogram.percentile(0.5)
+
+    assert LatencyHistogram.from_json({'counts': [1], 'total': 1}).total == 0
+
+
+def test_adaptive_timeouts():
+    timeouts = AdaptiveTimeouts(min_timeout=1, max_timeout=30)
+    fast_site = MaigretSite('Fast', {})
+    slow_site = MaigretSite('Slow', {})
+    new_site = MaigretSite('New', {})
+
+    for _ in range(MIN_SAMPLES):
+        timeouts.record(fast_site, 0.1)
+        timeouts.record(slow_site, 12)
+
+    assert timeouts.timeout_for(fast_site) == 1
+    assert 12 < timeouts.timeout_for(slow_site) <= 30
+    assert timeouts.timeout_for(new_site) == 30
+
+    durations = sorted(
+        [fast_site, slow_site, new_site], key=timeouts.expected_duration, reverse=True
+    )
+    assert [s.name for s in durations] == ['New', 'Slow', 'Fast']
+
+
+def test_sites_stats_are_not_shared():
+    site1 = MaigretSite('Site1', {})
+    site2 = MaigretSite('Site2', {})
+    get_site_latency(site1).add(1)
+
+    assert 'latency' not in site2.stats
+
+
+def test_save_load_stats(tmp_path):
+    db = MaigretDatabase()
+    db.update_site(MaigretSite('Site1', {}))
+    db.update_site(MaigretSite('Site2', {}))
+    get_site_latency(db.sites_dict['Site1']).add(2)
+
+    filename = os.path.join(tmp_path, 'stats', 'sites_stats.json')
+    db.save_stats_to_file(filename)
+
+    new_db = MaigretDatabase()
+    new_db.update_site(MaigretSite('Site1', {}))
+    new_db.update_site(MaigretSite('Site2', {}))
+    new_db.load_stats_from_file(filename)
+
+    assert new_db.sites_dict['Site1'].stats['latency'].total == 1
+    assert 'latency' not in new_db.sites_dict['Site2'].stats
+
+    # missing file is not an error
+    new_db.load_stats_from_file(os.path.join(tmp_path, 'missing.json'))
@@ -0,0 +1,100 @@
+"""Maigret scan metrics test functions"""
+
+import logging
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from maigret import metrics
+from maigret.checking import maigret
+from maigret.metrics import Counter, Histogram, MetricsRegistry, make_metrics_app
+from maigret.profiler import stage
+
+
+def site_result_except(server, username, **kwargs):
+    query = f'id={username}'
+    server.expect_request('/url', query_string=query).respond_with_data(**kwargs)
+
+
+@pytest.fixture
+def scan_metrics():
+    metrics.disable()
+    yield metrics.enable()
+    metrics.disable()
+
+
+def test_render_text_format():
+    registry = MetricsRegistry()
+    counter = registry.add(Counter('test_total', 'Test counter.', ('type',)))
+    counter.inc('a "b"')
+    counter.inc('a "b"', value=2)
+    histogram = registry.add(Histogram('test_seconds', 'Test.', buckets=(0.1, 1)))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert registry.render().splitlines() == [
+        '# HELP test_total Test counter.',
+        '# TYPE test_total counter',
+        'test_total{type="a \\"b\\""} 3',
+        '# HELP test_seconds Test.',
+        '# TYPE test_seconds histogram',
+        'test_seconds_bucket{le="0.1"} 1',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        'test_seconds_sum 5.55',
+        'test_seconds_count 3',
+    ]
+
+    with pytest.raises(ValueError):
+        registry.add(Counter('test_total', 'Duplicate.'))
+
+
+def test_disabled_metrics():
+    metrics.disable()
+    metrics.check_started()
+    metrics.check_finished('CLAIMED')
+    assert metrics.get_metrics() is None
+
+
+def test_textfile(scan_metrics, tmp_path):
+    path = tmp_path / 'maigret.prom'
+    scan_metrics.retries.inc()
+    scan_metrics.write_textfile(str(path))
+    assert 'maigret_check_retries_total 1' in path.read_text()
+    assert [p.name for p in tmp_path.iterdir()] == ['maigret.prom']
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_scan_metrics(httpserver, local_test_db, scan_metrics):
+    site_result_except(httpserver, 'claimed', status=200, response_data='user')
+    sites = local_test_db.sites_dict
+
+    await maigret('claimed', sites, logging.getLogger('maigret'), timeout=5)
+
+    assert scan_metrics.checks.get('CLAIMED') == len(sites)
+    assert scan_metrics.checks_queued.get() == 0
+    assert scan_metrics.requests_in_flight.get() == 0
+    assert scan_metrics.response_bytes.get() == len('user') * len(sites)
+    assert scan_metrics.response_wire_bytes.get() == len('user') * len(sites)
+    _, _, count = scan_metrics.stage_duration.values[('check',)]
+    assert count == len(sites)
+
+    with stage('reports'):
+        pass
+    assert ('reports',) in scan_metrics.stage_duration.values
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(scan_metrics):
+    metrics.check_finished('UNKNOWN', 'Request timeout')
+
+    async with TestClient(TestServer(make_metrics_app())) as client:
+        response = await client.get('/metrics')
+        assert response.status == 200
+        assert response.headers['Content-Type'].startswith('text/plain')
+        text = await response.text()
+
+    assert 'maigret_checks_total{status="UNKNOWN"} 1' in text
+    assert 'maigret_check_errors_total{type="Request timeout"} 1' in text
@@ -1,5 +1,8 @@
+import time
+from io import StringIO
+
 from maigret.errors import CheckError
-from maigret.notify import QueryNotifyPrint
+from maigret.notify import CLEAR_LINE, QueryNotifyPrint, TerminalWriter
 from maigret.result import MaigretCheckStatus, MaigretCheckResult
 
 
@@ -62,3 +65,79 @@ def test_notify_unknown():
     result.error = CheckError('Type', 'Reason')
 
     assert n.update(result) == "[?] TEST_SITE: Type error: Reason"
+
+
+class TtyStream(StringIO):
+    def isatty(self):
+        return True
+
+
+def test_notify_skipped_results_are_not_formatted(monkeypatch):
+    def get_dict_ascii_tree(*args):
+        raise AssertionError('formatted')
+
+    monkeypatch.setattr('maigret.notify.get_dict_ascii_tree', get_dict_ascii_tree)
+    n = QueryNotifyPrint(color=False, print_found_only=True)
+    result = MaigretCheckResult(
+        username="test",
+        status=MaigretCheckStatus.AVAILABLE,
+        site_name="TEST_SITE",
+        site_url_user="http://example.com/test",
+        ids_data={'uid': '1'},
+    )
+    assert n.update(result) is None
+
+
+def test_terminal_writer_buffers_lines():
+    stream = StringIO()
+    output = TerminalWriter(stream, interval=60, max_lines=3)
+    n = QueryNotifyPrint(color=False, output=output)
+    assert not output.is_tty
+
+    n.info('first')
+    n.info('second')
+    time.sleep(0.05)
+    assert stream.getvalue() == ''
+
+    # a batch is written by the thread as soon as it's full
+    n.info('third')
+    for _ in range(100):
+        if stream.getvalue():
+            break
+        time.sleep(0.01)
+    assert stream.getvalue() == '[*] first\n[*] second\n[*] third\n'
+
+    n.warning('fourth')
+    n.finish()
+    assert stream.getvalue().endswith('[-] fourth\n')
+    output.close()
+    assert not output._thread.is_alive()
+
+
+def test_terminal_writer_flushes_on_interval():
+    stream = StringIO()
+    output = TerminalWriter(stream, interval=0.01)
+    output.write_line('line')
+    for _ in range(100):
+        if stream.getvalue():
+            break
+        time.sleep(0.01)
+    assert stream.getvalue() == 'line\n'
+    output.close()
+
+
+def test_terminal_writer_tty():
+    stream = TtyStream()
+    output = TerminalWriter(stream)
+    assert output.is_tty
+    for i in range(3):
+        output.write_line(f'line {i}')
+    output.close()
+
+    # the progress bar line is cleared once for the batch
+    assert stream.getvalue() == CLEAR_LINE + 'line 0\nline 1\nline 2\n'
+
+    unbuffered = TerminalWriter(TtyStream(), buffered=False)
+    unbuffered.write_line('line')
+    assert unbuffered.stream.getvalue() == CLEAR_LINE + 'line\n'
+    assert unbuffered._thread is None
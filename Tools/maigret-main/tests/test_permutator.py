@@ -1,5 +1,6 @@
 import pytest
-from maigret.permutator import Permute
+from maigret.permutator import Permute, UsernameSiteFilter
+from maigret.sites import MaigretSite
 
 
 def test_gather_strict():
@@ -48,3 +49,49 @@ def test_gather_all():
         'ba_': 2,
     }
     assert result == expected
+
+
+def test_generate_likely_first():
+    permute = Permute({'john': 'username', 'doe': 'username', 'x': 'username'})
+    result = list(permute.generate(method='strict', limit=4))
+    assert result == [
+        ('johndoe', 'username'),
+        ('johnx', 'username'),
+        ('doejohn', 'username'),
+        ('doex', 'username'),
+    ]
+
+    all_result = [p for p, _ in permute.generate(method='strict')]
+    # 6 ordered pairs and 6 triples, 6 variants of each
+    assert len(all_result) == len(set(all_result)) == 72
+    assert all_result.index('john.doe.x') > all_result.index('_doejohn')
+
+
+def test_generate_is_lazy():
+    permute = Permute({str(i): 'username' for i in range(12)})
+    assert len(list(permute.generate(method='all', limit=100))) == 100
+
+
+def test_generate_deduplicates():
+    permute = Permute({'a': 'username', 'b': 'username', 'ab': 'username'})
+    result = [p for p, _ in permute.generate(method='all')]
+    assert len(result) == len(set(result))
+    assert result[:3] == ['a', 'b', 'ab']
+
+
+def test_username_site_filter():
+    sites = {
+        name: MaigretSite(name, {'url': '{username}', 'regexCheck': regex})
+        for name, regex in [
+            ('Letters', '^[a-z]+$'),
+            ('Any', None),
+            ('NoDots', '^[^.]+$'),
+            ('Letters2', '^[a-z]+$'),
+        ]
+    }
+    site_filter = UsernameSiteFilter(sites)
+    assert len(site_filter.groups) == 2
+
+    assert list(site_filter('johndoe')) == ['Letters', 'Any', 'NoDots', 'Letters2']
+    assert list(site_filter('john_doe')) == ['Any', 'NoDots']
+    assert list(site_filter('john.doe')) == ['Any']
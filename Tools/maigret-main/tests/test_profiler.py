@@ -0,0 +1,55 @@
+"""Maigret scan stages profiler test functions"""
+
+import asyncio
+import json
+
+import pytest
+
+from maigret import profiler
+from maigret.profiler import count, stage
+
+
+@pytest.fixture
+def stages_profiler():
+    yield profiler.enable(trace=True)
+    profiler.disable()
+
+
+def test_stage_is_noop_when_disabled():
+    assert profiler.get_profiler() is None
+    assert stage('check') is profiler.NO_STAGE
+    with stage('check'):
+        pass
+    count('error: Request timeout')
+
+
+@pytest.mark.asyncio
+async def test_stages_and_trace(stages_profiler, tmp_path):
+    async def check(name):
+        with stage('check', name):
+            await asyncio.sleep(0.01)
+            with stage('extraction'):
+                pass
+
+    await asyncio.gather(check('A'), check('B'))
+    count('error: Request timeout')
+    count('error: Request timeout')
+
+    stats = stages_profiler.stages
+    assert stats['check'].count == 2
+    assert stats['extraction'].count == 2
+    assert stats['check'].total >= 2 * 10**7
+    assert stats['check'].max >= stats['extraction'].max
+    assert stages_profiler.counters == {'error: Request timeout': 2}
+
+    report = stages_profiler.report()
+    assert report.splitlines()[2].startswith('check ')
+    assert 'error: Request timeout' in report
+
+    filename = tmp_path / 'trace.json'
+    stages_profiler.save_trace(str(filename))
+    events = json.loads(filename.read_text())['traceEvents']
+    checks = [e for e in events if e['name'] == 'check']
+    assert sorted(e['args']['detail'] for e in checks) == ['A', 'B']
+    # concurrent checks are shown in different rows
+    assert checks[0]['tid'] != checks[1]['tid']
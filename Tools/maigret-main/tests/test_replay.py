@@ -0,0 +1,99 @@
+"""Maigret scans recording and replaying test functions"""
+
+import gzip
+import logging
+import time
+
+import pytest
+
+from maigret.checking import maigret
+from maigret.errors import CheckError
+from maigret.replay import ArchiveWriter, ReplayChecker, ScanArchive
+from maigret.result import MaigretCheckStatus
+from maigret.transfer import ResponseBody
+
+
+def site_result_except(server, username, **kwargs):
+    query = f'id={username}'
+    server.expect_request('/url', query_string=query).respond_with_data(**kwargs)
+
+
+def test_archive_roundtrip(tmp_path):
+    path = str(tmp_path / 'scan.jsonl.gz')
+    writer = ArchiveWriter(path)
+    request = {'method': 'get', 'url': 'https://a.com/x', 'headers': {}}
+    writer.add(request, ('not found', 404, None), 0.25)
+    writer.add(request, ('', 0, CheckError('Request timeout', 'x')), 3)
+    writer.add(dict(request, url='https://b.com/x'), ('not found', 404, None), 0.1)
+    headers = [('Content-Type', 'text/html; charset=cp1251'), ('Set-Cookie', 'a=1')]
+    body = ResponseBody('Профиль'.encode('cp1251'), 'cp1251', headers=dict(headers))
+    writer.add(dict(request, url='https://c.com/x'), (body, 429, None), 0.1)
+    writer.close()
+
+    archive = ScanArchive.load(path)
+    assert len(archive) == 4
+    # equal bodies are stored once
+    assert len(archive.bodies) == 3
+
+    # response headers are restored with the decoded body
+    body, status, _ = archive.response(archive.next('get', 'https://c.com/x'))
+    assert (body, status) == ('Профиль', 429)
+    assert 'Профиль' in body
+    assert list(body.headers.items()) == headers
+    assert body.headers['content-type'] == 'text/html; charset=cp1251'
+
+    first = archive.next('get', 'https://a.com/x')
+    assert archive.response(first) == ('not found', 404, None)
+    assert first['elapsed'] == 0.25
+
+    second = archive.response(archive.next('get', 'https://a.com/x'))
+    assert str(second[2]) == 'Request timeout error: x'
+    # the last exchange is repeated
+    assert archive.next('get', 'https://a.com/x')['elapsed'] == 3
+
+    assert archive.next('head', 'https://a.com/x') is None
+
+
+def test_not_an_archive(tmp_path):
+    path = tmp_path / 'other.gz'
+    with gzip.open(path, 'wt') as f:
+        f.write('{"something": 1}\n')
+
+    with pytest.raises(ValueError):
+        ScanArchive.load(str(path))
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_record_and_replay(httpserver, local_test_db, tmp_path):
+    site_result_except(httpserver, 'claimed', status=200, response_data='user')
+    path = str(tmp_path / 'scan.jsonl.gz')
+    logger = logging.getLogger('maigret')
+    sites = local_test_db.sites_dict
+
+    recorder = ArchiveWriter(path)
+    recorded = await maigret(
+        'claimed', sites, logger, timeout=5, wrap_checker=recorder.wrap
+    )
+    recorder.close()
+    assert recorder.count == 2
+    archive = ScanArchive.load(path)
+    exchange = next(iter(archive.exchanges.values()))[0]
+    assert ['Content-Type', 'text/plain; charset=utf-8'] in exchange['response_headers']
+
+    httpserver.clear()
+    replay = ReplayChecker(ScanArchive.load(path), time_scale=0)
+    started_at = time.monotonic()
+    replayed = await maigret('claimed', sites, logger, wrap_checker=replay.wrap)
+    assert time.monotonic() - started_at < 1
+    assert len(httpserver.log) == 0
+
+    for name, result in recorded.items():
+        assert result['status'].status == MaigretCheckStatus.CLAIMED
+        assert replayed[name]['status'].status == result['status'].status
+        assert replayed[name]['http_status'] == result['http_status']
+
+    # requests out of the archive are not sent to network
+    results = await maigret('unclaimed', sites, logger, wrap_checker=replay.wrap)
+    assert all(r['status'].error.type == 'Replay' for r in results.values())
+    assert replay.missing == 2
@@ -2,6 +2,7 @@
 
 import copy
 import json
+import logging
 import os
 import pytest
 from io import StringIO
@@ -9,12 +10,19 @@ from io import StringIO
 import xmind
 from jinja2 import Template
 
+from maigret.checking import maigret
 from maigret.report import (
+    CsvReportWriter,
+    JsonReportWriter,
+    ReportWriter,
+    TxtReportWriter,
+    open_report_writers,
     generate_csv_report,
     generate_txt_report,
     save_xmind_report,
     save_html_report,
     save_pdf_report,
+    save_graph_report,
     generate_report_template,
     generate_report_context,
     generate_json_report,
@@ -23,7 +31,6 @@ from maigret.report import (
 from maigret.result import MaigretCheckResult, MaigretCheckStatus
 from maigret.sites import MaigretSite
 
-
 GOOD_RESULT = MaigretCheckResult('', '', '', MaigretCheckStatus.CLAIMED)
 BAD_RESULT = MaigretCheckResult('', '', '', MaigretCheckStatus.AVAILABLE)
 
@@ -365,6 +372,95 @@ def test_generate_json_ndjson_report():
     assert json.loads(data[0])['sitename'] == 'GitHub'
 
 
+def test_generate_json_simple_report_is_json_dumps():
+    jsonfile = StringIO()
+    results = {f'GitHub{i}': EXAMPLE_RESULTS['GitHub'] for i in range(120)}
+    generate_json_report('test', results, jsonfile, 'simple')
+
+    # encoded entry by entry as json.dumps of the whole object
+    data = json.loads(jsonfile.getvalue())
+    assert list(data) == list(results)
+    assert jsonfile.getvalue() == json.dumps(data)
+
+
+def test_streaming_reports_are_always_complete(tmp_path):
+    tpl = str(tmp_path / 'report_{username}{postfix}')
+    writers = open_report_writers(
+        tpl, 'te/st', csv_report=True, txt_report=True, json_report='simple'
+    )
+    csv_writer, txt_writer, json_writer = writers
+    assert isinstance(csv_writer, CsvReportWriter)
+    assert isinstance(txt_writer, TxtReportWriter)
+    assert isinstance(json_writer, JsonReportWriter)
+    with pytest.raises(TypeError):
+        ReportWriter('test', StringIO())
+    assert json_writer.filename.endswith('report_te_st_simple.json')
+
+    # reports on disk before the first check
+    assert json.load(open(json_writer.filename)) == {}
+    assert open(txt_writer.filename).read() == 'Total Websites Username Detected On : 0'
+
+    for writer in writers:
+        writer.flush_rows = 1
+
+    for i in range(5):
+        for writer in writers:
+            writer.add(f'GitHub{i}', EXAMPLE_RESULTS['GitHub'])
+            writer.add(f'Broken{i}', BROKEN_RESULTS['GitHub'])
+
+        # valid reports of all the flushed rows, e.g. after a crash
+        data = json.load(open(json_writer.filename))
+        assert list(data) == [f'GitHub{j}' for j in range(i + 1)]
+        lines = open(txt_writer.filename).read().splitlines()
+        assert lines[-1] == f'Total Websites Username Detected On : {i + 1}'
+        assert len(open(csv_writer.filename).readlines()) == 1 + 2 * (i + 1)
+
+    for writer in writers:
+        writer.close()
+
+    json_report = StringIO()
+    generate_json_report(
+        'te_st',
+        {f'GitHub{i}': EXAMPLE_RESULTS['GitHub'] for i in range(5)},
+        json_report,
+        'simple',
+    )
+    assert open(json_writer.filename).read() == json_report.getvalue()
+    assert len(open(txt_writer.filename).readlines()) == 6
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_reports_written_during_search(httpserver, local_test_db, tmp_path):
+    httpserver.expect_request('/url', query_string='id=claimed').respond_with_data(
+        'user', status=200
+    )
+    tpl = str(tmp_path / 'report_{username}{postfix}')
+    writers = open_report_writers(tpl, 'claimed', csv_report=True)
+    written = []
+
+    def on_result(sitename, site_result):
+        written.append(sitename)
+        for writer in writers:
+            writer.add(sitename, site_result)
+
+    results = await maigret(
+        'claimed',
+        local_test_db.sites_dict,
+        logging.getLogger('maigret'),
+        timeout=5,
+        on_result=on_result,
+    )
+    # rows are on disk before the end of the search
+    assert len(open(writers[0].filename).readlines()) == 1
+    writers[0].close()
+
+    assert sorted(written) == sorted(results)
+    rows = open(writers[0].filename).read().splitlines()[1:]
+    assert sorted(r.split(',')[1] for r in rows) == sorted(results)
+    assert all(',Claimed,200' in r for r in rows)
+
+
 def test_save_xmind_report():
     filename = 'report_test.xmind'
     save_xmind_report(filename, 'test', EXAMPLE_RESULTS)
@@ -426,6 +522,15 @@ def test_html_report_broken():
     assert SUPPOSED_BROKEN_INTERESTS in report_text
 
 
+def test_graph_report(tmp_path, monkeypatch, default_db):
+    monkeypatch.chdir(tmp_path)
+    save_graph_report('report_test.html', copy.deepcopy(TEST), default_db)
+
+    assert os.path.exists('report_test.html')
+    # scripts of the graph are in the report, not in a folder next to it
+    assert not os.path.exists('lib')
+
+
 @pytest.mark.skip(reason='connection reset, fixme')
 def test_pdf_report():
     report_name = 'report_test.pdf'
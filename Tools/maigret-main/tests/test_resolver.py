@@ -0,0 +1,171 @@
+"""Maigret DNS check engine test functions"""
+
+import asyncio
+import logging
+import time
+
+import pytest
+
+from maigret.checking import maigret
+from maigret.resolver import RECORD_TYPES, DnsResolver
+from maigret.result import MaigretCheckStatus
+from maigret.sites import MaigretSite
+
+RECORDS = {
+    ('soxoj.test', 'A'): (120, ['10.0.0.1', '10.0.0.2']),
+    ('v6.test', 'AAAA'): (60, ['2001:db8::1']),
+    ('alias.test', 'CNAME'): (60, ['target.example']),
+    # not cached by c-ares itself
+    ('fresh.test', 'A'): (0, ['10.0.0.3']),
+}
+
+
+def make_resolver(server, **kwargs):
+    return DnsResolver(nameservers=[server.address], timeout=1, tries=1, **kwargs)
+
+
+def make_dns_sites():
+    return {
+        name: MaigretSite(
+            name,
+            {
+                'protocol': 'dns',
+                'url': name,
+                'urlMain': name,
+                'checkType': 'status_code',
+                'usernameClaimed': 'soxoj',
+                'usernameUnclaimed': 'noonewouldeverusethis7',
+            },
+        )
+        for name in ('{username}.test', '{username}.example')
+    }
+
+
+@pytest.mark.asyncio
+async def test_resolve_and_cache(dns_server):
+    server = await dns_server(records=RECORDS)
+    resolver = make_resolver(server)
+
+    answer = await resolver.resolve('SoxoJ.test.')
+    assert answer.found
+    assert answer.address == '10.0.0.1'
+    assert answer.records == {'A': ['10.0.0.1', '10.0.0.2']}
+
+    missing = await resolver.resolve('missing.test')
+    assert not missing.found and missing.error is None
+
+    # both answers are cached, the missing domain too
+    assert await resolver.resolve('soxoj.test') is answer
+    assert await resolver.resolve('missing.test') is missing
+    assert server.queries == [('soxoj.test', 'A'), ('missing.test', 'A')]
+    assert resolver.stats()['cache_hits'] == 2
+
+    # expired answers are queried again
+    fresh = await resolver.resolve('fresh.test')
+    fresh.expires_at = time.monotonic() - 1
+    assert (await resolver.resolve('fresh.test')).address == '10.0.0.3'
+    assert server.queries[2:] == [('fresh.test', 'A')] * 2
+    await resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_ttl_bounds(dns_server):
+    server = await dns_server(records=RECORDS)
+    resolver = make_resolver(server, min_ttl=300, negative_ttl=10, max_ttl=60)
+    now = time.monotonic()
+
+    answer = await resolver.resolve('soxoj.test')
+    missing = await resolver.resolve('missing.test')
+    assert now + 60 <= answer.expires_at < now + 70
+    assert now + 60 <= missing.expires_at < now + 70
+    await resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_queries_deduplicated(dns_server):
+    server = await dns_server(records=RECORDS)
+    resolver = make_resolver(server)
+
+    answers = await asyncio.gather(*[resolver.resolve('soxoj.test') for _ in range(50)])
+    assert all(a is answers[0] for a in answers)
+    assert server.queries == [('soxoj.test', 'A')]
+    assert resolver.stats()['deduplicated'] == 49
+    await resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_failures_are_not_cached(dns_server):
+    server = await dns_server(servfail=['broken.test'])
+    resolver = make_resolver(server)
+
+    answer = await resolver.resolve('broken.test')
+    assert not answer.found
+    assert answer.error.type == 'DNS resolve error'
+    await resolver.resolve('broken.test')
+    assert server.queries == [('broken.test', 'A')] * 2
+    assert resolver.stats()['errors'] == 2
+    await resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_extra_record_types(dns_server):
+    server = await dns_server(records=RECORDS)
+    resolver = make_resolver(server, record_types=RECORD_TYPES)
+
+    assert (await resolver.resolve('v6.test')).records == {'AAAA': ['2001:db8::1']}
+    assert (await resolver.resolve('alias.test')).address == 'target.example'
+    # nonexistent domains aren't queried for other records
+    assert not (await resolver.resolve('missing.test')).found
+    assert server.queries == [
+        ('v6.test', 'A'),
+        ('v6.test', 'AAAA'),
+        ('alias.test', 'A'),
+        ('alias.test', 'AAAA'),
+        ('alias.test', 'CNAME'),
+        ('missing.test', 'A'),
+    ]
+
+    with pytest.raises(ValueError):
+        DnsResolver(record_types=('MX',))
+    await resolver.close()
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_domains_scan(dns_server):
+    server = await dns_server(records=RECORDS)
+    sites = make_dns_sites()
+    resolver = make_resolver(server)
+
+    results = await maigret(
+        'soxoj',
+        sites,
+        logging.getLogger('maigret'),
+        timeout=5,
+        no_progressbar=True,
+        check_domains=True,
+        dns_resolver=resolver,
+    )
+
+    assert results['{username}.test']['status'].status == MaigretCheckStatus.CLAIMED
+    assert (
+        results['{username}.example']['status'].status == MaigretCheckStatus.AVAILABLE
+    )
+    # the shared resolver isn't closed by the scan
+    assert resolver._resolver is not None
+    await resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_domains_are_not_checked():
+    # a resolver isn't made without check_domains
+    results = await maigret(
+        'soxoj',
+        make_dns_sites(),
+        logging.getLogger('maigret'),
+        timeout=5,
+        no_progressbar=True,
+        dns_options={'max_queries': 10},
+    )
+
+    assert len(results) == 2
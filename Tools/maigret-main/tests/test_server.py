@@ -0,0 +1,190 @@
+"""Maigret scan service test functions"""
+
+import asyncio
+import json
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from maigret.checking import ProxyPool, TorCircuitPool
+from maigret.server import (
+    JOB_EVENTS_BUFFER_SIZE,
+    SUBSCRIBER_QUEUE_SIZE,
+    ScanJob,
+    ScanService,
+    make_app,
+)
+
+
+def site_result_except(server, username, **kwargs):
+    query = f'id={username}'
+    server.expect_request('/url', query_string=query).respond_with_data(**kwargs)
+
+
+@pytest.fixture
+async def service_client(local_test_db):
+    service = ScanService(local_test_db, timeout=5, max_connections=4)
+    client = TestClient(TestServer(make_app(service)))
+    await client.start_server()
+    yield client
+    await client.close()
+
+
+async def wait_for_scan(client, job_id):
+    for _ in range(100):
+        resp = await client.get(f'/api/scans/{job_id}')
+        data = await resp.json()
+        if data['status'] in ('completed', 'failed'):
+            return data
+        await asyncio.sleep(0.05)
+    raise AssertionError('Scan is not finished')
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_service_scan_and_cache(httpserver, service_client):
+    site_result_except(httpserver, 'claimed', status=200, response_data='user')
+
+    resp = await service_client.post('/api/scans', json={'username': 'claimed'})
+    assert resp.status == 202
+    job_id = (await resp.json())['id']
+
+    data = await wait_for_scan(service_client, job_id)
+    assert data['status'] == 'completed'
+    assert data['found'] == {'claimed': ['Message', 'StatusCode']}
+    assert data['results']['claimed']['StatusCode']['status'] == 'Claimed'
+
+    requests_count = len(httpserver.log)
+
+    # the second scan is served from the results cache
+    resp = await service_client.post('/api/scans', json={'usernames': ['claimed']})
+    data = await wait_for_scan(service_client, (await resp.json())['id'])
+    assert data['found'] == {'claimed': ['Message', 'StatusCode']}
+    assert len(httpserver.log) == requests_count
+
+    # results without parsing are not used for scans with it
+    resp = await service_client.post(
+        '/api/scans', json={'username': 'claimed', 'parsing': True}
+    )
+    data = await wait_for_scan(service_client, (await resp.json())['id'])
+    assert data['found'] == {'claimed': ['Message', 'StatusCode']}
+    assert len(httpserver.log) > requests_count
+
+    resp = await service_client.get('/api/status')
+    stats = await resp.json()
+    assert stats['sites'] == 2
+    assert stats['jobs'] == {'completed': 3}
+    assert stats['cache']['hits'] == 2
+    assert stats['concurrency']['in_flight'] == 0
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_service_scan_events(httpserver, service_client):
+    site_result_except(httpserver, 'unclaimed', status=404, response_data='404')
+
+    resp = await service_client.post('/api/scans', json={'username': 'unclaimed'})
+    job_id = (await resp.json())['id']
+
+    resp = await service_client.get(f'/api/scans/{job_id}/events')
+    assert resp.headers['Content-Type'] == 'text/event-stream'
+    body = await resp.text()
+    events = [
+        line.split(': ', 1)[1] for line in body.splitlines() if line.startswith('event')
+    ]
+    assert events == ['started', 'result', 'result', 'finished', 'done']
+
+    ws = await service_client.ws_connect(f'/api/scans/{job_id}/ws')
+    messages = [json.loads(msg.data) async for msg in ws]
+    assert [m['event'] for m in messages] == events
+    assert messages[1]['data']['status'] == 'Available'
+
+
+@pytest.mark.asyncio
+async def test_service_bad_requests(service_client):
+    resp = await service_client.post('/api/scans', data='not json')
+    assert resp.status == 400
+
+    resp = await service_client.post('/api/scans', json={'usernames': []})
+    assert resp.status == 400
+    assert 'username' in (await resp.json())['error']
+
+    resp = await service_client.post(
+        '/api/scans', json={'username': 'test', 'id_type': 'unknown'}
+    )
+    assert resp.status == 400
+
+    for key in ('tags', 'sites'):
+        resp = await service_client.post(
+            '/api/scans', json={'username': 'test', key: 'coding'}
+        )
+        assert resp.status == 400
+        assert key in (await resp.json())['error']
+
+    resp = await service_client.get('/api/scans/unknown')
+    assert resp.status == 404
+
+
+@pytest.mark.asyncio
+async def test_service_scan_options(local_test_db, monkeypatch):
+    calls = []
+
+    async def fake_maigret(**kwargs):
+        calls.append(kwargs)
+        return {}
+
+    monkeypatch.setattr('maigret.server.maigret', fake_maigret)
+    service = ScanService(
+        local_test_db,
+        proxy=['http://127.0.0.1:8080', 'socks5://127.0.0.1:1080'],
+        tor_proxy='socks5://127.0.0.1:9050',
+        tor_circuits=2,
+    )
+    await service.start()
+    try:
+        assert service.is_checkable('tor')
+        assert not service.is_checkable('i2p')
+        assert not service.is_checkable('dns')
+
+        job = ScanJob(['test'], service.parse_request({'username': 'test'})[1])
+        await service.scan_username(job, 'test')
+        kwargs = calls[0]
+        # proxy pools are kept between scans
+        assert isinstance(kwargs['proxy'], ProxyPool)
+        assert isinstance(kwargs['tor_proxy'], TorCircuitPool)
+        assert kwargs['proxy'] is service.proxy
+        assert not kwargs['check_domains']
+    finally:
+        await service.close()
+
+
+def test_job_events_are_capped():
+    job = ScanJob(['test'], {})
+    for i in range(JOB_EVENTS_BUFFER_SIZE * 2):
+        job.publish('result', {'i': i})
+    job.finish('completed')
+
+    assert len(job.events) == JOB_EVENTS_BUFFER_SIZE
+    queue = job.subscribe()
+    assert queue.qsize() == JOB_EVENTS_BUFFER_SIZE + 1
+    assert job.events[-1][0] == 'done'
+
+
+def test_slow_subscriber_is_disconnected():
+    job = ScanJob(['test'], {})
+    slow = job.subscribe()
+    for i in range(SUBSCRIBER_QUEUE_SIZE * 2):
+        job.publish('result', {'i': i})
+
+    assert slow.qsize() == SUBSCRIBER_QUEUE_SIZE
+    events = [slow.get_nowait() for _ in range(SUBSCRIBER_QUEUE_SIZE)]
+    # the stream is ended after the events which fit into the queue
+    assert events[-1] is None
+    assert events[-2] == ('result', {'i': SUBSCRIBER_QUEUE_SIZE - 2})
+
+    fast = job.subscribe()
+    while not fast.empty():
+        fast.get_nowait()
+    job.finish('completed')
+    assert fast.get_nowait()[0] == 'done'
+    assert fast.get_nowait() is None
@@ -0,0 +1,107 @@
+"""Maigret search results storage test functions"""
+
+import copy
+import gc
+import json
+import tracemalloc
+
+from maigret.report import generate_report_context, get_plaintext_report
+from maigret.result import MaigretCheckResult, MaigretCheckStatus
+from maigret.sites import MaigretSite
+from maigret.storage import ResultStore, compact_results
+from tests.test_report import TEST
+
+
+def test_compact_results():
+    results = copy.deepcopy(TEST[1][2])
+    results['Reddit']['site'] = MaigretSite('Reddit', {})
+    results['Reddit']['future'] = object()
+    compact = compact_results(results)
+
+    # only found accounts, without live objects
+    assert list(compact) == ['Reddit', 'Instagram']
+    assert set(compact['Reddit']) == {
+        'url_main',
+        'url_user',
+        'http_status',
+        'is_similar',
+        'rank',
+        'ids_usernames',
+        'status',
+    }
+    assert json.loads(json.dumps(compact)) == compact
+
+
+def test_result_from_json():
+    result = MaigretCheckResult(
+        'alice', 'GitHub', 'https://github.com/alice', MaigretCheckStatus.CLAIMED
+    )
+    result.ids_data = {'fullname': 'Alice'}
+    result.tags = ['coding']
+    copied = MaigretCheckResult.from_json(result.json())
+    assert copied.json() == result.json()
+    assert copied.status is MaigretCheckStatus.CLAIMED
+
+
+def test_store_reports(tmp_path):
+    expected = generate_report_context(copy.deepcopy(TEST))
+
+    for max_in_memory in (10, 1):
+        path = str(tmp_path / f'results_{max_in_memory}.jsonl')
+        store = ResultStore(path, max_in_memory=max_in_memory)
+        for username, id_type, results in copy.deepcopy(TEST):
+            store.add(username, id_type, results)
+        assert store.spilled == (max_in_memory == 1)
+
+        context = generate_report_context(store)
+        for key in ('username', 'brief', 'supposed_data', 'countries_tuple_list'):
+            assert context[key] == expected[key]
+        assert get_plaintext_report(context) == get_plaintext_report(expected)
+
+        # rendering reads the results again
+        username, id_type, results = store[1]
+        assert (username, id_type) == ('alexaimephotography', 'username')
+        assert results['Reddit']['found']
+        assert results['Reddit']['status'].ids_data['reddit_id'] == 't5_1nytpy'
+        store.close()
+
+    with open(path) as f:
+        assert len(f.readlines()) == len(TEST)
+
+
+def test_store_memory_is_flat():
+    results = {
+        f'site{i}': {
+            'url_user': f'https://site{i}.com/alice',
+            'site': MaigretSite(f'site{i}', {}),
+            'status': MaigretCheckResult(
+                'alice',
+                f'site{i}',
+                f'https://site{i}.com/alice',
+                (
+                    MaigretCheckStatus.CLAIMED
+                    if i % 10 == 0
+                    else MaigretCheckStatus.AVAILABLE
+                ),
+                ids_data={'bio': 'x' * 1000},
+            ),
+        }
+        for i in range(500)
+    }
+    store = ResultStore(max_in_memory=2)
+
+    def used_memory(usernames):
+        gc.collect()
+        tracemalloc.start()
+        for i in range(usernames):
+            store.add(f'alice{i}', 'username', results)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size
+
+    used_memory(10)
+    # index of usernames only
+    assert used_memory(200) < 100 * 1024
+    assert len(store) == 210
+    assert len(store[209][2]) == 50
+    store.close()
@@ -0,0 +1,160 @@
+"""Maigret compressed transfers test functions"""
+
+import gzip
+import zlib
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from maigret import transfer
+from maigret.checking import SimpleAiohttpChecker
+from maigret.transfer import (
+    ACCEPT_ENCODING,
+    DecodingError,
+    ResponseBody,
+    TransferStats,
+    decode_content,
+    encode_marker,
+    format_size,
+)
+
+BODY = b'<html>user profile</html>' * 100
+
+
+def test_decode_content():
+    assert decode_content(BODY, '') == BODY
+    assert decode_content(BODY, 'identity') == BODY
+    assert decode_content(gzip.compress(BODY), 'gzip') == BODY
+    assert decode_content(gzip.compress(BODY), 'X-Gzip') == BODY
+    assert decode_content(zlib.compress(BODY), 'deflate') == BODY
+    # raw deflate without zlib header
+    raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    assert decode_content(raw.compress(BODY) + raw.flush(), 'deflate') == BODY
+    # encodings are applied in the listed order
+    assert decode_content(gzip.compress(zlib.compress(BODY)), 'deflate, gzip') == BODY
+    assert decode_content(gzip.compress(BODY), 'gzip', max_size=10) == BODY[:10]
+
+    with pytest.raises(DecodingError):
+        decode_content(BODY, 'gzip')
+    with pytest.raises(DecodingError):
+        decode_content(BODY, 'compress')
+
+
+@pytest.mark.skipif(not transfer.brotli, reason='brotli is not installed')
+def test_decode_brotli():
+    assert 'br' in ACCEPT_ENCODING
+    compressed = transfer.brotli.compress(BODY)
+    assert decode_content(compressed, 'br') == BODY
+    # decompression is stopped at the limit
+    bomb = transfer.brotli.compress(b'\0' * 100 * 1024 * 1024, quality=1)
+    assert decode_content(bomb, 'br', max_size=1024) == b'\0' * 1024
+
+    with pytest.raises(DecodingError):
+        decode_content(BODY, 'br')
+
+
+def test_encode_marker():
+    assert encode_marker('profile', 'UTF-8') == b'profile'
+    assert encode_marker('profile', 'utf-8-sig') == b'profile'
+    assert encode_marker('Профиль', 'utf-8') == 'Профиль'.encode()
+    assert encode_marker('Профиль', 'windows-1251') == 'Профиль'.encode('cp1251')
+    # ASCII bytes may be parts of multibyte characters
+    assert encode_marker('profile', 'shift_jis') is None
+    assert encode_marker('日本', 'cp1251') is None
+    assert encode_marker('profile', 'unknown') is None
+
+
+def test_response_body():
+    body = ResponseBody('Профиль: alice'.encode('koi8-r'), 'koi8-r')
+    assert 'Профиль' in body
+    assert 'alice' in body
+    assert 'bob' not in body
+    assert body._text is None
+
+    assert body == 'Профиль: alice'
+    assert str(body) == 'Профиль: alice'
+    assert body and len(body) == 14
+    assert not ResponseBody(b'')
+
+    body = ResponseBody(b'<h1>alice</h1>')
+    assert 'Профиль' not in body
+    assert body.is_ascii and body._text is None
+
+    # pages with BOM
+    body = ResponseBody('\ufeffПрофиль: alice'.encode('utf-8'), 'utf-8-sig')
+    assert 'Профиль' in body
+    assert 'alice' in body
+    assert 'bob' not in body
+    assert body._text is None
+
+    # decoded text is searched for other charsets
+    body = ResponseBody('プロフィール alice'.encode('shift_jis'), 'shift_jis')
+    assert 'alice' in body and 'プロフィール' in body
+    assert body._text is not None
+    assert ResponseBody(b'alice', 'unknown-charset') == 'alice'
+
+
+def test_transfer_stats():
+    transfer = TransferStats()
+    transfer.add('https://a.com/user1', 100, 400)
+    transfer.add('https://A.com/user2', 100, 400)
+    transfer.add('https://b.com/user1', 300, 200)
+
+    assert transfer.hosts['a.com'] == [2, 200, 800]
+    assert transfer.top_hosts(1) == [('b.com', 300, 200)]
+    assert transfer.saved_ratio == 0.5
+    assert transfer.summary() == (
+        '500 B transferred, 1000 B decoded (50% saved by compression) in 3 responses'
+    )
+
+    transfer.disable_compression('https://b.com/')
+    assert transfer.accept_encoding('https://b.com/user2') == 'identity'
+    assert transfer.accept_encoding('https://a.com/user2') == ACCEPT_ENCODING
+    assert format_size(1536) == '1.5 KB'
+    assert format_size(3 * 1024**3) == '3 GB'
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_compressed_responses():
+    accept_encodings = []
+
+    async def handler(request):
+        accept_encodings.append(request.headers.get('Accept-Encoding'))
+        if 'gzip' not in request.headers.get('Accept-Encoding', ''):
+            return web.Response(body=BODY)
+        body = gzip.compress(BODY)
+        if request.path == '/broken':
+            body = BODY
+        return web.Response(body=body, headers={'Content-Encoding': 'gzip'})
+
+    app = web.Application()
+    app.router.add_get('/user', handler)
+    app.router.add_get('/broken', handler)
+    server = TestServer(app, host='127.0.0.1')
+    await server.start_server()
+    transfer = TransferStats()
+    checker = SimpleAiohttpChecker(transfer=transfer)
+
+    checker.prepare(
+        str(server.make_url('/user')), headers={'Accept-Encoding': ACCEPT_ENCODING}
+    )
+    assert await checker.check() == (BODY.decode(), 200, None)
+    assert transfer.wire_bytes < transfer.decoded_bytes == len(BODY)
+
+    # a mis-encoded body fails the check, the site gets uncompressed ones then
+    checker.prepare(str(server.make_url('/broken')))
+    text, status, error = await checker.check()
+    assert error.type == 'Bad encoding'
+    checker.prepare(str(server.make_url('/broken')))
+    assert await checker.check() == (BODY.decode(), 200, None)
+    host = server.make_url('/').raw_authority
+    await server.close()
+
+    assert accept_encodings[-1] == 'identity'
+    assert transfer.responses == 2
+    assert transfer.hosts[host][1:] == [
+        len(gzip.compress(BODY)) + len(BODY),
+        2 * len(BODY),
+    ]
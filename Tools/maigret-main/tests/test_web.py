@@ -0,0 +1,291 @@
+"""Maigret web interface test functions"""
+
+import asyncio
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+from maigret.errors import CheckError
+from maigret.result import MaigretCheckResult, MaigretCheckStatus
+from maigret.web import app as web_app
+from maigret.web.autocomplete import SiteIndex
+from maigret.web.jobs import (
+    JobProgress,
+    QueueFullError,
+    SearchWorkerPool,
+    SharedDatabase,
+)
+from maigret.web.reports import JobReports, UnknownReportError
+from maigret.web.store import JobStore
+from tests.conftest import LOCAL_TEST_JSON_FILE
+from tests.test_report import EXAMPLE_RESULTS
+
+
+def test_shared_database_reload(tmp_path):
+    db_file = str(tmp_path / 'data.json')
+    shutil.copy(LOCAL_TEST_JSON_FILE, db_file)
+
+    shared_db = SharedDatabase(db_file)
+    db = shared_db.get()
+    assert len(db.sites) == 2
+    assert shared_db.get() is db
+
+    with open(db_file) as f:
+        data = f.read()
+    with open(db_file, 'w') as f:
+        f.write(data.replace('"Message"', '"Message2"'))
+    os.utime(db_file, (0, os.path.getmtime(db_file) + 10))
+
+    reloaded_db = shared_db.get()
+    assert reloaded_db is not db
+    assert 'Message2' in reloaded_db.sites_dict
+
+
+def test_search_worker_pool_admission():
+    pool = SearchWorkerPool(max_workers=1, max_queued=1)
+    release = threading.Event()
+    loops = []
+
+    async def job(n):
+        loops.append(asyncio.get_running_loop())
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        return n
+
+    futures = [pool.submit(job, 1), pool.submit(job, 2)]
+    with pytest.raises(QueueFullError):
+        pool.submit(job, 3)
+
+    release.set()
+    assert [f.result(timeout=5) for f in futures] == [1, 2]
+    # all jobs are executed in the same persistent event loop
+    assert len(set(loops)) == 1
+
+    assert pool.submit(job, 4).result(timeout=5) == 4
+    assert pool.running == 0 and pool.queued == 0
+    pool.shutdown()
+
+
+def test_job_reports_lazy_rendering(tmp_path, local_test_db):
+    folder = str(tmp_path / 'search')
+    reports = JobReports(folder, [('test', 'username', EXAMPLE_RESULTS)], local_test_db)
+    assert not os.path.exists(folder)
+
+    csv_path = reports.get('csv', 'test')
+    assert csv_path == os.path.join(folder, 'report_test.csv')
+    assert 'https://www.github.com/test' in open(csv_path).read()
+
+    html_path = reports.get('html')
+    assert 'GitHub' in open(html_path).read()
+    context = reports.context
+
+    # rendered reports are cached on disk, the context is computed once
+    mtime = os.path.getmtime(html_path)
+    assert reports.get('html') == html_path
+    assert os.path.getmtime(html_path) == mtime
+    assert reports.context is context
+    assert sorted(os.listdir(folder)) == ['report.html', 'report_test.csv']
+
+    with pytest.raises(UnknownReportError):
+        reports.get('exe')
+    with pytest.raises(UnknownReportError):
+        reports.get('json', '../test')
+
+
+def make_check_result(site_name, status, error=None):
+    return MaigretCheckResult(
+        'test', site_name, f'https://{site_name}/test', status, error=error
+    )
+
+
+def test_job_progress_events():
+    progress = JobProgress(buffer_size=3)
+    progress.start('test', 3)
+    progress.update('test', make_check_result('GitHub', MaigretCheckStatus.CLAIMED))
+    progress.update(
+        'test',
+        make_check_result(
+            'Reddit', MaigretCheckStatus.UNKNOWN, CheckError('Request timeout')
+        ),
+    )
+
+    last_id, state = progress.snapshot()
+    assert state['usernames']['test']['done'] == 2
+    assert state['usernames']['test']['errors'] == {'Request timeout': 1}
+    assert state['usernames']['test']['found'] == [
+        {'site_name': 'GitHub', 'url': 'https://GitHub/test'}
+    ]
+
+    progress.update('test', make_check_result('VK', MaigretCheckStatus.AVAILABLE))
+    events = progress.wait_events(last_id, timeout=0)
+    assert [(e[0], e[1]) for e in events] == [(last_id + 1, 'progress')]
+    assert events[0][2]['done'] == 3
+
+    progress.finish('completed')
+    assert progress.wait_events(last_id + 1, timeout=1)[0][1] == 'done'
+    # events before the ring buffer are dropped, only a snapshot is possible
+    assert progress.wait_events(0, timeout=0) is None
+
+
+def test_status_events_stream():
+    progress = JobProgress()
+    progress.start('test', 1)
+    progress.update('test', make_check_result('GitHub', MaigretCheckStatus.CLAIMED))
+    progress.finish('completed')
+    web_app.background_jobs['stream_test'] = {'completed': True, 'progress': progress}
+
+    client = web_app.app.test_client()
+    try:
+        response = client.get('/status/stream_test/events')
+        assert response.mimetype == 'text/event-stream'
+        body = response.get_data(as_text=True)
+        assert body.startswith('id: 4\nevent: snapshot\n')
+        assert '"site_name": "GitHub"' in body
+
+        response = client.get(
+            '/status/stream_test/events', headers={'Last-Event-ID': '1'}
+        )
+        events = [
+            line.split(': ', 1)[1]
+            for line in response.get_data(as_text=True).splitlines()
+            if line.startswith('event')
+        ]
+        assert events == ['found', 'progress', 'done']
+
+        assert client.get('/status/unknown/events').status_code == 404
+    finally:
+        del web_app.background_jobs['stream_test']
+
+
+def test_job_store(tmp_path, local_test_db):
+    reports_folder = str(tmp_path)
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'), reports_folder)
+
+    job_id = store.create_job(['test', 'other'], {'top_sites': '500'})
+    other_id = store.create_job(['test@example.com'], {}, id_type='email')
+    assert other_id != job_id
+    assert store.get_job(job_id)['status'] == 'running'
+    assert store.get_job(job_id)['usernames'] == ['test', 'other']
+
+    results = dict(EXAMPLE_RESULTS)
+    results['Reddit'] = {
+        'url_user': 'https://www.reddit.com/test',
+        'status': make_check_result(
+            'Reddit', MaigretCheckStatus.UNKNOWN, CheckError('Request timeout')
+        ),
+    }
+    store.finish_job(job_id, [('test', 'username', results), ('other', 'gaia_id', {})])
+
+    job = store.get_job(job_id)
+    assert job['status'] == 'completed'
+    assert job['options'] == {'top_sites': '500'}
+    assert job['id_types'] == {'test': 'username', 'other': 'gaia_id'}
+    assert store.get_job(other_id)['id_types'] == {'test@example.com': 'email'}
+    assert len(store.get_site_results(job_id, 'Unknown')) == 1
+    assert store.get_claimed_profiles(job_id) == {
+        'test': [
+            {
+                'site_name': 'GitHub',
+                'url': 'https://www.github.com/test',
+                'tags': ['test_tag'],
+            }
+        ]
+    }
+
+    # results are restored in the search format, e.g. after restart
+    restored = JobStore(str(tmp_path / 'jobs.sqlite3')).load_results(
+        job_id, local_test_db
+    )
+    assert [(u, t, len(r)) for u, t, r in restored] == [
+        ('test', 'username', 2),
+        ('other', 'gaia_id', 0),
+    ]
+    github = restored[0][2]['GitHub']
+    assert github['status'].is_found()
+    assert github['status'].tags == ['test_tag']
+    assert github['status'].error is None
+    assert github['http_status'] == 200
+    error = restored[0][2]['Reddit']['status'].error
+    assert (error.type, error.desc) == ('Request timeout', '')
+
+    store.fail_interrupted_jobs()
+    assert store.get_job(other_id)['status'] == 'failed'
+
+    os.makedirs(store.report_folder(job_id))
+    assert store.cleanup(retention=3600) == 0
+    assert store.cleanup(retention=-1) == 2
+    assert store.get_job(job_id) is None
+    assert store.get_site_results(job_id) == []
+    assert not os.path.exists(store.report_folder(job_id))
+
+
+@pytest.mark.slow
+def test_web_search_flow(httpserver, tmp_path, monkeypatch):
+    httpserver.expect_request('/url', query_string='id=claimed').respond_with_data(
+        'user profile', status=200
+    )
+    monkeypatch.setattr(web_app, 'shared_db', SharedDatabase(LOCAL_TEST_JSON_FILE))
+    monkeypatch.setattr(
+        web_app,
+        'job_store',
+        JobStore(str(tmp_path / 'jobs.sqlite3'), str(tmp_path)),
+    )
+    client = web_app.app.test_client()
+
+    response = client.post('/search', data={'usernames': 'claimed'})
+    assert response.status_code == 302
+    job_id = response.location.rsplit('/', 1)[1]
+
+    for _ in range(300):
+        if web_app.job_store.get_job(job_id)['status'] != 'running':
+            break
+        time.sleep(0.1)
+
+    response = client.get(f'/status/{job_id}')
+    assert response.location.endswith(f'/results/{job_id}')
+
+    response = client.get(f'/results/{job_id}')
+    assert b'StatusCode' in response.data
+
+    response = client.get(f'/reports/{job_id}/csv/claimed')
+    assert b'http://localhost:8989/url?id=claimed' in response.data
+    response.close()
+    assert os.path.exists(tmp_path / f'search_{job_id}' / 'report_claimed.csv')
+
+    assert client.get(f'/reports/{job_id}/csv/unknown').status_code == 404
+    assert client.get('/reports/unknown/csv/claimed').status_code == 404
+
+
+def test_site_index_search(default_db):
+    index = SiteIndex(default_db)
+    assert len(index) > len(default_db.sites)
+
+    results = index.search('github', limit=5)
+    assert results[0] == 'GitHub'
+    assert len(results) == 5
+    assert all('github' in r.lower() for r in results)
+
+    # URLs are matched without a scheme, substrings go after prefixes
+    assert 'https://www.reddit.com/' in index.search('reddit.com')
+    assert 'GitHub' in index.search('ithu', limit=50)
+    assert index.search('') == []
+    assert index.search('no-such-site-at-all') == []
+
+
+def test_sites_autocomplete_endpoint(monkeypatch):
+    monkeypatch.setattr(web_app, 'shared_db', SharedDatabase(LOCAL_TEST_JSON_FILE))
+    monkeypatch.setattr(web_app, 'site_index', None)
+    client = web_app.app.test_client()
+
+    response = client.get('/api/sites?q=status')
+    assert response.json == {'query': 'status', 'results': ['StatusCode']}
+    etag = response.headers['ETag']
+
+    response = client.get('/api/sites?q=status', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+    response = client.get('/api/sites?q=mess', headers={'If-None-Match': etag})
+    assert response.json['results'] == ['Message']
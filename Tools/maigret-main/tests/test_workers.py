@@ -0,0 +1,55 @@
+"""Maigret multi-process scanning test functions"""
+
+import logging
+
+import pytest
+
+from maigret.result import MaigretCheckStatus
+from maigret.workers import ShardedScanner, make_chunks
+
+
+def site_result_except(server, username, **kwargs):
+    query = f'id={username}'
+    server.expect_request('/url', query_string=query).respond_with_data(**kwargs)
+
+
+def test_make_chunks():
+    names = [str(i) for i in range(1000)]
+
+    chunks = make_chunks(names, 4)
+    assert sum(chunks, []) == names
+    assert len(chunks) == 32
+
+    # chunks are small enough to balance load between workers
+    chunks = make_chunks(names, 1)
+    assert max(len(c) for c in chunks) == 50
+
+    assert make_chunks(names[:3], 16) == [['0'], ['1'], ['2']]
+
+
+@pytest.mark.slow
+@pytest.mark.asyncio
+async def test_sharded_scanner(httpserver, local_test_db):
+    site_result_except(httpserver, 'claimed', status=200, response_data='user')
+    site_result_except(httpserver, 'unclaimed', status=404, response_data='404')
+
+    scanner = ShardedScanner(
+        local_test_db, 2, logging.getLogger('maigret'), timeout=5, max_connections=4
+    )
+    assert scanner.worker_connections == 2
+
+    try:
+        sites = local_test_db.sites_dict
+        results = await scanner.search('claimed', sites, no_progressbar=True)
+        assert list(results) == list(sites)
+        for name, result in results.items():
+            assert result['status'].status == MaigretCheckStatus.CLAIMED
+            assert result['site'] is sites[name]
+
+        results = await scanner.search('unclaimed', sites, no_progressbar=True)
+        assert all(
+            r['status'].status == MaigretCheckStatus.AVAILABLE
+            for r in results.values()
+        )
+    finally:
+        scanner.close()
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""Maigret: offline benchmark
+
+Starts a local "site farm" in a separate process: it serves synthetic
+profile and not found pages for URL patterns of every site of the database,
+with configurable latency, body sizes, error pages, redirects and hanging
+requests. Then runs `maigret()` searches end-to-end with all hostnames
+resolved to the farm, and reports sites/sec, latency percentiles, CPU time
+and peak RSS of the scanning process.
+
+    python3 -m utils.benchmark --top-sites 500 --save-baseline main
+    python3 -m utils.benchmark --top-sites 500 --compare main
+
+Outcome of each (site, username) pair is derived from the seed, so runs
+with the same options make the same requests and get the same pages.
+"""
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import re
+import resource
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from aiohttp import ClientSession, TCPConnector, web
+from aiohttp.abc import AbstractResolver
+
+from maigret.checking import maigret
+from maigret.errors import COMMON_ERRORS
+from maigret.sites import MaigretDatabase, MaigretSite
+
+DEFAULT_DB = os.path.join('maigret', 'resources', 'data.json')
+BASELINES_DIR = '.benchmarks'
+USERNAME_MARK = 'maigretfarmusername'
+HOP_PARAM = 'maigret_farm_hop'
+USERNAME_RE = '(?P<username>[^/?&#]*)'
+
+PAGE_TEMPLATE = (
+    '<html><head><title>{title}</title></head><body>{body}<div>{filler}</div>'
+    '</body></html>'
+)
+FILLER = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>'
+
+
+class LatencyModel:
+    """
+    Response delay distribution:
+        fixed:SECONDS
+        uniform:MIN:MAX
+        lognormal:MEDIAN:SIGMA
+    """
+
+    def __init__(self, spec: str):
+        kind, *params = spec.split(':')
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        expected = {'fixed': 1, 'uniform': 2, 'lognormal': 2}
+        if expected.get(kind) != len(self.params):
+            raise ValueError(f'Invalid latency distribution "{spec}"')
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'fixed':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return rng.uniform(*self.params)
+        median, sigma = self.params
+        return rng.lognormvariate(math.log(median), sigma)
+
+
+def parse_size_range(spec: str) -> Tuple[int, int]:
+    low, _, high = spec.partition('-')
+    return int(low), int(high or low)
+
+
+def site_url_patterns(site: MaigretSite) -> List[str]:
+    """URLs of a site requested by maigret, with the username mark"""
+    urls = []
+    url = site.url.format(
+        urlMain=site.url_main, urlSubpath=site.url_subpath, username=USERNAME_MARK
+    )
+    urls.append(re.sub("(?<!:)/+", "/", url))
+    if site.url_probe:
+        urls.append(
+            site.url_probe.format(
+                urlMain=site.url_main,
+                urlSubpath=site.url_subpath,
+                username=USERNAME_MARK,
+            )
+        )
+    return urls
+
+
+class SiteFarm:
+    """Synthetic pages for all sites of the database"""
+
+    def __init__(
+        self,
+        db: MaigretDatabase,
+        latency: str = 'lognormal:0.05:0.6',
+        body_size: str = '2000-100000',
+        claimed_ratio: float = 0.05,
+        error_ratio: float = 0.02,
+        redirect_ratio: float = 0.05,
+        timeout_ratio: float = 0.01,
+        hang_time: float = 60,
+        seed: int = 0,
+    ):
+        self.latency = LatencyModel(latency)
+        self.body_size = parse_size_range(body_size)
+        self.claimed_ratio = claimed_ratio
+        self.error_ratio = error_ratio
+        self.redirect_ratio = redirect_ratio
+        self.timeout_ratio = timeout_ratio
+        self.hang_time = hang_time
+        self.seed = seed
+        self.error_pages = [
+            flag for flag in COMMON_ERRORS if COMMON_ERRORS[flag].type != 'Resolving'
+        ]
+        self.stats: Dict[str, int] = {}
+
+        # host -> [(regex, site)], and hosts with the username in them
+        self.routes: Dict[str, List[Tuple[Any, MaigretSite]]] = {}
+        self.wildcard_routes: List[Tuple[Any, MaigretSite]] = []
+        for site in db.sites:
+            for url in site_url_patterns(site):
+                self._add_route(url, site)
+
+    def _add_route(self, url: str, site: MaigretSite):
+        parts = urlsplit(url)
+        target = parts.netloc.lower() + (parts.path or '/')
+        if parts.query:
+            target += '?' + parts.query
+        pattern = re.escape(target).replace(USERNAME_MARK, USERNAME_RE)
+        regex = re.compile(pattern + r'/?(?:[?&#].*)?', re.IGNORECASE)
+
+        if USERNAME_MARK in parts.netloc:
+            self.wildcard_routes.append((regex, site))
+        else:
+            self.routes.setdefault(parts.netloc.lower(), []).append((regex, site))
+
+    def match(self, host: str, path_qs: str) -> Tuple[Optional[MaigretSite], str]:
+        target = host.lower() + path_qs
+        candidates = self.routes.get(host.lower(), [])
+        for regex, site in candidates + self.wildcard_routes:
+            match = regex.fullmatch(target)
+            if match:
+                return site, match.group('username')
+        # unusual encoding of the URL, the host is still enough
+        if candidates:
+            return candidates[0][1], ''
+        return None, ''
+
+    def _count(self, key: str):
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    def page(self, rng: random.Random, title: str, text: str) -> str:
+        size = rng.randint(*self.body_size)
+        filler = FILLER * max(0, (size - len(text)) // len(FILLER))
+        return PAGE_TEMPLATE.format(title=title, body=text, filler=filler)
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        hop = HOP_PARAM in request.query
+        path_qs = request.raw_path.split(f'{HOP_PARAM}=')[0].rstrip('?&')
+        site, username = self.match(request.host.split(':')[0], path_qs)
+        if not site:
+            self._count('unknown')
+            return web.Response(status=404, text='Unknown site')
+
+        rng = random.Random(f'{self.seed}:{site.name}:{username}')
+        is_claimed = username == site.username_claimed or (
+            rng.random() < self.claimed_ratio
+        )
+        outcome = rng.random()
+        await asyncio.sleep(self.latency.sample(rng))
+
+        if outcome < self.timeout_ratio:
+            self._count('timeout')
+            await asyncio.sleep(self.hang_time)
+        outcome -= self.timeout_ratio
+
+        if outcome < self.error_ratio:
+            self._count('error')
+            text = rng.choice(self.error_pages)
+            return web.Response(
+                status=403, text=self.page(rng, 'Error', text), content_type='text/html'
+            )
+        outcome -= self.error_ratio
+
+        if outcome < self.redirect_ratio and not hop and site.check_type != 'response_url':
+            self._count('redirect')
+            separator = '&' if '?' in request.raw_path else '?'
+            raise web.HTTPFound(f'{request.raw_path}{separator}{HOP_PARAM}=1')
+
+        self._count('claimed' if is_claimed else 'not_found')
+        if is_claimed:
+            text = site.presense_strs[0] if site.presense_strs else 'Profile'
+            return web.Response(
+                text=self.page(rng, username, text), content_type='text/html'
+            )
+
+        if site.check_type == 'response_url':
+            raise web.HTTPFound(site.url_main)
+        if site.check_type == 'status_code':
+            status, text = 404, 'Page not found'
+        else:
+            status = 200
+            text = site.absence_strs[0] if site.absence_strs else 'Nothing here'
+        return web.Response(
+            status=status, text=self.page(rng, 'Not found', text), content_type='text/html'
+        )
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', self.handle)
+        return app
+
+
+def make_ssl_context(folder: str) -> Optional[ssl.SSLContext]:
+    """Self-signed certificate for HTTPS sites, clients don't verify it"""
+    cert, key = os.path.join(folder, 'farm.crt'), os.path.join(folder, 'farm.key')
+    try:
+        subprocess.run(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+             '-subj', '/CN=maigret-farm', '-keyout', key, '-out', cert],
+            check=True,
+            capture_output=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.error(f'No certificate for HTTPS sites: {e}')
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def run_farm(db_file: str, farm_options: Dict[str, Any], connection):
+    """Farm process: serves sites until terminated, sends its ports and stats"""
+
+    async def serve():
+        db = MaigretDatabase().load_from_path(db_file)
+        farm = SiteFarm(db, **farm_options)
+        runner = web.AppRunner(farm.make_app(), access_log=None)
+        await runner.setup()
+
+        ports = {}
+        with tempfile.TemporaryDirectory() as folder:
+            for scheme, ssl_context in (
+                ('http', None),
+                ('https', make_ssl_context(folder)),
+            ):
+                if scheme == 'https' and not ssl_context:
+                    continue
+                site = web.TCPSite(runner, '127.0.0.1', 0, ssl_context=ssl_context)
+                await site.start()
+                ports[scheme] = site._server.sockets[0].getsockname()[1]
+
+        connection.send(ports)
+        loop = asyncio.get_running_loop()
+        # any message is a request for the farm stats
+        while await loop.run_in_executor(None, connection.recv):
+            connection.send(farm.stats)
+        await runner.cleanup()
+
+    asyncio.run(serve())
+
+
+class FarmResolver(AbstractResolver):
+    """Resolves every hostname to the farm"""
+
+    def __init__(self, ports: Dict[str, int]):
+        self.ports = ports
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        farm_port = self.ports['https'] if port == 443 else self.ports['http']
+        return [
+            {
+                'hostname': host,
+                'host': '127.0.0.1',
+                'port': farm_port,
+                'family': socket.AF_INET,
+                'proto': 0,
+                'flags': socket.AI_NUMERICHOST,
+            }
+        ]
+
+    async def close(self):
+        pass
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def run_scans(args, ports: Dict[str, int]) -> Dict[str, Any]:
+    db = MaigretDatabase().load_from_path(args.db_file)
+    sites = db.ranked_sites_dict(top=args.top_sites, tags=args.tags)
+    logger = logging.getLogger('maigret')
+    logger.setLevel(logging.CRITICAL)
+
+    connector = TCPConnector(
+        ssl=False, limit=args.connections, resolver=FarmResolver(ports)
+    )
+    session = ClientSession(connector=connector)
+
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    checks = 0
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    try:
+        for username in args.usernames:
+            results = await maigret(
+                username,
+                dict(sites),
+                logger,
+                timeout=args.timeout,
+                max_connections=args.connections,
+                is_parsing_enabled=args.parsing,
+                no_progressbar=True,
+                session=session,
+            )
+            for result in results.values():
+                status = result['status']
+                checks += 1
+                statuses[str(status.status)] = statuses.get(str(status.status), 0) + 1
+                # timeouts and errors are counted in statuses
+                if status.query_time and not status.error:
+                    latencies.append(status.query_time)
+    finally:
+        await session.close()
+    duration = time.perf_counter() - start
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu_time = (usage_after.ru_utime - usage_before.ru_utime) + (
+        usage_after.ru_stime - usage_before.ru_stime
+    )
+    # kilobytes on Linux, bytes on macOS
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'checks': checks,
+        'duration': round(duration, 3),
+        'sites_per_sec': round(checks / duration, 1),
+        'latency_p50': round(percentile(latencies, 50), 4),
+        'latency_p99': round(percentile(latencies, 99), 4),
+        'cpu_time': round(cpu_time, 3),
+        'peak_rss_mb': round(usage_after.ru_maxrss * rss_unit / 2**20, 1),
+        'statuses': statuses,
+    }
+
+
+# metric, is a bigger value better
+COMPARED_METRICS = [
+    ('sites_per_sec', True),
+    ('latency_p50', False),
+    ('latency_p99', False),
+    ('cpu_time', False),
+    ('peak_rss_mb', False),
+]
+
+
+def compare(metrics: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """Print changes against the baseline, returns False on regressions"""
+    ok = True
+    print(f"{'metric':<15} {'baseline':>10} {'current':>10} {'change':>9}")
+    for name, bigger_is_better in COMPARED_METRICS:
+        old, new = baseline['metrics'][name], metrics[name]
+        change = (new - old) / old * 100 if old else 0.0
+        regression = -change if bigger_is_better else change
+        mark = ''
+        if regression > threshold:
+            mark = '  REGRESSION'
+            ok = False
+        print(f'{name:<15} {old:>10} {new:>10} {change:>+8.1f}%{mark}')
+    return ok
+
+
+def baseline_path(args, name: str) -> str:
+    return os.path.join(args.baselines_dir, f'{name}.json')
+
+
+def main():
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--db', dest='db_file', default=DEFAULT_DB)
+    parser.add_argument('--top-sites', type=int, default=500)
+    parser.add_argument('--tags', type=lambda x: x.split(','), default=[])
+    parser.add_argument('--usernames', nargs='+', default=['johndoe', 'janedoe'])
+    parser.add_argument('--connections', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=5)
+    parser.add_argument('--parsing', action='store_true', help='extract ids')
+    parser.add_argument(
+        '--latency', default='lognormal:0.05:0.6',
+        help='fixed:S, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA, seconds',
+    )
+    parser.add_argument('--body-size', default='2000-100000', help='bytes, MIN-MAX')
+    parser.add_argument('--claimed-ratio', type=float, default=0.05)
+    parser.add_argument('--error-ratio', type=float, default=0.02)
+    parser.add_argument('--redirect-ratio', type=float, default=0.05)
+    parser.add_argument('--timeout-ratio', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baselines-dir', default=BASELINES_DIR)
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    parser.add_argument(
+        '--max-regression', type=float, default=15,
+        help='percents of change of a metric to fail the comparison',
+    )
+    args = parser.parse_args()
+
+    farm_options = {
+        'latency': args.latency,
+        'body_size': args.body_size,
+        'claimed_ratio': args.claimed_ratio,
+        'error_ratio': args.error_ratio,
+        'redirect_ratio': args.redirect_ratio,
+        'timeout_ratio': args.timeout_ratio,
+        'hang_time': args.timeout * 2,
+        'seed': args.seed,
+    }
+    LatencyModel(args.latency)
+
+    context = multiprocessing.get_context('spawn')
+    connection, farm_connection = context.Pipe()
+    farm = context.Process(
+        target=run_farm, args=(args.db_file, farm_options, farm_connection), daemon=True
+    )
+    farm.start()
+    try:
+        ports = connection.recv()
+        metrics = asyncio.run(run_scans(args, ports))
+        connection.send(True)
+        farm_stats = connection.recv()
+        connection.send(False)
+    finally:
+        farm.join(timeout=5)
+        if farm.is_alive():
+            farm.terminate()
+
+    print(json.dumps(metrics, indent=4))
+    print('farm responses:', json.dumps(farm_stats, sort_keys=True))
+
+    options = {k: v for k, v in vars(args).items() if k not in ('save_baseline', 'compare')}
+    if args.save_baseline:
+        os.makedirs(args.baselines_dir, exist_ok=True)
+        with open(baseline_path(args, args.save_baseline), 'w') as f:
+            json.dump({'options': options, 'metrics': metrics}, f, indent=4)
+        print(f'Baseline is saved to {baseline_path(args, args.save_baseline)}')
+
+    if args.compare:
+        with open(baseline_path(args, args.compare)) as f:
+            baseline = json.load(f)
+        changed = [
+            k for k, v in baseline['options'].items() if options.get(k) != v
+        ]
+        if changed:
+            print(f'Warning: options differ from the baseline: {changed}')
+        if not compare(metrics, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
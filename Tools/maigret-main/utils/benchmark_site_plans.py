@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Maigret: benchmark of site requests building in scans
+
+Searches a list of usernames on the sites database through `maigret.search`
+without network (every checker is replaced by a mock), with site plans
+compiled for every username (as before plans were shared) and once for
+the whole scan, as main() and the scan service do.
+
+    python3 -m utils.benchmark_site_plans --sites 3000 --usernames 100
+"""
+import asyncio
+import logging
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from os import path
+
+from maigret import search
+from maigret.checking import CheckerMock
+from maigret.sites import MaigretDatabase
+
+DB_FILE = path.join(
+    path.dirname(path.dirname(path.realpath(__file__))),
+    'maigret',
+    'resources',
+    'data.json',
+)
+
+
+def without_network(checker) -> CheckerMock:
+    return CheckerMock()
+
+
+async def run_scan(sites, usernames, shared: bool) -> float:
+    logger = logging.getLogger('maigret')
+    site_plans = {} if shared else None
+    started_at = time.perf_counter()
+    for username in usernames:
+        await search(
+            username=username,
+            site_dict=sites,
+            logger=logger,
+            timeout=10,
+            # build requests of disabled sites too
+            forced=True,
+            no_progressbar=True,
+            wrap_checker=without_network,
+            site_plans=site_plans,
+        )
+    return time.perf_counter() - started_at
+
+
+def main():
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--sites', type=int, default=3000)
+    parser.add_argument('--usernames', type=int, default=100)
+    parser.add_argument('--db', default=DB_FILE, help='Sites database file')
+    args = parser.parse_args()
+
+    logging.getLogger('maigret').setLevel(logging.ERROR)
+    db = MaigretDatabase().load_from_path(args.db)
+    sites = {site.name: site for site in db.sites[: args.sites]}
+    usernames = [f'user_{i}.test' for i in range(args.usernames)]
+    checks_count = len(sites) * len(usernames)
+    print(f'{len(sites)} sites x {len(usernames)} usernames')
+
+    results = {}
+    for name, shared in (('per username', False), ('per scan', True)):
+        spent = asyncio.run(run_scan(sites, usernames, shared))
+        results[name] = spent
+        print(
+            f'plans compiled {name:<12} {spent:>7.2f}s '
+            f'{spent / checks_count * 1e6:>7.2f} us/check'
+        )
+
+    print(f"speedup: {results['per username'] / results['per scan']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
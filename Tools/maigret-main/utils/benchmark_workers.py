@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Maigret: scaling benchmark of multi-process scanning
+
+Starts a local stand-in server for a generated sites database and measures
+scans speed with different numbers of worker processes.
+
+    python3 -m utils.benchmark_workers --sites 2000 --workers 1 2 4 8 16
+"""
+import asyncio
+import logging
+import random
+import time
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+from aiohttp import web
+
+from maigret.checking import maigret
+from maigret.sites import MaigretDatabase
+from maigret.workers import ShardedScanner
+
+HOST = '127.0.0.1'
+
+PAGE_TEMPLATE = '<html><head><title>{title}</title></head><body>{body}</body></html>'
+
+
+def make_app(page_size: int, max_delay: float) -> web.Application:
+    filler = '<p>' + 'lorem ipsum dolor sit amet ' * (page_size // 27) + '</p>'
+    found = PAGE_TEMPLATE.format(title='profile', body='user profile' + filler)
+    not_found = PAGE_TEMPLATE.format(title='error', body='not found' + filler)
+
+    async def handler(request):
+        await asyncio.sleep(random.uniform(0, max_delay))
+        if request.match_info['username'].startswith('claimed'):
+            return web.Response(text=found, content_type='text/html')
+        return web.Response(text=not_found, status=404, content_type='text/html')
+
+    app = web.Application()
+    app.router.add_get('/{site}/{username}', handler)
+    return app
+
+
+def make_db(sites_count: int, port: int) -> MaigretDatabase:
+    sites = {}
+    for i in range(sites_count):
+        sites[f'Site{i}'] = {
+            'checkType': 'message',
+            'url': f'http://{HOST}:{port}/site{i}/{{username}}',
+            'urlMain': f'http://{HOST}:{port}/',
+            'presenseStrs': ['user profile'],
+            'absenseStrs': ['not found'],
+            'usernameClaimed': 'claimed',
+            'usernameUnclaimed': 'unclaimed',
+            'alexaRank': i + 1,
+        }
+    return MaigretDatabase().load_from_json({'engines': {}, 'sites': sites})
+
+
+async def run_benchmark(args):
+    runner = web.AppRunner(make_app(args.page_size, args.max_delay))
+    await runner.setup()
+    site = web.TCPSite(runner, HOST, args.port)
+    await site.start()
+
+    db = make_db(args.sites, args.port)
+    logger = logging.getLogger('maigret')
+    usernames = [f'claimed{i}' for i in range(args.usernames)]
+    search_kwargs = dict(
+        timeout=args.timeout,
+        max_connections=args.connections,
+        is_parsing_enabled=True,
+    )
+    checks = len(usernames) * args.sites
+
+    print(f'{args.sites} sites, {len(usernames)} usernames, {checks} checks')
+    print(f"{'workers':>8} {'seconds':>9} {'sites/sec':>10}")
+
+    try:
+        for workers in args.workers:
+            scanner = None
+            if workers > 1:
+                scanner = ShardedScanner(db, workers, logger, **search_kwargs)
+                # start worker processes before measuring
+                warmup_sites = dict(list(db.sites_dict.items())[: workers * 8])
+                await scanner.search('warmup', warmup_sites, no_progressbar=True)
+
+            start = time.perf_counter()
+            for username in usernames:
+                if scanner:
+                    await scanner.search(username, db.sites_dict, no_progressbar=True)
+                else:
+                    await maigret(
+                        username,
+                        db.sites_dict,
+                        logger,
+                        no_progressbar=True,
+                        **search_kwargs,
+                    )
+            duration = time.perf_counter() - start
+
+            if scanner:
+                scanner.close()
+
+            print(f'{workers:>8} {duration:>9.2f} {checks / duration:>10.1f}')
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--sites', type=int, default=1000, help='sites count')
+    parser.add_argument('--usernames', type=int, default=2, help='usernames count')
+    parser.add_argument(
+        '--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16],
+        help='numbers of worker processes to compare',
+    )
+    parser.add_argument('--connections', type=int, default=100)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--page-size', type=int, default=50000, help='bytes')
+    parser.add_argument(
+        '--max-delay', type=float, default=0.05, help='server response delay, seconds'
+    )
+    parser.add_argument('--port', type=int, default=8990)
+
+    asyncio.run(run_benchmark(parser.parse_args()))